@@ -1,46 +1,392 @@
-from math import log
+import hmac
 import urllib
-import requests
 import logging
-import msal
 
-from fastapi import APIRouter, HTTPException
+from datetime import datetime
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from starlette.requests import Request
-from starlette.responses import RedirectResponse, HTMLResponse
+from starlette.responses import (
+    HTMLResponse, JSONResponse, PlainTextResponse, RedirectResponse, Response, StreamingResponse
+)
 
-from app.models.email import EmailSendRequest, EmailResponse
+from app.dependencies import (
+    get_attachment_repository, get_email_repository, get_email_service, get_mailbox_repository, get_mailbox_scheduler,
+    get_notification_worker, get_outbound_attachments, get_outbound_repository, get_response_cache,
+    get_search_backend, get_send_worker_pool, get_token_cache
+)
+from app.exceptions import GraphAPIError
+from app.models.attachment import AttachmentResponse
+from app.models.email import (
+    BodyStorageReport, EmailBatchSendRequest, EmailBatchSendResponse, EmailPage, EmailSearchHit, EmailSearchResponse,
+    EmailSendRequest, OutboundEmailResponse, OutboundEmailStatus, StagedAttachmentResponse, StoredEmail
+)
+from app.models.mailbox import MailboxRequest, MailboxResponse
+from app.repositories.attachment_repository import AttachmentRepository
+from app.repositories.email_repository import EmailRepository, InvalidCursorError
+from app.repositories.mailbox_repository import MailboxRepository
+from app.repositories.outbound_repository import OutboundEmailRepository
+from app.schedulers.scheduler import MailboxScheduler
+from app.services.attachment_store import create_attachment_store
+from app.services.email_export import EXPORT_MEDIA_TYPES, EXPORT_NDJSON, EXPORT_SSE, export_stream, parse_export_fields
 from app.services.email_service import EmailService
-from typing import Any, List
+from app.services.outbound_attachments import OutboundAttachmentStore
+from app.services.response_cache import ALL_MAILBOXES, ResponseCache, encode_json, etag_response
+from app.services.search_backend import SearchBackend
+from app.workers.notification_worker import NotificationWorker
+from app.workers.send_worker import SendWorkerPool
+from typing import Any, Dict, List, Optional
 
-from app.services.token_service import token_cache
+from app.services.token_service import TokenCache
+from app.startup import startup_state
 from config import settings
 
 router = APIRouter()
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-@router.post("/email/send", response_model=EmailResponse)
-async def send_email_route(email_request: EmailSendRequest):
+@router.post("/email/send", response_model=OutboundEmailResponse, status_code=202)
+async def send_email_route(
+    email_request: EmailSendRequest,
+    outbound_repository: OutboundEmailRepository = Depends(get_outbound_repository),
+    outbound_attachments: OutboundAttachmentStore = Depends(get_outbound_attachments),
+    send_worker_pool: SendWorkerPool = Depends(get_send_worker_pool)
+):
+    """
+    Queue an email for sending through Microsoft Graph API. The email is sent
+    by the send workers; poll GET /email/send/{id} for its status.
+    """
+    try:
+        _check_staged_attachments([email_request], outbound_attachments)
+        # A soft limit: concurrent requests may all pass the count before inserting
+        if await outbound_repository.count_queued_async() >= settings.SEND_QUEUE_MAX_DEPTH:
+            raise HTTPException(status_code=429, detail="Send queue is full, retry later.")
+        queue_id = await outbound_repository.enqueue_async(email_request)
+        send_worker_pool.notify()
+        return OutboundEmailResponse(id=queue_id, status=OutboundEmailStatus.PENDING)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/email/send/{queue_id}", response_model=OutboundEmailResponse)
+async def send_email_status_route(
+    queue_id: str, outbound_repository: OutboundEmailRepository = Depends(get_outbound_repository)
+):
+    """
+    Report the status of a queued email
+    """
+    queued = await outbound_repository.get_async(queue_id)
+    if queued is None:
+        raise HTTPException(status_code=404, detail="Queued email not found.")
+    return OutboundEmailResponse(
+        id=str(queued["_id"]),
+        status=queued["status"],
+        attempts=queued.get("attempts", 0),
+        parts_sent=queued.get("parts_sent", 0),
+        error=queued.get("error"),
+        created_at=queued.get("created_at"),
+        updated_at=queued.get("updated_at")
+    )
+
+@router.post("/email/send/batch", response_model=EmailBatchSendResponse)
+async def send_email_batch_route(
+    batch_request: EmailBatchSendRequest,
+    email_service: EmailService = Depends(get_email_service),
+    outbound_attachments: OutboundAttachmentStore = Depends(get_outbound_attachments)
+):
     """
-    Send an email using Microsoft Graph API
+    Send many emails using Microsoft Graph API JSON batching
     """
+    _check_staged_attachments(batch_request.messages, outbound_attachments)
     try:
-        result = EmailService().send_email(email_request)
-        return {"message": result}
+        results = await email_service.send_batch(batch_request.messages)
+        sent = sum(1 for result in results if result.success)
+        return EmailBatchSendResponse(sent=sent, failed=len(results) - sent, results=results)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.get("/email/retrieve", response_model=List[Any])
-async def retrieve_emails_route():
+@router.post("/email/attachments", response_model=StagedAttachmentResponse, status_code=201)
+async def upload_attachment_route(
+    request: Request, store: OutboundAttachmentStore = Depends(get_outbound_attachments)
+):
+    """
+    Upload a file to attach to outbound emails. The request body is the raw
+    file content and is streamed to disk; reference the returned file_id in
+    the attachments of a send request.
     """
-    Manually trigger email retrieval from Microsoft Graph API
+    store.purge_expired()
+    file_id, size = await store.save(request.stream())
+    return StagedAttachmentResponse(file_id=file_id, size=size)
+
+def _check_staged_attachments(email_requests: List[EmailSendRequest], store: OutboundAttachmentStore):
+    for email_request in email_requests:
+        for attachment in email_request.attachments:
+            if attachment.file_id is not None and not store.exists(attachment.file_id):
+                raise HTTPException(status_code=400, detail=f"Unknown attachment file_id {attachment.file_id}.")
+
+@router.get("/email/retrieve", response_model=Dict[str, Any])
+async def retrieve_emails_route(
+    request: Request,
+    email_service: EmailService = Depends(get_email_service),
+    response_cache: ResponseCache = Depends(get_response_cache)
+):
+    """
+    Manually trigger email retrieval from Microsoft Graph API. Repeated calls
+    within RESPONSE_CACHE_RETRIEVE_TTL seconds return the previous result
+    without calling Graph.
     """
     try:
-        emails = EmailService().retrieve_emails()
-        return emails
+        return await response_cache.respond(
+            request, email_service.retrieve_emails, scope=None, ttl=settings.RESPONSE_CACHE_RETRIEVE_TTL
+        )
+    except GraphAPIError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/emails", response_model=EmailPage, response_model_exclude_none=True)
+async def list_emails_route(
+    request: Request,
+    sender: Optional[str] = None,
+    recipient: Optional[str] = None,
+    mailbox: Optional[str] = None,
+    received_after: Optional[datetime] = None,
+    received_before: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(25, ge=1, le=100),
+    include_body: bool = False,
+    email_repository: EmailRepository = Depends(get_email_repository),
+    response_cache: ResponseCache = Depends(get_response_cache)
+):
+    """
+    List stored emails newest first. Pass the returned next_cursor to get the
+    following page.
+    """
+    async def page():
+        documents, next_cursor = await email_repository.find_emails_async(
+            sender=sender,
+            recipient=recipient,
+            mailbox=mailbox,
+            received_after=received_after,
+            received_before=received_before,
+            cursor=cursor,
+            limit=limit,
+            include_body=include_body
+        )
+        return EmailPage(items=[_stored_email(document) for document in documents], next_cursor=next_cursor)
+
+    try:
+        return await response_cache.respond(request, page, scope=mailbox or ALL_MAILBOXES, exclude_none=True)
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/emails/search", response_model=EmailSearchResponse, response_model_exclude_none=True)
+async def search_emails_route(
+    request: Request,
+    q: str = Query(..., min_length=1),
+    mailbox: Optional[str] = None,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(25, ge=1, le=100),
+    search_backend: SearchBackend = Depends(get_search_backend),
+    response_cache: ResponseCache = Depends(get_response_cache)
+):
+    """
+    Search the subjects and bodies of stored emails, best match first
+    """
+    async def results():
+        documents, has_more = await search_backend.search(q, mailbox=mailbox, offset=offset, limit=limit)
+        return EmailSearchResponse(
+            items=[_stored_email(document, EmailSearchHit) for document in documents],
+            next_offset=offset + limit if has_more else None
+        )
+
+    return await response_cache.respond(request, results, scope=mailbox or ALL_MAILBOXES, exclude_none=True)
+
+@router.get("/emails/export")
+async def export_emails_route(
+    request: Request,
+    sender: Optional[str] = None,
+    recipient: Optional[str] = None,
+    mailbox: Optional[str] = None,
+    received_after: Optional[datetime] = None,
+    received_before: Optional[datetime] = None,
+    fields: Optional[str] = Query(None, description="Comma-separated fields to export, all by default"),
+    export_format: Optional[str] = Query(None, alias="format", regex="^(ndjson|sse)$"),
+    email_repository: EmailRepository = Depends(get_email_repository)
+):
+    """
+    Stream stored emails newest first as NDJSON (default) or server-sent
+    events (format=sse or Accept: text/event-stream)
+    """
+    try:
+        selected = parse_export_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if export_format is None:
+        export_format = EXPORT_SSE if "text/event-stream" in request.headers.get("accept", "") else EXPORT_NDJSON
+    documents = email_repository.export_emails_async(
+        selected,
+        sender=sender,
+        recipient=recipient,
+        mailbox=mailbox,
+        received_after=received_after,
+        received_before=received_before
+    )
+    return StreamingResponse(export_stream(documents, export_format), media_type=EXPORT_MEDIA_TYPES[export_format])
+
+@router.get("/emails/storage-report", response_model=BodyStorageReport)
+async def body_storage_report_route(email_repository: EmailRepository = Depends(get_email_repository)):
+    """
+    Report the bytes taken by stored email bodies and saved by compression
+    and GridFS offloading
+    """
+    return await email_repository.body_storage_report_async()
+
+@router.get("/emails/{email_id}", response_model=StoredEmail)
+async def get_email_route(
+    email_id: str, request: Request, email_repository: EmailRepository = Depends(get_email_repository)
+):
+    """
+    Get one stored email with its body. A single lookup by id is not cached,
+    but the ETag still saves sending the body again.
+    """
+    document = await email_repository.get_email_async(email_id)
+    if document is None:
+        raise HTTPException(status_code=404, detail="Email not found.")
+    return etag_response(request, encode_json(_stored_email(document)))
+
+@router.get("/emails/{email_id}/attachments", response_model=List[AttachmentResponse])
+async def list_attachments_route(
+    email_id: str, attachment_repository: AttachmentRepository = Depends(get_attachment_repository)
+):
+    """
+    List the stored attachments of an email
+    """
+    documents = await attachment_repository.list_attachments_async(email_id)
+    return [AttachmentResponse(**document) for document in documents]
+
+@router.get("/emails/{email_id}/attachments/{attachment_id}/content")
+async def download_attachment_route(
+    email_id: str, attachment_id: str, attachment_repository: AttachmentRepository = Depends(get_attachment_repository)
+):
+    """
+    Stream the content of a stored attachment
+    """
+    document = await attachment_repository.get_attachment_async(email_id, attachment_id)
+    if document is None:
+        raise HTTPException(status_code=404, detail="Attachment not found.")
+    store = create_attachment_store(document.get("storage"))
+    return StreamingResponse(
+        store.open(document["sha256"]),
+        media_type=document.get("content_type") or "application/octet-stream",
+        headers={
+            "Content-Length": str(document["size"]),
+            "Content-Disposition": f"attachment; filename*=UTF-8''{urllib.parse.quote(document['name'])}"
+        }
+    )
+
+def _stored_email(document: dict, model=StoredEmail):
+    fields = {key: value for key, value in document.items() if key in model.__fields__ and key != "id"}
+    return model(id=str(document["_id"]), **fields)
+
+
+@router.post("/mailboxes", response_model=MailboxResponse, status_code=201)
+async def add_mailbox_route(
+    mailbox_request: MailboxRequest,
+    mailbox_repository: MailboxRepository = Depends(get_mailbox_repository),
+    mailbox_scheduler: MailboxScheduler = Depends(get_mailbox_scheduler)
+):
+    """
+    Register a mailbox for scheduled email retrieval
+    """
+    mailbox = await mailbox_repository.add_mailbox_async(mailbox_request.address)
+    mailbox_scheduler.request_sync()
+    return _mailbox_response(mailbox)
+
+@router.get("/mailboxes", response_model=List[MailboxResponse])
+async def list_mailboxes_route(mailbox_repository: MailboxRepository = Depends(get_mailbox_repository)):
+    """
+    List the registered mailboxes and the state of their last retrieval run
+    """
+    return [_mailbox_response(mailbox) for mailbox in await mailbox_repository.list_mailboxes_async()]
+
+@router.delete("/mailboxes/{address}", status_code=204)
+async def remove_mailbox_route(
+    address: str,
+    mailbox_repository: MailboxRepository = Depends(get_mailbox_repository),
+    mailbox_scheduler: MailboxScheduler = Depends(get_mailbox_scheduler)
+):
+    """
+    Stop scheduled email retrieval for a mailbox
+    """
+    if not await mailbox_repository.disable_mailbox_async(address):
+        raise HTTPException(status_code=404, detail="Mailbox not found.")
+    mailbox_scheduler.request_sync()
+
+def _mailbox_response(mailbox: dict) -> MailboxResponse:
+    fields = {key: value for key, value in mailbox.items() if key in MailboxResponse.__fields__}
+    return MailboxResponse(address=mailbox["_id"], **fields)
+
+
+@router.post("/notifications")
+async def notifications_route(
+    request: Request, notification_worker: NotificationWorker = Depends(get_notification_worker)
+):
+    """
+    Receive Microsoft Graph change notifications. Answers the subscription
+    validation handshake and queues notified messages for the notification worker.
+    """
+    if not settings.WEBHOOK_CLIENT_STATE:
+        # Without the secret notifications cannot be told apart from forged ones
+        raise HTTPException(status_code=403, detail="Change notifications require WEBHOOK_CLIENT_STATE.")
+    validation_token = request.query_params.get("validationToken")
+    if validation_token is not None:
+        return PlainTextResponse(validation_token)
+
+    payload = await request.json()
+    for notification in payload.get("value", []):
+        if not hmac.compare_digest(str(notification.get("clientState") or ""), settings.WEBHOOK_CLIENT_STATE):
+            logger.warning(f"Ignoring notification with invalid clientState for {notification.get('subscriptionId')}")
+            continue
+        email_id = (notification.get("resourceData") or {}).get("id")
+        if not email_id:
+            continue
+        if not notification_worker.enqueue(notification.get("subscriptionId"), email_id):
+            # Graph delivers the notification again later
+            raise HTTPException(status_code=503, detail="Notification queue is full.")
+    return Response(status_code=202)
+
+
+@router.get("/healthz", include_in_schema=False)
+async def liveness_route():
+    """
+    Liveness probe: the process is up and its event loop responsive
+    """
+    return {"status": "ok"}
+
+@router.get("/readyz", include_in_schema=False)
+async def readiness_route():
+    """
+    Readiness probe: 503 until MongoDB answered and the background services
+    started
+    """
+    status_code = 200 if startup_state.ready else 503
+    body = {"status": "ready" if startup_state.ready else "starting", "checks": startup_state.checks()}
+    if startup_state.error and not startup_state.ready:
+        body["error"] = startup_state.error
+    return JSONResponse(body, status_code=status_code)
+
+@router.get("/metrics", include_in_schema=False)
+def metrics_route():
+    """
+    Prometheus metrics in the text exposition format
+    """
+    if not settings.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled.")
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 
 # Step 1: Redirect to Microsoft's login page
 @router.get("/auth/login")
@@ -59,11 +405,14 @@ async def login():
 
 # Step 2: Handle callback and exchange code for access token
 @router.get("/auth/callback")
-async def auth_callback(request: Request):
+async def auth_callback(request: Request, token_cache: TokenCache = Depends(get_token_cache)):
     code = request.query_params.get("code")
     if not code:
         return HTMLResponse(content="Authorization code not found.", status_code=400)
 
+    # Imported on first use: msal (and the requests stack under it) is only needed to sign in
+    import msal
+
     msal_app = msal.ConfidentialClientApplication(
     client_id=settings.MS_CLIENT_ID,
     client_credential=settings.MS_CLIENT_SECRET,
@@ -72,7 +421,8 @@ async def auth_callback(request: Request):
 
     result = msal_app.acquire_token_by_authorization_code(
     code,  # The authorization code from the redirect
-    scopes=["Mail.Send", "Mail.Read"],
+    # Mail.Read.Shared lets the signed-in user read the registered mailboxes of other users
+    scopes=["Mail.Send", "Mail.Read", "Mail.Read.Shared"],
     redirect_uri=settings.REDIRECT_URI
     )
     access_token = result.get("access_token")
@@ -0,0 +1,39 @@
+import logging
+from typing import Callable, Dict, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+def create_backend(setting: str, name: str, factories: Dict[str, Callable[[], T]], default: str) -> T:
+    """
+    Create the backend `name` selected by the `setting` setting, falling back
+    to `default` with a warning when the name is unknown
+    """
+    factory = factories.get(name)
+    if factory is None:
+        logger.warning(f"Unknown {setting} {name!r}, using {default!r}")
+        factory = factories[default]
+    return factory()
+
+class lazy_attribute:
+    """
+    Attribute created by `factory` on first access unless one was passed to
+    the constructor (as `_<name>`). Backends hold their MongoDB collections
+    this way so that creating them, e.g. at import, does not connect to
+    MongoDB.
+    """
+    def __init__(self, factory: Callable[[], object]):
+        self.factory = factory
+
+    def __set_name__(self, owner, name: str):
+        self.attribute = f"_{name}"
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        value = getattr(instance, self.attribute, None)
+        if value is None:
+            value = self.factory()
+            setattr(instance, self.attribute, value)
+        return value
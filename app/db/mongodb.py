@@ -1,31 +1,78 @@
-from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel, MongoClient
 from config import settings
 import logging
+import threading
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# MongoDB client instance
+# MongoDB client instances: the Motor client serves the async request paths,
+# the synchronous client is kept for the scheduler and other blocking callers
 _mongo_client = None
+_async_mongo_client = None
+_client_lock = threading.Lock()
+
+def mongo_client_options() -> dict:
+    """
+    Connection pool, timeout and write concern options shared by both clients
+    """
+    write_concern = settings.MONGODB_WRITE_CONCERN
+    return {
+        "maxPoolSize": settings.MONGODB_MAX_POOL_SIZE,
+        "minPoolSize": settings.MONGODB_MIN_POOL_SIZE,
+        "maxIdleTimeMS": settings.MONGODB_MAX_IDLE_TIME_MS,
+        "connectTimeoutMS": settings.MONGODB_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": settings.MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+        "socketTimeoutMS": settings.MONGODB_SOCKET_TIMEOUT_MS,
+        "waitQueueTimeoutMS": settings.MONGODB_WAIT_QUEUE_TIMEOUT_MS,
+        "w": int(write_concern) if write_concern.isdigit() else write_concern,
+        "journal": settings.MONGODB_WRITE_CONCERN_JOURNAL
+    }
+
+# Indexes of the email collection. The query API sorts newest first on
+# (received_datetime, _id), so every filter gets a compound index ending in it.
+EMAIL_ID_INDEX = IndexModel([("email_id", ASCENDING)], unique=True, name="email_id_unique")
+EMAIL_INDEXES = [
+    IndexModel([("received_datetime", DESCENDING), ("_id", DESCENDING)], name="received"),
+    IndexModel([("sender", ASCENDING), ("received_datetime", DESCENDING), ("_id", DESCENDING)], name="sender_received"),
+    IndexModel([("recipients", ASCENDING), ("received_datetime", DESCENDING), ("_id", DESCENDING)],
+               name="recipients_received"),
+    IndexModel([("mailbox", ASCENDING), ("received_datetime", DESCENDING), ("_id", DESCENDING)], name="mailbox_received"),
+    # Full-text search over inline bodies and the plain-text prefix kept for
+    # compressed or offloaded ones; subject matches rank above body matches
+    IndexModel([("subject", TEXT), ("body", TEXT), ("body_text", TEXT)],
+               weights={"subject": 10, "body": 1, "body_text": 1}, name="subject_body_search")
+]
 
 def get_mongo_client():
     """
-    Get or create MongoDB client instance
+    Get or create MongoDB client instance. Connections are opened in the
+    background; the startup readiness check pings the server.
     """
     global _mongo_client
-    
+
     if _mongo_client is None:
-        try:
-            _mongo_client = MongoClient(settings.MONGODB_URI)
-            _mongo_client.server_info()  # Check if connection is successful
-            logger.info(f"Connected to MongoDB at {settings.MONGODB_URI}")
-            return _mongo_client
-        except Exception as e:
-            logger.error(f"Failed to connect to MongoDB: {str(e)}")
-            raise
+        # Startup creates the indexes on a thread while requests may already be served
+        with _client_lock:
+            if _mongo_client is None:
+                _mongo_client = MongoClient(settings.MONGODB_URI, **mongo_client_options())
+                logger.info(f"MongoDB client created for {settings.MONGODB_URI}")
     return _mongo_client
 
+def get_async_mongo_client():
+    """
+    Get or create the Motor (asyncio) MongoDB client instance. Connections
+    are opened lazily on first use.
+    """
+    global _async_mongo_client
+
+    if _async_mongo_client is None:
+        _async_mongo_client = AsyncIOMotorClient(settings.MONGODB_URI, **mongo_client_options())
+        logger.info(f"Async MongoDB client created (max_pool_size={settings.MONGODB_MAX_POOL_SIZE})")
+    return _async_mongo_client
+
 def get_database():
     """
     Get MongoDB database instance
@@ -33,6 +80,13 @@ def get_database():
     client = get_mongo_client()
     return client[settings.MONGODB_COLLECTION]
 
+def get_async_database():
+    """
+    Get the MongoDB database instance of the async client
+    """
+    client = get_async_mongo_client()
+    return client[settings.MONGODB_COLLECTION]
+
 def get_email_collection():
     """
     Get emails collection from MongoDB
@@ -40,13 +94,190 @@ def get_email_collection():
     db = get_database()
     return db[settings.MONGODB_COLLECTION]
 
+def get_async_email_collection():
+    """
+    Get emails collection from MongoDB through the async client
+    """
+    db = get_async_database()
+    return db[settings.MONGODB_COLLECTION]
+
+def get_async_body_bucket():
+    """
+    Get the GridFS bucket of offloaded email bodies through the async client
+    """
+    return AsyncIOMotorGridFSBucket(get_async_database(), bucket_name=settings.MONGODB_BODY_BUCKET)
+
+def get_attachment_collection():
+    """
+    Get the attachment metadata collection from MongoDB
+    """
+    db = get_database()
+    return db[settings.MONGODB_ATTACHMENT_COLLECTION]
+
+def get_async_attachment_collection():
+    """
+    Get the attachment metadata collection from MongoDB through the async client
+    """
+    db = get_async_database()
+    return db[settings.MONGODB_ATTACHMENT_COLLECTION]
+
+def get_async_attachment_bucket():
+    """
+    Get the GridFS bucket of attachment contents through the async client
+    """
+    return AsyncIOMotorGridFSBucket(get_async_database(), bucket_name=settings.MONGODB_ATTACHMENT_BUCKET)
+
+def get_sync_state_collection():
+    """
+    Get the per-mailbox sync state (delta links) collection from MongoDB
+    """
+    db = get_database()
+    return db[settings.MONGODB_SYNC_STATE_COLLECTION]
+
+def get_async_sync_state_collection():
+    """
+    Get the per-mailbox sync state collection from MongoDB through the async client
+    """
+    db = get_async_database()
+    return db[settings.MONGODB_SYNC_STATE_COLLECTION]
+
+def get_outbound_collection():
+    """
+    Get the outbound send queue collection from MongoDB
+    """
+    db = get_database()
+    return db[settings.MONGODB_OUTBOUND_COLLECTION]
+
+def get_async_outbound_collection():
+    """
+    Get the outbound send queue collection from MongoDB through the async client
+    """
+    db = get_async_database()
+    return db[settings.MONGODB_OUTBOUND_COLLECTION]
+
+def get_token_collection():
+    """
+    Get the shared OAuth token collection from MongoDB
+    """
+    db = get_database()
+    return db[settings.MONGODB_TOKEN_COLLECTION]
+
+def get_async_token_collection():
+    """
+    Get the shared OAuth token collection from MongoDB through the async client
+    """
+    db = get_async_database()
+    return db[settings.MONGODB_TOKEN_COLLECTION]
+
+def get_mailbox_collection():
+    """
+    Get the mailbox registry collection from MongoDB
+    """
+    db = get_database()
+    return db[settings.MONGODB_MAILBOX_COLLECTION]
+
+def get_async_mailbox_collection():
+    """
+    Get the mailbox registry collection from MongoDB through the async client
+    """
+    db = get_async_database()
+    return db[settings.MONGODB_MAILBOX_COLLECTION]
+
+def get_subscription_collection():
+    """
+    Get the Graph change-notification subscription collection from MongoDB
+    """
+    db = get_database()
+    return db[settings.MONGODB_SUBSCRIPTION_COLLECTION]
+
+def get_async_subscription_collection():
+    """
+    Get the Graph change-notification subscription collection from MongoDB through the async client
+    """
+    db = get_async_database()
+    return db[settings.MONGODB_SUBSCRIPTION_COLLECTION]
+
+def get_replica_collection():
+    """
+    Get the scheduler replica lease collection from MongoDB
+    """
+    db = get_database()
+    return db[settings.MONGODB_REPLICA_COLLECTION]
+
+def get_response_cache_collection():
+    """
+    Get the shared response cache collection from MongoDB
+    """
+    db = get_database()
+    return db[settings.MONGODB_RESPONSE_CACHE_COLLECTION]
+
+def get_async_response_cache_collection():
+    """
+    Get the shared response cache collection from MongoDB through the async client
+    """
+    db = get_async_database()
+    return db[settings.MONGODB_RESPONSE_CACHE_COLLECTION]
+
+def dedupe_emails(collection) -> int:
+    """
+    Delete all but the newest document of every email_id. Emails used to be
+    inserted again on every retrieval, which the unique email_id index
+    cannot be built over.
+    """
+    pipeline = [
+        {"$sort": {"_id": DESCENDING}},
+        {"$group": {"_id": "$email_id", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}}
+    ]
+    removed = 0
+    for group in collection.aggregate(pipeline, allowDiskUse=True):
+        removed += collection.delete_many({"_id": {"$in": group["ids"][1:]}}).deleted_count
+    if removed:
+        logger.warning(f"Removed {removed} duplicate stored emails before creating the unique email_id index")
+    return removed
+
+def ensure_indexes():
+    """
+    Create the indexes the repositories rely on. Each email index is built
+    on its own so one failure does not leave the others missing; raises
+    after trying them all if any failed.
+    """
+    email_collection = get_email_collection()
+    if EMAIL_ID_INDEX.document["name"] not in email_collection.index_information():
+        dedupe_emails(email_collection)
+    failed = []
+    for index in [EMAIL_ID_INDEX] + EMAIL_INDEXES:
+        try:
+            email_collection.create_indexes([index])
+        except Exception as e:
+            failed.append(index.document["name"])
+            logger.error(f"Failed to create email index {index.document['name']}: {str(e)}")
+    get_outbound_collection().create_index([("status", 1), ("created_at", 1)], name="status_created_at")
+    get_subscription_collection().create_index("subscription_id", name="subscription_id")
+    get_attachment_collection().create_index(
+        [("email_id", ASCENDING), ("attachment_id", ASCENDING)], unique=True, name="email_attachment_unique"
+    )
+    get_attachment_collection().create_index("sha256", name="sha256")
+    # Offloaded bodies are stored once per hash, also by concurrent writers
+    get_database()[f"{settings.MONGODB_BODY_BUCKET}.files"].create_index("filename", unique=True, name="filename_unique")
+    # Leases of replicas that stopped heartbeating are removed by MongoDB
+    get_replica_collection().create_index("expires_at", expireAfterSeconds=0, name="expires_at_ttl")
+    # Only cached responses have expires_at; the mailbox versions are kept
+    get_response_cache_collection().create_index("expires_at", expireAfterSeconds=0, name="expires_at_ttl")
+    if failed:
+        raise RuntimeError(f"Failed to create email indexes: {', '.join(failed)}")
+    logger.info("MongoDB indexes ensured")
+
 def close_mongo_connection():
     """
-    Close MongoDB connection
+    Close MongoDB connections
     """
-    global _mongo_client
+    global _mongo_client, _async_mongo_client
     
+    if _async_mongo_client is not None:
+        _async_mongo_client.close()
+        _async_mongo_client = None
     if _mongo_client is not None:
         _mongo_client.close()
         _mongo_client = None
-        logger.info("MongoDB connection closed")
\ No newline at end of file
+        logger.info("MongoDB connection closed")
@@ -0,0 +1,169 @@
+import logging
+import threading
+from typing import TYPE_CHECKING
+
+from app.repositories.attachment_repository import AttachmentRepository
+from app.repositories.email_repository import EmailRepository
+from app.repositories.mailbox_repository import MailboxRepository
+from app.repositories.outbound_repository import OutboundEmailRepository
+from app.repositories.sync_state_repository import SyncStateRepository
+from app.services.attachment_service import AttachmentService
+from app.services.email_service import EmailService
+from app.services.graph_client import GraphClient, close_graph_client, get_graph_client
+from app.services.outbound_attachments import OutboundAttachmentStore
+from app.services.response_cache import ResponseCache, get_response_cache as shared_response_cache
+from app.services.search_backend import SearchBackend, get_search_backend as shared_search_backend
+from app.services.token_service import TokenCache, token_cache
+
+if TYPE_CHECKING:
+    from app.schedulers.scheduler import MailboxScheduler
+    from app.workers.notification_worker import NotificationWorker
+    from app.workers.send_worker import SendWorkerPool
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class Container:
+    """
+    Services and repositories shared by the routes, the scheduler and the
+    workers. Each is built once per process on first use, so a request does
+    not construct services or resolve MongoDB collections, and released by
+    `close` when the application shuts down.
+    """
+    def __init__(self):
+        self._instances = {}
+        # The scheduler's synchronous jobs run on executor threads; reentrant
+        # because building a service builds the repositories it uses
+        self._lock = threading.RLock()
+
+    def _get(self, name: str, factory):
+        instance = self._instances.get(name)
+        if instance is None:
+            with self._lock:
+                instance = self._instances.get(name)
+                if instance is None:
+                    instance = self._instances[name] = factory()
+        return instance
+
+    @property
+    def graph_client(self) -> GraphClient:
+        return get_graph_client()
+
+    @property
+    def token_cache(self) -> TokenCache:
+        return token_cache
+
+    @property
+    def search_backend(self) -> SearchBackend:
+        return shared_search_backend()
+
+    @property
+    def response_cache(self) -> ResponseCache:
+        return shared_response_cache()
+
+    # The scheduler and the workers use this container themselves, so their
+    # modules are imported on first use
+    @property
+    def send_worker_pool(self) -> "SendWorkerPool":
+        from app.workers.send_worker import send_worker_pool
+        return send_worker_pool
+
+    @property
+    def notification_worker(self) -> "NotificationWorker":
+        from app.workers.notification_worker import notification_worker
+        return notification_worker
+
+    @property
+    def mailbox_scheduler(self) -> "MailboxScheduler":
+        from app.schedulers.scheduler import mailbox_scheduler
+        return mailbox_scheduler
+
+    @property
+    def email_repository(self) -> EmailRepository:
+        return self._get("email_repository", EmailRepository)
+
+    @property
+    def outbound_repository(self) -> OutboundEmailRepository:
+        return self._get("outbound_repository", OutboundEmailRepository)
+
+    @property
+    def attachment_repository(self) -> AttachmentRepository:
+        return self._get("attachment_repository", AttachmentRepository)
+
+    @property
+    def mailbox_repository(self) -> MailboxRepository:
+        return self._get("mailbox_repository", MailboxRepository)
+
+    @property
+    def sync_state_repository(self) -> SyncStateRepository:
+        return self._get("sync_state_repository", SyncStateRepository)
+
+    @property
+    def outbound_attachments(self) -> OutboundAttachmentStore:
+        return self._get("outbound_attachments", OutboundAttachmentStore)
+
+    @property
+    def attachment_service(self) -> AttachmentService:
+        return self._get("attachment_service", lambda: AttachmentService(
+            self.graph_client, attachment_repository=self.attachment_repository
+        ))
+
+    @property
+    def email_service(self) -> EmailService:
+        return self._get("email_service", lambda: EmailService(
+            self.graph_client, self.email_repository,
+            sync_state_repository=self.sync_state_repository,
+            search_backend=self.search_backend,
+            attachment_service=self.attachment_service,
+            outbound_attachments=self.outbound_attachments
+        ))
+
+    async def close(self):
+        """
+        Drop the shared instances and close the Graph API client. MongoDB
+        clients are closed by close_mongo_connection.
+        """
+        with self._lock:
+            self._instances.clear()
+        await close_graph_client()
+
+# Shared container instance
+container = Container()
+
+# FastAPI dependencies; override them in app.dependency_overrides to swap in fakes
+def get_email_service() -> EmailService:
+    return container.email_service
+
+def get_email_repository() -> EmailRepository:
+    return container.email_repository
+
+def get_outbound_repository() -> OutboundEmailRepository:
+    return container.outbound_repository
+
+def get_attachment_repository() -> AttachmentRepository:
+    return container.attachment_repository
+
+def get_mailbox_repository() -> MailboxRepository:
+    return container.mailbox_repository
+
+def get_outbound_attachments() -> OutboundAttachmentStore:
+    return container.outbound_attachments
+
+def get_token_cache() -> TokenCache:
+    return container.token_cache
+
+def get_search_backend() -> SearchBackend:
+    return container.search_backend
+
+def get_response_cache() -> ResponseCache:
+    return container.response_cache
+
+def get_send_worker_pool() -> "SendWorkerPool":
+    return container.send_worker_pool
+
+def get_notification_worker() -> "NotificationWorker":
+    return container.notification_worker
+
+def get_mailbox_scheduler() -> "MailboxScheduler":
+    return container.mailbox_scheduler
@@ -3,9 +3,18 @@ from fastapi.responses import JSONResponse
 from fastapi.exceptions import RequestValidationError
 from starlette.exceptions import HTTPException as StarletteHTTPException
 import logging
+import math
+from typing import Optional
 
 logger = logging.getLogger(__name__)
 
+class GraphAPIError(Exception):
+    """Raised when Microsoft Graph API answers with an unexpected status code"""
+    def __init__(self, message: str, status_code: int, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
 async def http_exception_handler(request: Request, exc: StarletteHTTPException):
     logger.warning(f"HTTP error: {exc.detail} - Path: {request.url.path}")
     return JSONResponse(
@@ -32,3 +41,20 @@ async def generic_exception_handler(request: Request, exc: Exception):
             "path": request.url.path,
         },
     )
+
+async def graph_exception_handler(request: Request, exc: GraphAPIError):
+    # Graph still throttling after our retries: tell the caller to back off
+    # instead of reporting an internal error
+    if exc.status_code in (429, 503):
+        logger.warning(f"Graph API throttled: {exc} - Path: {request.url.path}")
+        headers = {"Retry-After": str(math.ceil(exc.retry_after))} if exc.retry_after is not None else None
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "Microsoft Graph API is throttling requests, retry later."},
+            headers=headers,
+        )
+    logger.error(f"Graph API error: {exc} - Path: {request.url.path}")
+    return JSONResponse(
+        status_code=502,
+        content={"detail": str(exc)},
+    )
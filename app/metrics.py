@@ -0,0 +1,187 @@
+import logging
+import re
+import time
+from urllib.parse import urlsplit
+
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# An observation is a lock and a few additions (about 2µs, plus about 10µs to
+# label a Graph URL), cheap enough to keep on for every request. Gauges read
+# from in-memory state of other components (notification queue, Graph retry
+# counters) are collected at scrape time only; the outbound queue lives in
+# MongoDB, so the send workers count it and set its gauge.
+
+GRAPH_REQUEST_DURATION = Histogram(
+    "graph_request_duration_seconds", "Microsoft Graph API call latency, per attempt",
+    ["method", "endpoint", "status"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+GRAPH_REQUESTS_IN_FLIGHT = Gauge("graph_requests_in_flight", "Microsoft Graph API calls in progress")
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "API request latency", ["method", "route", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+HTTP_REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight", "API requests in progress")
+
+MONGO_WRITE_DURATION = Histogram(
+    "mongo_write_duration_seconds", "MongoDB write latency", ["operation"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+MONGO_WRITE_BATCH_SIZE = Histogram(
+    "mongo_write_batch_size", "Documents per MongoDB write", ["operation"],
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000)
+)
+
+TOKEN_REFRESHES = Counter("token_refreshes_total", "Access token refreshes against the token endpoint", ["outcome"])
+TOKEN_REFRESH_DURATION = Histogram(
+    "token_refresh_duration_seconds", "Access token refresh latency",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+
+SCHEDULER_JOB_DURATION = Histogram(
+    "scheduler_job_duration_seconds", "Scheduler job run time", ["job"],
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+)
+SCHEDULER_JOB_LAG = Histogram(
+    "scheduler_job_lag_seconds", "Delay between a job's scheduled time and its start", ["job"],
+    buckets=(0.01, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+)
+SCHEDULER_JOB_OVERLAPS = Counter(
+    "scheduler_job_overlaps_total", "Runs skipped because the previous run of the job was still going", ["job"]
+)
+SCHEDULER_JOB_MISSED = Counter("scheduler_job_missed_total", "Runs missed past their grace time", ["job"])
+SCHEDULER_JOB_ERRORS = Counter("scheduler_job_errors_total", "Job runs that raised", ["job"])
+SCHEDULER_JOBS_RUNNING = Gauge("scheduler_jobs_running", "Scheduler jobs in progress", ["job"])
+OUTBOUND_QUEUE_DEPTH = Gauge("outbound_queue_depth", "Outbound emails by queue status", ["status"])
+
+SCHEDULER_REPLICAS = Gauge("scheduler_replicas", "Live scheduler replicas sharing the mailboxes")
+SCHEDULER_OWNED_MAILBOXES = Gauge("scheduler_owned_mailboxes", "Mailboxes polled by this replica")
+
+RESPONSE_CACHE_LOOKUPS = Counter(
+    "response_cache_lookups_total", "Cached read responses served (hit) or computed (miss)",
+    ["route", "result"]
+)
+
+# Path segments following these collections are ids; the rest are kept
+_ID_COLLECTIONS = {"users", "messages", "attachments", "subscriptions", "mailFolders"}
+_KEPT_SEGMENTS = {"delta", "inbox", "$value", "createUploadSession"}
+_VERSION_PATTERN = re.compile(r"^(v1\.0|beta)$")
+
+def graph_endpoint(url) -> str:
+    """
+    Low-cardinality endpoint label of a Graph URL: ids and mailbox addresses
+    are replaced by placeholders, e.g. /users/{id}/messages/{id}/attachments.
+    Pre-authenticated upload session URLs are reported as "upload_session".
+    """
+    parts = urlsplit(str(url))
+    path_segments = parts.path.split("/")
+    if not (parts.hostname or "").startswith("graph.") and not any(map(_VERSION_PATTERN.match, path_segments)):
+        # Not a Graph URL: the upload URLs of upload sessions point at Outlook
+        location = f"{parts.hostname}{parts.path}".lower()
+        return "upload_session" if "session" in location or "upload" in location else "external"
+    segments = []
+    previous = None
+    for segment in path_segments:
+        if not segment or _VERSION_PATTERN.match(segment):
+            continue
+        if previous in _ID_COLLECTIONS and segment not in _KEPT_SEGMENTS:
+            segment = "{id}"
+        segments.append(segment)
+        previous = segment
+    return "/" + "/".join(segments)
+
+def observe_graph_request(method: str, url, status, started: float):
+    GRAPH_REQUEST_DURATION.labels(method, graph_endpoint(url), str(status)).observe(time.perf_counter() - started)
+
+class MongoWriteTimer:
+    """
+    Time a MongoDB write and record how many documents it carried
+    """
+    def __init__(self, operation: str, documents: int):
+        self.operation = operation
+        self.documents = documents
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        MONGO_WRITE_DURATION.labels(self.operation).observe(time.perf_counter() - self.started)
+        MONGO_WRITE_BATCH_SIZE.labels(self.operation).observe(self.documents)
+        return False
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording latency per route template and the requests in
+    progress. A plain ASGI middleware avoids the overhead of BaseHTTPMiddleware.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUESTS_IN_FLIGHT.dec()
+            # The router stores the matched route in the scope; unmatched paths share one label
+            route = scope.get("route")
+            HTTP_REQUEST_DURATION.labels(
+                scope["method"], getattr(route, "path", "unmatched"), str(status["code"])
+            ).observe(time.perf_counter() - started)
+
+class RuntimeCollector:
+    """
+    In-memory values owned by other components, read when Prometheus
+    scrapes: the notification queue depth and the Graph client's retry
+    counters
+    """
+    def describe(self):
+        # Without describe, registering the collector calls collect, which
+        # would create the Graph client at import time
+        yield GaugeMetricFamily("notification_queue_depth", "Change notifications waiting to be fetched")
+
+    def collect(self):
+        from app.dependencies import container
+
+        yield GaugeMetricFamily("notification_queue_depth", "Change notifications waiting to be fetched",
+                                value=container.notification_worker.queue_depth)
+
+        stats = container.graph_client.stats
+        yield CounterMetricFamily("graph_requests", "Graph API calls sent, retries included", value=stats.requests)
+        yield CounterMetricFamily("graph_retries", "Graph API calls retried", value=stats.retries)
+        yield CounterMetricFamily("graph_throttled", "Graph API throttled responses", value=stats.throttled)
+        yield CounterMetricFamily("graph_retry_wait_seconds", "Time spent backing off before retries",
+                                  value=stats.retry_wait_seconds)
+        yield CounterMetricFamily("graph_rate_limit_wait_seconds", "Time spent waiting on the client rate limiter",
+                                  value=stats.rate_limit_wait_seconds)
+
+_runtime_collector = None
+
+def register_runtime_collector():
+    """
+    Register the scrape-time collector once per process
+    """
+    global _runtime_collector
+
+    if settings.METRICS_ENABLED and _runtime_collector is None:
+        _runtime_collector = RuntimeCollector()
+        REGISTRY.register(_runtime_collector)
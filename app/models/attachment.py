@@ -0,0 +1,14 @@
+from pydantic import BaseModel
+from typing import Optional
+from datetime import datetime
+
+class AttachmentResponse(BaseModel):
+    """Model for a stored email attachment"""
+    attachment_id: str
+    email_id: str
+    name: str
+    content_type: Optional[str] = None
+    size: int
+    is_inline: bool = False
+    sha256: str
+    created_at: Optional[datetime] = None
@@ -1,7 +1,38 @@
-from pydantic import BaseModel, EmailStr, Field
-from typing import List, Optional
+import base64
+import binascii
+from enum import Enum
+
+from pydantic import BaseModel, EmailStr, Field, root_validator
+from typing import Dict, List, Optional
 from datetime import datetime
 
+from config import settings
+
+class EmailAttachment(BaseModel):
+    """Model for a file attached to an outbound email"""
+    name: str = Field(..., min_length=1)
+    content_type: str = "application/octet-stream"
+    # Base64 content, for files up to SEND_INLINE_ATTACHMENT_LIMIT bytes
+    content_bytes: Optional[str] = None
+    # Id returned by POST /email/attachments, for files of any size
+    file_id: Optional[str] = Field(None, regex=r"^[0-9a-f]{32}$")
+    is_inline: bool = False
+    content_id: Optional[str] = None
+
+    @root_validator(skip_on_failure=True)
+    def check_content(cls, values):
+        content_bytes = values.get("content_bytes")
+        if (content_bytes is None) == (values.get("file_id") is None):
+            raise ValueError("Give exactly one of content_bytes and file_id")
+        if content_bytes is not None and len(content_bytes) * 3 // 4 > settings.SEND_INLINE_ATTACHMENT_LIMIT:
+            raise ValueError("Attachment too large for content_bytes, upload it to POST /email/attachments")
+        if content_bytes is not None:
+            try:
+                base64.b64decode(content_bytes, validate=True)
+            except binascii.Error:
+                raise ValueError("content_bytes is not valid base64")
+        return values
+
 class EmailSendRequest(BaseModel):
     """Model for sending email requests"""
     to_recipients: List[EmailStr]
@@ -10,6 +41,47 @@ class EmailSendRequest(BaseModel):
     cc_recipients: Optional[List[EmailStr]] = Field(default_factory=list)
     bcc_recipients: Optional[List[EmailStr]] = Field(default_factory=list)
     is_html: Optional[bool] = False
+    attachments: List[EmailAttachment] = Field(default_factory=list)
+
+class EmailBatchSendRequest(BaseModel):
+    """Model for sending many emails in one request"""
+    messages: List[EmailSendRequest] = Field(..., min_items=1)
+
+class EmailBatchResult(BaseModel):
+    """Model for the outcome of one message of a batch send"""
+    index: int
+    success: bool
+    status_code: Optional[int] = None
+    error: Optional[str] = None
+
+class EmailBatchSendResponse(BaseModel):
+    """Model for batch send response data"""
+    sent: int
+    failed: int
+    results: List[EmailBatchResult]
+
+class StagedAttachmentResponse(BaseModel):
+    """Model for a file uploaded to attach to outbound emails"""
+    file_id: str
+    size: int
+
+class OutboundEmailStatus(str, Enum):
+    """States of a message in the outbound send queue"""
+    PENDING = "pending"
+    IN_FLIGHT = "in_flight"
+    SENT = "sent"
+    FAILED = "failed"
+
+class OutboundEmailResponse(BaseModel):
+    """Model for the state of a queued outbound email"""
+    id: str
+    status: OutboundEmailStatus
+    attempts: int = 0
+    # Emails sent so far when the recipients were split into several emails
+    parts_sent: int = 0
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
 
 class EmailResponse(BaseModel):
     """Model for email response data"""
@@ -20,6 +92,20 @@ class EmailResponse(BaseModel):
     received_datetime: Optional[datetime] = None
     body: Optional[str] = None
 
+class EmailStoreResult(BaseModel):
+    """Model for the outcome of storing a batch of emails"""
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+
+class BodyStorageReport(BaseModel):
+    """Storage taken by email bodies and bytes saved by compression/offloading"""
+    emails: int = 0
+    original_bytes: int = 0
+    stored_bytes: int = 0
+    saved_bytes: int = 0
+    by_storage: Dict[str, int] = Field(default_factory=dict)
+
 class EmailDB(BaseModel):
     """Model for storing emails in MongoDB"""
     email_id: str
@@ -30,7 +116,9 @@ class EmailDB(BaseModel):
     bcc_recipients: List[str] = Field(default_factory=list)
     body: str
     is_html: bool = False
+    has_attachments: bool = False
     received_datetime: datetime
+    mailbox: Optional[str] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
     
     class Config:
@@ -45,6 +133,37 @@ class EmailDB(BaseModel):
                 "body": "This is a test email",
                 "is_html": False,
                 "received_datetime": "2023-05-01T12:00:00Z",
+                "mailbox": "me",
                 "created_at": "2023-05-01T12:05:00Z"
             }
         }
+
+class StoredEmail(BaseModel):
+    """Email read back from MongoDB; body is only included when requested"""
+    id: str
+    email_id: str
+    subject: str
+    sender: str
+    recipients: List[str] = Field(default_factory=list)
+    cc_recipients: List[str] = Field(default_factory=list)
+    bcc_recipients: List[str] = Field(default_factory=list)
+    body: Optional[str] = None
+    body_size: Optional[int] = None
+    is_html: bool = False
+    has_attachments: bool = False
+    received_datetime: datetime
+    mailbox: Optional[str] = None
+
+class EmailPage(BaseModel):
+    """Page of stored emails, newest first"""
+    items: List[StoredEmail]
+    next_cursor: Optional[str] = None
+
+class EmailSearchHit(StoredEmail):
+    """Stored email matching a search, with its relevance score"""
+    score: float
+
+class EmailSearchResponse(BaseModel):
+    """Page of search results, best match first"""
+    items: List[EmailSearchHit]
+    next_offset: Optional[int] = None
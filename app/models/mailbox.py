@@ -0,0 +1,17 @@
+from pydantic import BaseModel, EmailStr
+from typing import Optional
+from datetime import datetime
+
+class MailboxRequest(BaseModel):
+    """Model for registering a mailbox for retrieval"""
+    address: EmailStr
+
+class MailboxResponse(BaseModel):
+    """Model for a registered mailbox and its last retrieval run"""
+    address: str
+    enabled: bool = True
+    running: bool = False
+    last_run_at: Optional[datetime] = None
+    last_duration: Optional[float] = None
+    last_success_at: Optional[datetime] = None
+    last_error: Optional[str] = None
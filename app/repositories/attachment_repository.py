@@ -0,0 +1,52 @@
+import logging
+from datetime import datetime
+from typing import List, Optional, Set
+
+from app.db.mongodb import get_async_attachment_collection
+
+logger = logging.getLogger(__name__)
+
+class AttachmentRepository:
+    """
+    Attachment metadata, one document per (email, attachment). The content
+    itself is kept once per SHA-256 by the attachment store.
+    """
+    def __init__(self):
+        # Set MongoDB collection
+        self.async_collection = get_async_attachment_collection()
+
+    async def stored_attachment_ids_async(self, email_id: str) -> Set[str]:
+        documents = await self.async_collection.find({"email_id": email_id}, {"attachment_id": 1}).to_list(None)
+        return {document["attachment_id"] for document in documents}
+
+    async def save_attachment_async(self, email_id: str, mailbox: str, attachment: dict, sha256: str,
+                                    size: int, storage: str):
+        """
+        Record a downloaded attachment of an email
+        """
+        try:
+            await self.async_collection.update_one(
+                {"email_id": email_id, "attachment_id": attachment["id"]},
+                {
+                    "$set": {
+                        "mailbox": mailbox,
+                        "name": attachment.get("name") or "",
+                        "content_type": attachment.get("contentType"),
+                        "size": size,
+                        "is_inline": bool(attachment.get("isInline")),
+                        "sha256": sha256,
+                        "storage": storage
+                    },
+                    "$setOnInsert": {"created_at": datetime.utcnow()}
+                },
+                upsert=True
+            )
+        except Exception as e:
+            logger.error(f"Failed to save attachment {attachment['id']} of {email_id}: {e}")
+            raise
+
+    async def list_attachments_async(self, email_id: str) -> List[dict]:
+        return await self.async_collection.find({"email_id": email_id}).sort("name", 1).to_list(None)
+
+    async def get_attachment_async(self, email_id: str, attachment_id: str) -> Optional[dict]:
+        return await self.async_collection.find_one({"email_id": email_id, "attachment_id": attachment_id})
@@ -0,0 +1,155 @@
+import hashlib
+import logging
+import re
+import zlib
+from typing import List, NamedTuple, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+from app.backends import lazy_attribute
+from app.db.mongodb import get_async_body_bucket
+from config import settings
+
+try:
+    import zstandard
+except ImportError:  # optional dependency, zlib is used without it
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Where the body of an email document lives
+BODY_INLINE = "inline"          # plain string in "body"
+BODY_COMPRESSED = "compressed"  # compressed bytes in "body_compressed"
+BODY_GRIDFS = "gridfs"          # compressed bytes in GridFS, referenced by "body_ref"
+
+HTML_TAG_PATTERN = re.compile(r"<[^>]+>")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+class EncodedBody(NamedTuple):
+    # Body fields of the email document
+    fields: dict
+    # Compressed body to upload to GridFS (body_ref is set once uploaded)
+    blob: Optional[bytes] = None
+
+def compression_codec() -> str:
+    """
+    Codec selected by BODY_COMPRESSION, falling back to zlib when zstandard
+    is not installed
+    """
+    if settings.BODY_COMPRESSION == "zstd":
+        if zstandard is not None:
+            return "zstd"
+        logger.warning("BODY_COMPRESSION=zstd but zstandard is not installed, using zlib")
+    return "zlib"
+
+def compress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=settings.BODY_COMPRESSION_LEVEL).compress(data)
+    return zlib.compress(data, settings.BODY_COMPRESSION_LEVEL)
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Body was compressed with zstd but zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+def encode_body(body: str, is_html: bool = False) -> EncodedBody:
+    """
+    Decide how a body is stored: inline below BODY_COMPRESSION_THRESHOLD
+    bytes, compressed in the document otherwise, and in GridFS when even the
+    compressed body exceeds BODY_GRIDFS_THRESHOLD bytes. Compressed and
+    offloaded bodies keep a plain-text prefix in "body_text" for the text
+    index, counted in body_stored_size; inline bodies are indexed as they are.
+    """
+    raw = body.encode("utf-8")
+    fields = {
+        "body": body,
+        "body_storage": BODY_INLINE,
+        "body_encoding": None,
+        "body_compressed": None,
+        "body_ref": None,
+        "body_hash": None,
+        "body_text": None,
+        "body_size": len(raw),
+        "body_stored_size": len(raw)
+    }
+    if len(raw) < settings.BODY_COMPRESSION_THRESHOLD:
+        return EncodedBody(fields)
+
+    codec = compression_codec()
+    compressed = compress(raw, codec)
+    text = search_text(body, is_html)
+    stored_size = len(compressed) + len(text.encode("utf-8"))
+    if stored_size >= len(raw):
+        # Not worth it (e.g. already compressed content)
+        return EncodedBody(fields)
+
+    fields.update(body=None, body_encoding=codec, body_text=text, body_stored_size=stored_size)
+    if len(compressed) < settings.BODY_GRIDFS_THRESHOLD:
+        fields.update(body_storage=BODY_COMPRESSED, body_compressed=compressed)
+        return EncodedBody(fields)
+    # Content-addressed so the same body is uploaded once
+    fields.update(body_storage=BODY_GRIDFS, body_hash=hashlib.sha256(compressed).hexdigest())
+    return EncodedBody(fields, compressed)
+
+def decode_body(document: dict, blob: Optional[bytes] = None) -> Optional[str]:
+    """
+    Body of an email document; `blob` holds the GridFS content of offloaded bodies
+    """
+    storage = document.get("body_storage", BODY_INLINE)
+    if storage == BODY_INLINE:
+        return document.get("body")
+    data = blob if storage == BODY_GRIDFS else document["body_compressed"]
+    return decompress(data, document["body_encoding"]).decode("utf-8")
+
+def search_text(body: str, is_html: bool) -> str:
+    """
+    Plain-text prefix of a body for the text index, which cannot look into
+    compressed or offloaded bodies
+    """
+    if is_html:
+        body = HTML_TAG_PATTERN.sub(" ", body)
+    return WHITESPACE_PATTERN.sub(" ", body).strip()[:settings.BODY_SEARCH_TEXT_LENGTH]
+
+class BodyBlobStore:
+    """
+    GridFS bucket holding offloaded bodies, one file per body hash (a unique
+    index on filename enforces it)
+    """
+    # Resolved on first use: most emails never need GridFS
+    async_bucket = lazy_attribute(get_async_body_bucket)
+
+    def __init__(self, async_bucket=None):
+        self._async_bucket = async_bucket
+
+    async def _find_async(self, body_hash: str):
+        async for existing in self.async_bucket.find({"filename": body_hash}).limit(1):
+            return existing._id
+        return None
+
+    async def put_async(self, body_hash: str, data: bytes):
+        """
+        Store a body once and return its file id, also when another writer
+        stores the same body concurrently
+        """
+        file_id = await self._find_async(body_hash)
+        if file_id is not None:
+            return file_id
+        upload = self.async_bucket.open_upload_stream(body_hash)
+        try:
+            await upload.write(data)
+            await upload.close()
+        except DuplicateKeyError:
+            # Another writer stored it first: drop the chunks written here
+            await upload.abort()
+            return await self._find_async(body_hash)
+        return upload._id
+
+    async def get_async(self, file_id) -> bytes:
+        stream = await self.async_bucket.open_download_stream(file_id)
+        return await stream.read()
+
+    async def delete_async(self, file_ids: List):
+        for file_id in file_ids:
+            await self.async_bucket.delete(file_id)
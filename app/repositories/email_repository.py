@@ -1,57 +1,370 @@
+import base64
+import json
 import logging
+from datetime import datetime
+from typing import AsyncIterator, List, Optional, Tuple
 
-from app.db.mongodb import get_email_collection
-from app.models.email import EmailDB, EmailResponse
+from bson import ObjectId
+from bson.errors import InvalidId
+from pydantic.datetime_parse import parse_datetime
+from pymongo import DESCENDING, UpdateOne
+
+from app.db.mongodb import get_async_email_collection
+from app.metrics import MongoWriteTimer
+from app.models.email import BodyStorageReport, EmailDB, EmailStoreResult
+from app.repositories.body_storage import BODY_GRIDFS, BodyBlobStore, decode_body, encode_body
+from app.services.response_cache import ResponseCache, get_response_cache
+from config import settings
 
 logger = logging.getLogger(__name__)
+
+# Newest first; _id breaks ties between emails received at the same instant
+EMAIL_SORT = [("received_datetime", DESCENDING), ("_id", DESCENDING)]
+# Fields left out of list queries: the body (inline, compressed or a GridFS
+# reference) is only loaded when a caller asks for it
+BODY_PROJECTION = {"body": 0, "body_compressed": 0, "body_text": 0}
+EMAIL_LIST_PROJECTION = dict(BODY_PROJECTION, created_at=0)
+# Fields needed to load a body whatever its storage
+BODY_STORAGE_PROJECTION = {"body_storage": 1, "body_encoding": 1, "body_compressed": 1, "body_ref": 1}
+# Stands in for missing nested objects of Graph messages; never mutated
+_EMPTY = {}
+
+class InvalidCursorError(ValueError):
+    pass
+
 class EmailRepository:
     def __init__(self):
-        # Set MongoDB collection
-        self.collection = get_email_collection()
+        # Motor collection, so request handlers and jobs on the event loop
+        # never block on a MongoDB round-trip
+        self.async_collection = get_async_email_collection()
+        # GridFS bucket of bodies too large to keep in the document
+        self.body_store = BodyBlobStore()
+        # Cached reads are invalidated whenever emails of their mailbox change
+        self.response_cache: ResponseCache = get_response_cache()
 
-    def store_emails(self, emails_data):
-        # Process and store emails
-        stored_emails = []
-        email_docs = []
-        for email in emails_data:
-            # Extract email data
-            email_id = email.get("id")
-            subject = email.get("subject", "")
-            sender = email.get("sender", {}).get("emailAddress", {}).get("address", "")
-            to_recipients = [r.get("emailAddress", {}).get("address", "") for r in email.get("toRecipients", [])]
-            cc_recipients = [r.get("emailAddress", {}).get("address", "") for r in email.get("ccRecipients", [])]
-            bcc_recipients = [r.get("emailAddress", {}).get("address", "") for r in email.get("bccRecipients", [])]
-            body = email.get("body", {}).get("content", "")
-            is_html = email.get("body", {}).get("contentType", "") == "html"
-            received_datetime = email.get("receivedDateTime")
-            
-            # Create email document
-            email_doc = EmailDB(
-                email_id=email_id,
-                subject=subject,
-                sender=sender,
-                recipients=to_recipients,
-                cc_recipients=cc_recipients,
-                bcc_recipients=bcc_recipients,
-                body=body,
-                is_html=is_html,
-                received_datetime=received_datetime
-            )
-            email_docs.append(email_doc.dict())
-
-            # Add to response
-            stored_emails.append(EmailResponse(
-                message="Email retrieved and stored",
-                email_id=email_id,
-                subject=subject,
-                sender=sender,
-                received_datetime=received_datetime,
-                body=body
-            ))
+    async def store_emails_async(self, emails_data, mailbox: str = None):
+        return await self.store_documents_async(self.email_documents(emails_data, mailbox), mailbox)
+
+    async def store_documents_async(self, email_docs: List[dict], mailbox: str = None) -> EmailStoreResult:
+        """
+        Store documents built by `email_documents`, with their body
+        compressed or set aside for GridFS depending on its size
+        """
+        documents = self._encoded_documents(email_docs)
+        for document, blob in documents:
+            if blob is not None:
+                document["body_ref"] = await self.body_store.put_async(document["body_hash"], blob)
+        operations = self._upsert_operations(documents)
+        if not operations:
+            return EmailStoreResult()
         try:
-            self.collection.insert_many(email_docs)
+            # Offloaded bodies the upserts may replace, e.g. of re-synced emails whose body changed
+            previous_refs = await self.async_collection.distinct("body_ref", {
+                "email_id": {"$in": [document["email_id"] for document, _ in documents]}, "body_storage": BODY_GRIDFS
+            })
+            with MongoWriteTimer("store_emails", len(operations)):
+                result = await self.async_collection.bulk_write(operations, ordered=False)
+            await self._delete_unused_bodies_async(previous_refs)
         except Exception as e:
             logger.error(f"Failed to store emails: {e}")
             raise
-        return stored_emails
-        
\ No newline at end of file
+        store_result = self._store_result(result)
+        if store_result.inserted or store_result.updated:
+            await self.response_cache.invalidate_mailbox(mailbox)
+        return store_result
+
+    async def delete_emails_async(self, email_ids):
+        # Remove emails that were deleted or moved out of the mailbox
+        if not email_ids:
+            return 0
+        query = {"email_id": {"$in": list(email_ids)}}
+        try:
+            mailboxes = await self.async_collection.distinct("mailbox", query)
+            body_refs = await self.async_collection.distinct("body_ref", dict(query, body_storage=BODY_GRIDFS))
+            with MongoWriteTimer("delete_emails", len(query["email_id"]["$in"])):
+                result = await self.async_collection.delete_many(query)
+            for mailbox in mailboxes:
+                await self.response_cache.invalidate_mailbox(mailbox)
+            await self._delete_unused_bodies_async(body_refs)
+        except Exception as e:
+            logger.error(f"Failed to delete emails: {e}")
+            raise
+        return result.deleted_count
+
+    async def _delete_unused_bodies_async(self, body_refs: List):
+        # Bodies are shared by hash: keep the ones emails still reference
+        if body_refs:
+            still_used = await self.async_collection.distinct("body_ref", {"body_ref": {"$in": body_refs}})
+            await self.body_store.delete_async(set(body_refs) - set(still_used))
+
+    async def find_emails_async(self, sender: Optional[str] = None, recipient: Optional[str] = None,
+                                mailbox: Optional[str] = None, received_after: Optional[datetime] = None,
+                                received_before: Optional[datetime] = None, cursor: Optional[str] = None,
+                                limit: int = 25, include_body: bool = False) -> Tuple[List[dict], Optional[str]]:
+        """
+        Page through stored emails newest first with keyset pagination on
+        (received_datetime, _id). Returns the page and the cursor of the next
+        page (None on the last page). Raises InvalidCursorError for a cursor
+        that was not produced by this method.
+        """
+        query = email_filter(sender, recipient, mailbox, received_after, received_before)
+        if cursor:
+            received, last_id = decode_cursor(cursor)
+            query = {"$and": [query, {"$or": [
+                {"received_datetime": {"$lt": received}},
+                {"received_datetime": received, "_id": {"$lt": last_id}}
+            ]}]}
+
+        projection = {"body_text": 0} if include_body else EMAIL_LIST_PROJECTION
+        # One extra document tells whether there is a next page
+        documents = await self.async_collection.find(query, projection).sort(EMAIL_SORT).limit(limit + 1).to_list(limit + 1)
+        next_cursor = None
+        if len(documents) > limit:
+            documents = documents[:limit]
+            next_cursor = encode_cursor(documents[-1])
+        if include_body:
+            for document in documents:
+                await self._load_body(document)
+        return documents, next_cursor
+
+    async def export_emails_async(self, fields: List[str], sender: Optional[str] = None,
+                                  recipient: Optional[str] = None, mailbox: Optional[str] = None,
+                                  received_after: Optional[datetime] = None,
+                                  received_before: Optional[datetime] = None,
+                                  batch_size: Optional[int] = None) -> AsyncIterator[dict]:
+        """
+        Stream stored emails newest first, with only `fields` (and _id), from
+        a server-side cursor fetching batch_size documents per round-trip, so
+        memory use does not grow with the number of emails exported
+        """
+        query = email_filter(sender, recipient, mailbox, received_after, received_before)
+        projection = {field: 1 for field in fields}
+        include_body = "body" in fields
+        if include_body:
+            projection.update(BODY_STORAGE_PROJECTION)
+        cursor = self.async_collection.find(query, projection, sort=EMAIL_SORT,
+                                            batch_size=batch_size or settings.EXPORT_BATCH_SIZE)
+        async for document in cursor:
+            if include_body:
+                await self._load_body(document)
+                for field in BODY_STORAGE_PROJECTION:
+                    document.pop(field, None)
+            yield document
+
+    async def get_email_async(self, email_id: str, include_body: bool = True) -> Optional[dict]:
+        """
+        Get one stored email, loading its body only when asked to
+        """
+        projection = {"body_text": 0} if include_body else BODY_PROJECTION
+        document = await self.async_collection.find_one({"email_id": email_id}, projection)
+        if document is not None and include_body:
+            await self._load_body(document)
+        return document
+
+    async def body_storage_report_async(self) -> BodyStorageReport:
+        """
+        Bytes taken by bodies as received versus as stored, per storage kind
+        """
+        rows = await self.async_collection.aggregate([
+            {"$group": {
+                "_id": "$body_storage",
+                "emails": {"$sum": 1},
+                "original_bytes": {"$sum": "$body_size"},
+                "stored_bytes": {"$sum": "$body_stored_size"}
+            }}
+        ]).to_list(None)
+        report = BodyStorageReport()
+        for row in rows:
+            storage = row["_id"] or "inline"
+            report.emails += row["emails"]
+            report.original_bytes += row["original_bytes"]
+            report.stored_bytes += row["stored_bytes"]
+            report.by_storage[storage] = row["emails"]
+        report.saved_bytes = report.original_bytes - report.stored_bytes
+        return report
+
+    async def _load_body(self, document: dict):
+        # Replace the stored representation of the body with the body itself
+        blob = None
+        if document.get("body_storage") == BODY_GRIDFS:
+            blob = await self.body_store.get_async(document["body_ref"])
+        document["body"] = decode_body(document, blob)
+        document.pop("body_compressed", None)
+
+    async def search_emails_async(self, text: str, mailbox: Optional[str] = None, offset: int = 0,
+                                  limit: int = 25) -> Tuple[List[dict], bool]:
+        """
+        Full-text search over subject and body through the text index, best
+        match first. Returns the page (each document has its "score") and
+        whether more results follow.
+        """
+        query = {"$text": {"$search": text}}
+        if mailbox:
+            query["mailbox"] = mailbox
+        projection = dict(EMAIL_LIST_PROJECTION, score={"$meta": "textScore"})
+        documents = await self.async_collection.find(query, projection) \
+            .sort([("score", {"$meta": "textScore"})] + EMAIL_SORT) \
+            .skip(offset).limit(limit + 1).to_list(limit + 1)
+        return documents[:limit], len(documents) > limit
+
+    def email_documents(self, emails_data, mailbox: str = None) -> List[dict]:
+        """
+        EmailDB documents of Graph messages; malformed messages are skipped
+        with INGEST_VALIDATION=lenient and raise ValueError with strict
+        """
+        strict = settings.INGEST_VALIDATION == "strict"
+        created_at = datetime.utcnow()
+        documents = []
+        for email in emails_data:
+            try:
+                email_doc = to_email_document(email, mailbox, created_at=created_at, strict=strict)
+            except (AttributeError, KeyError, TypeError, ValueError) as e:
+                if strict:
+                    raise
+                # Lenient mode: a malformed message does not fail the whole page
+                logger.warning(f"Skipping malformed message {email.get('id')!r}: {e!r}")
+                continue
+            documents.append(email_doc)
+        return documents
+
+    def _encoded_documents(self, email_docs: List[dict]) -> List[Tuple[dict, Optional[bytes]]]:
+        # Copies of the documents with their body fields as stored, and the
+        # body to upload to GridFS if any
+        documents = []
+        for email_doc in email_docs:
+            document = dict(email_doc)
+            encoded = encode_body(document.pop("body"), document["is_html"])
+            document.update(encoded.fields)
+            documents.append((document, encoded.blob))
+        return documents
+
+    def _upsert_operations(self, documents: List[Tuple[dict, Optional[bytes]]]):
+        # Upsert emails keyed on email_id, so re-fetched messages are not
+        # stored twice
+        operations = []
+        for email_doc, _ in documents:
+            # created_at is only written the first time the email is seen
+            created_at = email_doc.pop("created_at")
+            operations.append(UpdateOne(
+                {"email_id": email_doc["email_id"]},
+                {"$set": email_doc, "$setOnInsert": {"created_at": created_at}},
+                upsert=True
+            ))
+
+        return operations
+
+    def _store_result(self, result) -> EmailStoreResult:
+        return EmailStoreResult(
+            inserted=result.upserted_count,
+            updated=result.modified_count,
+            unchanged=result.matched_count - result.modified_count
+        )
+
+def to_email_document(email: dict, mailbox: str = None, created_at: Optional[datetime] = None,
+                      strict: Optional[bool] = None) -> dict:
+    """
+    Convert a Microsoft Graph message into an EmailDB document, validated
+    through the EmailDB model with INGEST_VALIDATION=strict and extracted
+    directly otherwise
+    """
+    if strict is None:
+        strict = settings.INGEST_VALIDATION == "strict"
+    if not strict:
+        return extract_email_document(email, mailbox, created_at)
+
+    # Extract email data
+    email_id = email.get("id")
+    subject = email.get("subject", "")
+    sender = email.get("sender", {}).get("emailAddress", {}).get("address", "")
+    to_recipients = [r.get("emailAddress", {}).get("address", "") for r in email.get("toRecipients", [])]
+    cc_recipients = [r.get("emailAddress", {}).get("address", "") for r in email.get("ccRecipients", [])]
+    bcc_recipients = [r.get("emailAddress", {}).get("address", "") for r in email.get("bccRecipients", [])]
+    body = email.get("body", {}).get("content", "")
+    is_html = email.get("body", {}).get("contentType", "") == "html"
+    received_datetime = email.get("receivedDateTime")
+
+    # Create email document
+    return EmailDB(
+        email_id=email_id,
+        subject=subject,
+        sender=sender,
+        recipients=to_recipients,
+        cc_recipients=cc_recipients,
+        bcc_recipients=bcc_recipients,
+        body=body,
+        is_html=is_html,
+        has_attachments=bool(email.get("hasAttachments")),
+        received_datetime=received_datetime,
+        mailbox=mailbox,
+        created_at=created_at or datetime.utcnow()
+    ).dict()
+
+def extract_email_document(email: dict, mailbox: str = None, created_at: Optional[datetime] = None) -> dict:
+    """
+    Build the same document as the EmailDB model without creating a model per
+    message. Missing or null fields get their EmailDB defaults; a message
+    without id or with an unparsable receivedDateTime raises.
+    """
+    body = email.get("body") or _EMPTY
+    return {
+        "email_id": email["id"],
+        "subject": email.get("subject") or "",
+        "sender": ((email.get("sender") or _EMPTY).get("emailAddress") or _EMPTY).get("address") or "",
+        "recipients": _addresses(email.get("toRecipients")),
+        "cc_recipients": _addresses(email.get("ccRecipients")),
+        "bcc_recipients": _addresses(email.get("bccRecipients")),
+        "body": body.get("content") or "",
+        "is_html": body.get("contentType") == "html",
+        "has_attachments": bool(email.get("hasAttachments")),
+        "received_datetime": parse_graph_datetime(email["receivedDateTime"]),
+        "mailbox": mailbox,
+        "created_at": created_at or datetime.utcnow()
+    }
+
+def _addresses(recipients: Optional[list]) -> List[str]:
+    return [(recipient.get("emailAddress") or _EMPTY).get("address") or "" for recipient in recipients or ()]
+
+def parse_graph_datetime(value: str) -> datetime:
+    """
+    Parse a Graph timestamp like 2023-01-01T10:00:00Z with
+    datetime.fromisoformat, falling back to pydantic's parser for the ISO 8601
+    forms it does not accept
+    """
+    try:
+        return datetime.fromisoformat(value[:-1] + "+00:00" if value.endswith("Z") else value)
+    except ValueError:
+        return parse_datetime(value)
+
+def email_filter(sender: Optional[str] = None, recipient: Optional[str] = None, mailbox: Optional[str] = None,
+                 received_after: Optional[datetime] = None, received_before: Optional[datetime] = None) -> dict:
+    """
+    MongoDB filter of the stored email listing and export parameters
+    """
+    query = {}
+    if sender:
+        query["sender"] = sender
+    if recipient:
+        query["recipients"] = recipient
+    if mailbox:
+        query["mailbox"] = mailbox
+    if received_after or received_before:
+        query["received_datetime"] = {}
+        if received_after:
+            query["received_datetime"]["$gte"] = received_after
+        if received_before:
+            query["received_datetime"]["$lt"] = received_before
+    return query
+
+def encode_cursor(document: dict) -> str:
+    """
+    Opaque cursor pointing after `document` in EMAIL_SORT order
+    """
+    position = {"r": document["received_datetime"].isoformat(), "i": str(document["_id"])}
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(position["r"]), ObjectId(position["i"])
+    except (ValueError, KeyError, TypeError, InvalidId) as e:
+        raise InvalidCursorError(f"Invalid cursor: {cursor}") from e
@@ -0,0 +1,58 @@
+import logging
+from datetime import datetime
+from typing import List, Optional
+
+from app.db.mongodb import get_async_mailbox_collection, get_mailbox_collection
+
+logger = logging.getLogger(__name__)
+
+class MailboxRepository:
+    def __init__(self):
+        # Set MongoDB collection, read by the scheduler's sync mailbox listing
+        self.collection = get_mailbox_collection()
+        # Motor collection used by every other method
+        self.async_collection = get_async_mailbox_collection()
+
+    async def add_mailbox_async(self, address: str) -> dict:
+        """
+        Register (or re-enable) a mailbox for scheduled retrieval
+        """
+        address = address.lower()
+        await self.async_collection.update_one(*_enable_update(address), upsert=True)
+        return await self.async_collection.find_one({"_id": address})
+
+    async def disable_mailbox_async(self, address: str) -> bool:
+        result = await self.async_collection.update_one({"_id": address.lower()}, {"$set": {"enabled": False}})
+        return result.matched_count == 1
+
+    def list_mailboxes(self, enabled_only: bool = False) -> List[dict]:
+        query = {"enabled": True} if enabled_only else {}
+        return list(self.collection.find(query).sort("_id", 1))
+
+    async def list_mailboxes_async(self, enabled_only: bool = False) -> List[dict]:
+        query = {"enabled": True} if enabled_only else {}
+        return await self.async_collection.find(query).sort("_id", 1).to_list(None)
+
+    async def mark_running_async(self, address: str, started_at: datetime):
+        await self.async_collection.update_one({"_id": address}, {"$set": {"running": True, "last_run_at": started_at}})
+
+    async def record_run_async(self, address: str, duration: float, error: Optional[str] = None):
+        """
+        Store the outcome of a retrieval run of a mailbox
+        """
+        try:
+            await self.async_collection.update_one({"_id": address}, {"$set": _run_update(duration, error)})
+        except Exception as e:
+            logger.error(f"Failed to record retrieval run of {address}: {e}")
+
+def _enable_update(address: str):
+    return (
+        {"_id": address},
+        {"$set": {"enabled": True}, "$setOnInsert": {"created_at": datetime.utcnow(), "running": False}}
+    )
+
+def _run_update(duration: float, error: Optional[str]) -> dict:
+    update = {"running": False, "last_duration": duration, "last_error": error}
+    if error is None:
+        update["last_success_at"] = datetime.utcnow()
+    return update
@@ -0,0 +1,147 @@
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ReturnDocument
+
+from app.db.mongodb import get_async_outbound_collection
+from app.models.email import EmailSendRequest, OutboundEmailStatus
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+class OutboundEmailRepository:
+    def __init__(self):
+        # Motor collection (API routes and send workers)
+        self.async_collection = get_async_outbound_collection()
+
+    async def enqueue_async(self, email_request: EmailSendRequest) -> str:
+        """
+        Persist an email in the pending state and return its queue id
+        """
+        try:
+            result = await self.async_collection.insert_one(self._pending_document(email_request))
+        except Exception as e:
+            logger.error(f"Failed to enqueue email: {e}")
+            raise
+        return str(result.inserted_id)
+
+    async def count_queued_async(self) -> int:
+        """
+        Number of emails waiting to be sent or being sent
+        """
+        return await self.async_collection.count_documents(QUEUED_FILTER)
+
+    async def queue_depths_async(self) -> Dict[str, int]:
+        """
+        Number of queued emails per status (pending and in-flight)
+        """
+        depths = {OutboundEmailStatus.PENDING.value: 0, OutboundEmailStatus.IN_FLIGHT.value: 0}
+        pipeline = [{"$match": QUEUED_FILTER}, {"$group": {"_id": "$status", "count": {"$sum": 1}}}]
+        async for group in self.async_collection.aggregate(pipeline):
+            depths[group["_id"]] = group["count"]
+        return depths
+
+    async def claim_next_async(self) -> Optional[dict]:
+        """
+        Atomically move the oldest pending email to in-flight. In-flight emails
+        whose lease expired (their worker crashed) are claimed again; every
+        claim gets a new `claim_id` so only its holder can renew the lease.
+        """
+        return await self.async_collection.find_one_and_update(*self._claim_query(), sort=[("created_at", 1)],
+                                                               return_document=ReturnDocument.AFTER)
+
+    async def renew_lease_async(self, queue_id, claim_id: str) -> bool:
+        """
+        Push the lease of an email being sent forward so it is not claimed
+        again. Returns False when the claim was lost to another worker.
+        """
+        result = await self.async_collection.update_one(
+            {"_id": queue_id, "status": OutboundEmailStatus.IN_FLIGHT.value, "claim_id": claim_id},
+            {"$set": {"claimed_at": datetime.utcnow()}}
+        )
+        return result.matched_count == 1
+
+    async def mark_sent_async(self, queue_id):
+        await self._set_status_async(queue_id, OutboundEmailStatus.SENT, error=None)
+
+    async def mark_failed_async(self, queue_id, error: str, retry: bool, retry_delay: float = 0):
+        """
+        Record a failed attempt, putting the email back in the queue when it
+        has attempts left; it is not claimed again for `retry_delay` seconds
+        """
+        status = OutboundEmailStatus.PENDING if retry else OutboundEmailStatus.FAILED
+        await self._set_status_async(queue_id, status, error=error, not_before=_not_before(retry, retry_delay))
+
+    async def mark_parts_sent_async(self, queue_id, parts_sent: int):
+        """
+        Record how many of the emails an email was split into are sent, so a
+        retry does not send them again
+        """
+        await self.async_collection.update_one(
+            {"_id": queue_id}, {"$set": {"parts_sent": parts_sent, "updated_at": datetime.utcnow()}}
+        )
+
+    async def get_async(self, queue_id: str) -> Optional[dict]:
+        object_id = _object_id(queue_id)
+        if object_id is None:
+            return None
+        return await self.async_collection.find_one({"_id": object_id})
+
+    def _pending_document(self, email_request: EmailSendRequest) -> dict:
+        now = datetime.utcnow()
+        return {
+            "status": OutboundEmailStatus.PENDING.value,
+            "request": email_request.dict(),
+            "attempts": 0,
+            "error": None,
+            "created_at": now,
+            "updated_at": now
+        }
+
+    def _claim_query(self):
+        now = datetime.utcnow()
+        lease_expired = now - timedelta(seconds=settings.SEND_LEASE_TIMEOUT)
+        return (
+            {"$or": [
+                # Emails waiting out a retry delay are skipped
+                {"status": OutboundEmailStatus.PENDING.value,
+                 "$or": [{"not_before": None}, {"not_before": {"$lte": now}}]},
+                {"status": OutboundEmailStatus.IN_FLIGHT.value, "claimed_at": {"$lt": lease_expired}}
+            ]},
+            {
+                "$set": {"status": OutboundEmailStatus.IN_FLIGHT.value, "claim_id": uuid.uuid4().hex,
+                         "claimed_at": now, "updated_at": now},
+                "$inc": {"attempts": 1}
+            }
+        )
+
+    async def _set_status_async(self, queue_id, status: OutboundEmailStatus, error: Optional[str],
+                                not_before: Optional[datetime] = None):
+        try:
+            await self.async_collection.update_one(*_status_update(queue_id, status, error, not_before))
+        except Exception as e:
+            logger.error(f"Failed to update outbound email {queue_id}: {e}")
+            raise
+
+QUEUED_FILTER = {"status": {"$in": [OutboundEmailStatus.PENDING.value, OutboundEmailStatus.IN_FLIGHT.value]}}
+
+def _object_id(queue_id) -> Optional[ObjectId]:
+    try:
+        return ObjectId(queue_id)
+    except (InvalidId, TypeError):
+        return None
+
+def _not_before(retry: bool, retry_delay: float) -> Optional[datetime]:
+    if not retry or retry_delay <= 0:
+        return None
+    return datetime.utcnow() + timedelta(seconds=retry_delay)
+
+def _status_update(queue_id, status: OutboundEmailStatus, error: Optional[str], not_before: Optional[datetime] = None):
+    return (
+        {"_id": ObjectId(queue_id)},
+        {"$set": {"status": status.value, "error": error, "not_before": not_before, "updated_at": datetime.utcnow()}}
+    )
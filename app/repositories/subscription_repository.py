@@ -0,0 +1,46 @@
+import logging
+from datetime import datetime
+from typing import List, Optional
+
+from app.db.mongodb import get_async_subscription_collection
+
+logger = logging.getLogger(__name__)
+
+class SubscriptionRepository:
+    def __init__(self):
+        # Motor collection (subscription jobs, notification worker)
+        self.async_collection = get_async_subscription_collection()
+
+    async def get_subscription_async(self, mailbox: str) -> Optional[dict]:
+        return await self.async_collection.find_one({"_id": mailbox})
+
+    async def get_by_subscription_id_async(self, subscription_id: str) -> Optional[dict]:
+        return await self.async_collection.find_one({"subscription_id": subscription_id})
+
+    async def list_subscribed_mailboxes_async(self) -> List[str]:
+        return [subscription["_id"] async for subscription in self.async_collection.find({}, {"_id": 1})]
+
+    async def save_subscription_async(self, mailbox: str, subscription_id: str, expiration_datetime: datetime):
+        """
+        Store the Graph change-notification subscription of a mailbox
+        """
+        try:
+            await self.async_collection.update_one(
+                *_subscription_update(mailbox, subscription_id, expiration_datetime), upsert=True
+            )
+        except Exception as e:
+            logger.error(f"Failed to save subscription of {mailbox}: {e}")
+            raise
+
+    async def delete_subscription_async(self, mailbox: str):
+        await self.async_collection.delete_one({"_id": mailbox})
+
+def _subscription_update(mailbox: str, subscription_id: str, expiration_datetime: datetime):
+    return (
+        {"_id": mailbox},
+        {"$set": {
+            "subscription_id": subscription_id,
+            "expiration_datetime": expiration_datetime,
+            "updated_at": datetime.utcnow()
+        }}
+    )
@@ -0,0 +1,40 @@
+import logging
+from datetime import datetime
+from typing import Optional
+
+from app.db.mongodb import get_async_sync_state_collection
+
+logger = logging.getLogger(__name__)
+
+class SyncStateRepository:
+    def __init__(self):
+        # Motor collection (retrieval jobs)
+        self.async_collection = get_async_sync_state_collection()
+
+    async def get_delta_link_async(self, mailbox: str) -> Optional[str]:
+        """
+        Get the stored deltaLink for a mailbox, or None if it has never been synced
+        """
+        state = await self.async_collection.find_one({"_id": mailbox})
+        if state is None:
+            return None
+        return state.get("delta_link")
+
+    async def save_delta_link_async(self, mailbox: str, delta_link: str):
+        """
+        Store the deltaLink returned by the last completed sync of a mailbox
+        """
+        try:
+            await self.async_collection.update_one(*_delta_link_update(mailbox, delta_link), upsert=True)
+        except Exception as e:
+            logger.error(f"Failed to save delta link for {mailbox}: {e}")
+            raise
+
+    async def clear_delta_link_async(self, mailbox: str):
+        """
+        Forget the deltaLink of a mailbox so the next sync starts from scratch
+        """
+        await self.async_collection.update_one({"_id": mailbox}, {"$unset": {"delta_link": ""}})
+
+def _delta_link_update(mailbox: str, delta_link: str):
+    return {"_id": mailbox}, {"$set": {"delta_link": delta_link, "updated_at": datetime.utcnow()}}
@@ -0,0 +1,177 @@
+import abc
+import bisect
+import hashlib
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from app.backends import create_backend, lazy_attribute
+from app.db.mongodb import get_replica_collection
+from app.metrics import SCHEDULER_REPLICAS
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+class ReplicaRegistry(abc.ABC):
+    """
+    Leases of the scheduler replicas. A replica renews its lease on every
+    heartbeat; a replica whose lease expired is no longer live and its
+    mailboxes move to the others.
+    """
+    @abc.abstractmethod
+    def heartbeat(self, replica_id: str, ttl: float):
+        """
+        Create or renew the lease of a replica for `ttl` seconds
+        """
+
+    @abc.abstractmethod
+    def live_replicas(self) -> List[str]:
+        """
+        Ids of the replicas holding an unexpired lease, sorted
+        """
+
+    @abc.abstractmethod
+    def leave(self, replica_id: str):
+        """
+        Drop the lease of a replica that is shutting down
+        """
+
+class InMemoryReplicaRegistry(ReplicaRegistry):
+    """
+    Replica registry local to the process: a single replica polls every
+    mailbox. Also used by tests running several schedulers in one process.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._leases: Dict[str, datetime] = {}
+
+    def heartbeat(self, replica_id: str, ttl: float):
+        with self._lock:
+            self._leases[replica_id] = datetime.utcnow() + timedelta(seconds=ttl)
+
+    def live_replicas(self) -> List[str]:
+        now = datetime.utcnow()
+        with self._lock:
+            return sorted(replica_id for replica_id, expires_at in self._leases.items() if expires_at > now)
+
+    def leave(self, replica_id: str):
+        with self._lock:
+            self._leases.pop(replica_id, None)
+
+class MongoReplicaRegistry(ReplicaRegistry):
+    """
+    Replica registry shared by every process and host through MongoDB. A TTL
+    index removes the leases of replicas that died without leaving.
+    """
+    collection = lazy_attribute(get_replica_collection)
+
+    def __init__(self, collection=None):
+        self._collection = collection
+
+    def heartbeat(self, replica_id: str, ttl: float):
+        now = datetime.utcnow()
+        self.collection.update_one(
+            {"_id": replica_id},
+            {"$set": {"expires_at": now + timedelta(seconds=ttl), "heartbeat_at": now},
+             "$setOnInsert": {"joined_at": now}},
+            upsert=True
+        )
+
+    def live_replicas(self) -> List[str]:
+        # The TTL monitor runs about once a minute, so expired leases may still be there
+        leases = self.collection.find({"expires_at": {"$gt": datetime.utcnow()}}, {"_id": 1})
+        return sorted(lease["_id"] for lease in leases)
+
+    def leave(self, replica_id: str):
+        self.collection.delete_one({"_id": replica_id})
+
+def create_replica_registry() -> ReplicaRegistry:
+    """
+    Create the replica registry selected by SCHEDULER_COORDINATION
+    """
+    return create_backend("SCHEDULER_COORDINATION", settings.SCHEDULER_COORDINATION,
+                          {"memory": InMemoryReplicaRegistry, "mongo": MongoReplicaRegistry}, default="memory")
+
+def _ring_hash(key: str) -> int:
+    # Python's hash() differs between processes, every replica must agree
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+class HashRing:
+    """
+    Consistent hash ring of replicas. Every replica is placed at
+    `virtual_nodes` points so the mailboxes split evenly; when a replica
+    joins or leaves only the mailboxes next to its points change owner.
+    """
+    def __init__(self, replicas: List[str], virtual_nodes: int = 100):
+        points = sorted((_ring_hash(f"{replica}#{index}"), replica)
+                        for replica in replicas for index in range(virtual_nodes))
+        self._hashes = [point for point, _ in points]
+        self._replicas = [replica for _, replica in points]
+
+    def owner(self, key: str) -> Optional[str]:
+        """
+        Replica owning `key`: the first point clockwise from its hash
+        """
+        if not self._hashes:
+            return None
+        index = bisect.bisect(self._hashes, _ring_hash(key)) % len(self._hashes)
+        return self._replicas[index]
+
+class SchedulerCoordinator:
+    """
+    Shards mailboxes across the scheduler replicas. Each replica heartbeats
+    its lease and polls the mailboxes the hash ring of the live replicas
+    assigns to it. A replica that could not renew its lease for
+    SCHEDULER_LEASE_TTL seconds owns nothing, since the others have taken
+    its mailboxes over by then.
+    """
+    def __init__(self, registry: ReplicaRegistry = None, replica_id: str = None):
+        self.registry = registry or create_replica_registry()
+        self.replica_id = replica_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.replicas: List[str] = []
+        self._ring = HashRing([])
+        self._lease_until = 0.0
+
+    def heartbeat(self) -> bool:
+        """
+        Renew the lease and refresh the live replicas. Returns whether the
+        replicas changed, i.e. whether mailboxes need rebalancing.
+        """
+        try:
+            renewed_at = time.monotonic()
+            self.registry.heartbeat(self.replica_id, settings.SCHEDULER_LEASE_TTL)
+            replicas = self.registry.live_replicas()
+        except Exception as e:
+            logger.warning(f"Scheduler heartbeat of {self.replica_id} failed: {str(e)}")
+            return False
+        if self.replica_id not in replicas:
+            replicas = sorted(replicas + [self.replica_id])
+        self._lease_until = renewed_at + settings.SCHEDULER_LEASE_TTL
+        SCHEDULER_REPLICAS.set(len(replicas))
+        if replicas == self.replicas:
+            return False
+        logger.info(f"Scheduler replicas changed from {len(self.replicas)} to {len(replicas)}: {', '.join(replicas)}")
+        self.replicas = replicas
+        self._ring = HashRing(replicas)
+        return True
+
+    def owns(self, mailbox: str) -> bool:
+        if time.monotonic() > self._lease_until:
+            return False
+        return self._ring.owner(mailbox) == self.replica_id
+
+    def leave(self):
+        """
+        Give the lease up so the other replicas take the mailboxes over at
+        their next heartbeat instead of after the lease expires
+        """
+        self._lease_until = 0.0
+        try:
+            self.registry.leave(self.replica_id)
+        except Exception as e:
+            logger.warning(f"Failed to remove the lease of scheduler replica {self.replica_id}: {str(e)}")
@@ -1,5 +1,19 @@
-from apscheduler.schedulers.background import BackgroundScheduler
-from app.services.email_service import EmailService
+import asyncio
+import time
+import zlib
+from datetime import datetime, timedelta
+
+from apscheduler.events import (
+    EVENT_JOB_ERROR, EVENT_JOB_EXECUTED, EVENT_JOB_MAX_INSTANCES, EVENT_JOB_MISSED, EVENT_JOB_SUBMITTED
+)
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from app.dependencies import container
+from app.metrics import (
+    SCHEDULER_JOB_DURATION, SCHEDULER_JOB_ERRORS, SCHEDULER_JOB_LAG, SCHEDULER_JOB_MISSED,
+    SCHEDULER_JOB_OVERLAPS, SCHEDULER_JOBS_RUNNING, SCHEDULER_OWNED_MAILBOXES
+)
+from app.schedulers.coordination import SchedulerCoordinator
+from app.services.subscription_service import SubscriptionService
 from config import settings
 import logging
 
@@ -7,27 +21,250 @@ import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+REGISTRY_JOB_ID = "sync_mailbox_jobs"
+SUBSCRIPTION_JOB_ID = "renew_subscriptions"
+HEARTBEAT_JOB_ID = "scheduler_heartbeat"
+MAILBOX_JOB_PREFIX = "retrieve_emails:"
+
+def job_kind(job_id: str) -> str:
+    """
+    Metric label of a job: the per-mailbox retrieval jobs share one label
+    """
+    return MAILBOX_JOB_PREFIX[:-1] if job_id.startswith(MAILBOX_JOB_PREFIX) else job_id
+
+def mailbox_addresses(mailboxes: list) -> list:
+    """
+    Addresses of registered mailboxes, or the signed-in user's ("me") without any
+    """
+    return [mailbox["_id"] for mailbox in mailboxes] or ["me"]
+
+class MailboxScheduler:
+    """
+    Schedules one retrieval job per registered mailbox. Jobs are coroutines
+    running on the application's event loop so they share the pooled Graph API
+    client with the routes; at most MAILBOX_CONCURRENCY of them run at once.
+    With several replicas each schedules only the mailboxes its coordinator
+    assigns to it.
+    """
+    def __init__(self, scheduler: AsyncIOScheduler = None):
+        self.scheduler = scheduler or AsyncIOScheduler()
+        self.email_service = None
+        self.mailbox_repository = None
+        self.subscription_service = None
+        # Without a coordinator (tests) every mailbox is polled
+        self.coordinator: SchedulerCoordinator = None
+        self._semaphore = None
+        self._job_starts = {}
+        self.scheduler.add_listener(
+            self.record_job_event,
+            EVENT_JOB_SUBMITTED | EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MAX_INSTANCES | EVENT_JOB_MISSED
+        )
+
+    @property
+    def retrieval_interval(self) -> int:
+        """
+        Polling interval of a mailbox. With change notifications enabled polling
+        only runs as a low-frequency fallback for missed notifications.
+        """
+        if settings.webhooks_active:
+            return settings.WEBHOOK_FALLBACK_INTERVAL
+        return settings.EMAIL_RETRIEVAL_INTERVAL
+
+    def record_job_event(self, event):
+        """
+        Record job lag, run time, overlaps and misses from the scheduler's events
+        """
+        job = job_kind(event.job_id)
+        if event.code == EVENT_JOB_SUBMITTED:
+            SCHEDULER_JOBS_RUNNING.labels(job).inc()
+            self._job_starts[event.job_id] = time.monotonic()
+            if event.scheduled_run_times:
+                lag = datetime.now(self.scheduler.timezone) - event.scheduled_run_times[-1]
+                SCHEDULER_JOB_LAG.labels(job).observe(max(lag.total_seconds(), 0))
+        elif event.code in (EVENT_JOB_EXECUTED, EVENT_JOB_ERROR):
+            started = self._job_starts.pop(event.job_id, None)
+            if started is not None:
+                SCHEDULER_JOBS_RUNNING.labels(job).dec()
+                SCHEDULER_JOB_DURATION.labels(job).observe(time.monotonic() - started)
+            if event.code == EVENT_JOB_ERROR:
+                SCHEDULER_JOB_ERRORS.labels(job).inc()
+        elif event.code == EVENT_JOB_MAX_INSTANCES:
+            # The previous run is still going; max_instances=1 skipped this one
+            SCHEDULER_JOB_OVERLAPS.labels(job).inc()
+        elif event.code == EVENT_JOB_MISSED:
+            SCHEDULER_JOB_MISSED.labels(job).inc()
+
+    def start(self):
+        """
+        Start the scheduler and the job keeping mailbox jobs in sync with the registry
+        """
+        self.email_service = self.email_service or container.email_service
+        self.mailbox_repository = self.mailbox_repository or container.mailbox_repository
+        self._semaphore = asyncio.Semaphore(settings.MAILBOX_CONCURRENCY)
+        self.coordinator = self.coordinator or SchedulerCoordinator()
+        # Join before the first registry sync so it already sees this replica's share
+        self.coordinator.heartbeat()
+        self.scheduler.add_job(
+            self.heartbeat,
+            'interval',
+            seconds=settings.SCHEDULER_HEARTBEAT_INTERVAL,
+            id=HEARTBEAT_JOB_ID,
+            max_instances=1,
+            coalesce=True,
+            replace_existing=True
+        )
+        self.scheduler.add_job(
+            self.sync_mailbox_jobs,
+            'interval',
+            seconds=settings.MAILBOX_REGISTRY_REFRESH_INTERVAL,
+            id=REGISTRY_JOB_ID,
+            next_run_time=datetime.now(self.scheduler.timezone),
+            max_instances=1,
+            coalesce=True,
+            replace_existing=True
+        )
+        if settings.WEBHOOKS_ENABLED and not settings.WEBHOOK_CLIENT_STATE:
+            logger.error("WEBHOOKS_ENABLED is set without WEBHOOK_CLIENT_STATE, change notifications stay off")
+        if settings.webhooks_active:
+            self.subscription_service = self.subscription_service or SubscriptionService()
+            self.scheduler.add_job(
+                self.renew_subscriptions,
+                'interval',
+                seconds=settings.WEBHOOK_RENEWAL_INTERVAL,
+                id=SUBSCRIPTION_JOB_ID,
+                next_run_time=datetime.now(self.scheduler.timezone),
+                max_instances=1,
+                coalesce=True,
+                replace_existing=True
+            )
+        if not self.scheduler.running:
+            self.scheduler.start()
+
+    def stop(self):
+        if self.scheduler.running:
+            self.scheduler.shutdown(wait=False)
+        if self.coordinator is not None:
+            self.coordinator.leave()
+
+    def heartbeat(self):
+        """
+        Renew this replica's lease, and rebalance the mailbox jobs at once
+        when replicas joined or left
+        """
+        if self.coordinator.heartbeat():
+            self.request_sync()
+
+    def owns(self, mailbox: str) -> bool:
+        return self.coordinator is None or self.coordinator.owns(mailbox)
+
+    def request_sync(self):
+        """
+        Re-read the mailbox registry now instead of at the next refresh
+        interval, and bring the subscriptions in line with it
+        """
+        if not self.scheduler.running:
+            return
+        for job_id in (REGISTRY_JOB_ID, SUBSCRIPTION_JOB_ID):
+            if self.scheduler.get_job(job_id):
+                self.scheduler.modify_job(job_id, next_run_time=datetime.now(self.scheduler.timezone))
+
+    def start_offset(self, mailbox: str) -> float:
+        """
+        Stable offset of a mailbox within the retrieval interval, so mailboxes
+        are spread across the interval instead of all starting at once
+        """
+        fraction = (zlib.crc32(mailbox.encode()) % 10000) / 10000
+        return fraction * self.retrieval_interval
+
+    def enabled_mailboxes(self) -> list:
+        return mailbox_addresses(self.mailbox_repository.list_mailboxes(enabled_only=True))
+
+    def owned_mailboxes(self) -> list:
+        """
+        Enabled mailboxes assigned to this replica
+        """
+        return [mailbox for mailbox in self.enabled_mailboxes() if self.owns(mailbox)]
+
+    def sync_mailbox_jobs(self):
+        """
+        Add a retrieval job for every enabled mailbox this replica owns and
+        remove the jobs of mailboxes that were disabled or moved to another
+        replica. Without registered mailboxes the signed-in user's mailbox
+        ("me") is retrieved.
+        """
+        mailboxes = self.owned_mailboxes()
+        SCHEDULER_OWNED_MAILBOXES.set(len(mailboxes))
+        wanted = {f"{MAILBOX_JOB_PREFIX}{mailbox}": mailbox for mailbox in mailboxes}
+
+        for job in self.scheduler.get_jobs():
+            if job.id.startswith(MAILBOX_JOB_PREFIX) and job.id not in wanted:
+                job.remove()
+                logger.info(f"Stopped email retrieval for {job.id[len(MAILBOX_JOB_PREFIX):]}")
+
+        now = datetime.now(self.scheduler.timezone)
+        for job_id, mailbox in wanted.items():
+            if self.scheduler.get_job(job_id):
+                continue
+            self.scheduler.add_job(
+                self.retrieve_mailbox,
+                'interval',
+                seconds=self.retrieval_interval,
+                args=[mailbox],
+                id=job_id,
+                next_run_time=now + timedelta(seconds=self.start_offset(mailbox)),
+                # Never run the same mailbox twice at once; collapse missed runs into one
+                max_instances=1,
+                coalesce=True,
+                misfire_grace_time=self.retrieval_interval
+            )
+            logger.info(f"Scheduled email retrieval for {mailbox} every {self.retrieval_interval} seconds")
+
+    async def renew_subscriptions(self):
+        """
+        Create or renew the change-notification subscription of every mailbox
+        this replica owns, and delete the subscriptions of mailboxes disabled
+        since. The subscription of a mailbox moved to another replica is
+        renewed by its new owner.
+        """
+        enabled = mailbox_addresses(await self.mailbox_repository.list_mailboxes_async(enabled_only=True))
+        await self.subscription_service.ensure_subscriptions([mailbox for mailbox in enabled if self.owns(mailbox)])
+        # Each stale subscription is deleted by the replica the mailbox would belong to
+        subscribed = await self.subscription_service.subscription_repository.list_subscribed_mailboxes_async()
+        stale = [mailbox for mailbox in subscribed if mailbox not in enabled and self.owns(mailbox)]
+        await self.subscription_service.remove_subscriptions(stale)
+
+    async def retrieve_mailbox(self, mailbox: str):
+        """
+        Retrieve the emails of one mailbox and record the run in the registry
+        """
+        # The job may outlive the ownership until the next registry sync
+        if not self.owns(mailbox):
+            logger.info(f"Skipped email retrieval for {mailbox}, now polled by another replica")
+            return
+        async with self._semaphore:
+            started = time.monotonic()
+            await self.mailbox_repository.mark_running_async(mailbox, datetime.utcnow())
+            error = None
+            try:
+                await self.email_service.retrieve_emails(mailbox)
+            except Exception as e:
+                error = str(e)
+                SCHEDULER_JOB_ERRORS.labels(job_kind(MAILBOX_JOB_PREFIX)).inc()
+                logger.error(f"Email retrieval for {mailbox} failed: {error}")
+            finally:
+                await self.mailbox_repository.record_run_async(mailbox, time.monotonic() - started, error)
+
 # Create a scheduler instance
-scheduler = BackgroundScheduler()
+mailbox_scheduler = MailboxScheduler()
+scheduler = mailbox_scheduler.scheduler
 
 def start_scheduler():
     """
     Start the background scheduler for periodic email retrieval
     """
     try:
-        # Add job to retrieve emails at regular intervals
-        scheduler.add_job(
-            EmailService().retrieve_emails,
-            'interval',
-            seconds=settings.EMAIL_RETRIEVAL_INTERVAL,
-            id='retrieve_emails_job',
-            replace_existing=True
-        )
-        
-        # Start the scheduler
-        if not scheduler.running:
-            scheduler.start()
-            logger.info(f"Email retrieval scheduler started. Running every {settings.EMAIL_RETRIEVAL_INTERVAL} seconds")
+        mailbox_scheduler.start()
+        logger.info(f"Email retrieval scheduler started. Running every {mailbox_scheduler.retrieval_interval} seconds")
     except Exception as e:
         logger.error(f"Failed to start scheduler: {str(e)}")
 
@@ -36,5 +273,5 @@ def stop_scheduler():
     Stop the background scheduler
     """
     if scheduler.running:
-        scheduler.shutdown()
-        logger.info("Email retrieval scheduler stopped")
\ No newline at end of file
+        mailbox_scheduler.stop()
+        logger.info("Email retrieval scheduler stopped")
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+from typing import List
+
+from app.exceptions import GraphAPIError
+from app.repositories.attachment_repository import AttachmentRepository
+from app.services.attachment_store import AttachmentBlobStore, create_attachment_store
+from app.services.graph_client import GraphClient, get_graph_client
+from app.services.graph_retry import parse_retry_after
+from app.services.token_service import token_cache
+from config import settings
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+FILE_ATTACHMENT_TYPE = "#microsoft.graph.fileAttachment"
+# Listing without contentBytes: contents are streamed separately from $value
+ATTACHMENT_SELECT_FIELDS = "id,name,contentType,size,isInline"
+
+class AttachmentService:
+    """
+    Downloads the file attachments of stored emails. Contents are streamed
+    from Graph straight into the attachment store chunk by chunk, so memory
+    use does not grow with the attachment size.
+    """
+    def __init__(self, graph_client: GraphClient = None, attachment_store: AttachmentBlobStore = None,
+                 attachment_repository: AttachmentRepository = None):
+        self.token_service = token_cache
+        self.graph_client = graph_client or get_graph_client()
+        self.attachment_store = attachment_store or create_attachment_store()
+        self.attachment_repository = attachment_repository or AttachmentRepository()
+
+    async def ingest_emails(self, mailbox: str, email_ids: List[str]) -> dict:
+        """
+        Download the attachments of several emails, ATTACHMENT_CONCURRENCY at
+        a time. A failing email is logged and does not stop the others.
+        """
+        semaphore = asyncio.Semaphore(settings.ATTACHMENT_CONCURRENCY)
+        summary = {"emails": len(email_ids), "attachments": 0, "bytes": 0, "skipped": 0, "failed": 0}
+
+        async def ingest(email_id):
+            async with semaphore:
+                try:
+                    result = await self.ingest_email(mailbox, email_id)
+                except Exception as e:
+                    logger.error(f"Failed to ingest attachments of {email_id}: {str(e)}")
+                    summary["failed"] += 1
+                    return
+                for key in ("attachments", "bytes", "skipped"):
+                    summary[key] += result[key]
+
+        await asyncio.gather(*[ingest(email_id) for email_id in email_ids])
+        if email_ids:
+            logger.info(f"Ingested {summary['attachments']} attachments ({summary['bytes']} bytes) of {mailbox}")
+        return summary
+
+    async def ingest_email(self, mailbox: str, email_id: str) -> dict:
+        """
+        List the attachments of an email and download the ones not stored yet
+        """
+        headers = {"Authorization": f"Bearer {await self.token_service.get_access_token_async()}"}
+        messages_url = f"{settings.GRAPH_API_BASE_URL}/{'me' if mailbox == 'me' else f'users/{mailbox}'}/messages"
+        attachments_url = f"{messages_url}/{email_id}/attachments"
+        url = attachments_url
+        params = {"$select": ATTACHMENT_SELECT_FIELDS}
+        stored = await self.attachment_repository.stored_attachment_ids_async(email_id)
+        result = {"attachments": 0, "bytes": 0, "skipped": 0}
+
+        while url:
+            response = await self.graph_client.get(url, headers=headers, params=params)
+            params = None  # nextLink already contains the query
+            if response.status_code != 200:
+                raise GraphAPIError(
+                    f"Failed to list attachments: {response.status_code} - {response.text}",
+                    response.status_code,
+                    retry_after=parse_retry_after(response.headers.get("Retry-After"))
+                )
+            page = response.json()
+            for attachment in page.get("value", []):
+                if attachment.get("@odata.type") != FILE_ATTACHMENT_TYPE or attachment["id"] in stored:
+                    # Already stored, or an item/reference attachment without file content
+                    result["skipped"] += 1
+                    continue
+                sha256, size = await self.download(f"{attachments_url}/{attachment['id']}/$value", headers)
+                await self.attachment_repository.save_attachment_async(
+                    email_id, mailbox, attachment, sha256, size, self.attachment_store.name
+                )
+                result["attachments"] += 1
+                result["bytes"] += size
+            url = page.get("@odata.nextLink")
+        return result
+
+    async def download(self, url: str, headers: dict):
+        """
+        Stream raw attachment content from Graph into the attachment store
+        """
+        async with self.graph_client.stream("GET", url, headers=headers) as response:
+            if response.status_code != 200:
+                await response.aread()
+                raise GraphAPIError(
+                    f"Failed to download attachment: {response.status_code} - {response.text}",
+                    response.status_code,
+                    retry_after=parse_retry_after(response.headers.get("Retry-After"))
+                )
+            return await self.attachment_store.save(response.aiter_bytes(settings.ATTACHMENT_CHUNK_SIZE))
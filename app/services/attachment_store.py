@@ -0,0 +1,141 @@
+import abc
+import asyncio
+import hashlib
+import logging
+import os
+import uuid
+from typing import AsyncIterator, Optional, Tuple
+
+from app.backends import create_backend, lazy_attribute
+from app.db.mongodb import get_async_attachment_bucket
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+class AttachmentBlobStore(abc.ABC):
+    """
+    Content-addressed storage for attachment bytes.
+
+    `save` consumes a stream of chunks, hashing them on the way, and stores
+    the content under its SHA-256 unless it is already there, so a file
+    attached to many emails is stored once. Nothing holds more than one chunk
+    in memory.
+    """
+    name = None
+
+    @abc.abstractmethod
+    async def save(self, chunks: AsyncIterator[bytes]) -> Tuple[str, int]:
+        """
+        Store a stream of chunks and return its SHA-256 and size
+        """
+
+    @abc.abstractmethod
+    async def exists(self, sha256: str) -> bool:
+        pass
+
+    @abc.abstractmethod
+    def open(self, sha256: str) -> AsyncIterator[bytes]:
+        """
+        Read stored content back chunk by chunk
+        """
+
+class GridFSAttachmentStore(AttachmentBlobStore):
+    """
+    Attachments in a GridFS bucket, one file named after each SHA-256
+    """
+    name = "gridfs"
+    bucket = lazy_attribute(get_async_attachment_bucket)
+
+    def __init__(self, bucket=None):
+        self._bucket = bucket
+
+    async def save(self, chunks: AsyncIterator[bytes]) -> Tuple[str, int]:
+        digest = hashlib.sha256()
+        size = 0
+        # The hash is only known at the end: upload under a temporary name first
+        upload = self.bucket.open_upload_stream(f"partial-{uuid.uuid4().hex}")
+        try:
+            async for chunk in chunks:
+                digest.update(chunk)
+                size += len(chunk)
+                await upload.write(chunk)
+        except BaseException:
+            await upload.abort()
+            raise
+        await upload.close()
+
+        sha256 = digest.hexdigest()
+        if await self.exists(sha256):
+            await self.bucket.delete(upload._id)
+        else:
+            await self.bucket.rename(upload._id, sha256)
+        return sha256, size
+
+    async def exists(self, sha256: str) -> bool:
+        async for _ in self.bucket.find({"filename": sha256}).limit(1):
+            return True
+        return False
+
+    async def open(self, sha256: str) -> AsyncIterator[bytes]:
+        stream = await self.bucket.open_download_stream_by_name(sha256)
+        while True:
+            chunk = await stream.readchunk()
+            if not chunk:
+                return
+            yield chunk
+
+class LocalDiskAttachmentStore(AttachmentBlobStore):
+    """
+    Attachments as files under ATTACHMENT_DIR/<sha256[:2]>/<sha256>
+    """
+    name = "disk"
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = root or settings.ATTACHMENT_DIR
+
+    def path(self, sha256: str) -> str:
+        return os.path.join(self.root, sha256[:2], sha256)
+
+    async def save(self, chunks: AsyncIterator[bytes]) -> Tuple[str, int]:
+        os.makedirs(self.root, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        partial = os.path.join(self.root, f".partial-{uuid.uuid4().hex}")
+        try:
+            with open(partial, "wb") as f:
+                async for chunk in chunks:
+                    digest.update(chunk)
+                    size += len(chunk)
+                    # Keep disk writes off the event loop
+                    await asyncio.to_thread(f.write, chunk)
+            sha256 = digest.hexdigest()
+            path = self.path(sha256)
+            if os.path.exists(path):
+                os.remove(partial)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(partial, path)
+        except BaseException:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+        return sha256, size
+
+    async def exists(self, sha256: str) -> bool:
+        return os.path.exists(self.path(sha256))
+
+    async def open(self, sha256: str) -> AsyncIterator[bytes]:
+        with open(self.path(sha256), "rb") as f:
+            while True:
+                chunk = await asyncio.to_thread(f.read, settings.ATTACHMENT_CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+
+def create_attachment_store(storage: Optional[str] = None) -> AttachmentBlobStore:
+    """
+    Create the attachment store selected by ATTACHMENT_STORAGE, or the one
+    named by `storage` to read attachments stored under another setting
+    """
+    return create_backend("ATTACHMENT_STORAGE", storage or settings.ATTACHMENT_STORAGE,
+                          {"gridfs": GridFSAttachmentStore, "disk": LocalDiskAttachmentStore}, default="gridfs")
@@ -0,0 +1,70 @@
+import json
+from datetime import datetime
+from typing import AsyncIterator, List, Optional
+
+try:
+    import orjson
+except ImportError:  # optional dependency, the json module is used without it
+    orjson = None
+
+EXPORT_NDJSON = "ndjson"
+EXPORT_SSE = "sse"
+EXPORT_MEDIA_TYPES = {EXPORT_NDJSON: "application/x-ndjson", EXPORT_SSE: "text/event-stream"}
+# Fields of stored emails that can be exported (the StoredEmail fields)
+EXPORT_FIELDS = [
+    "email_id", "subject", "sender", "recipients", "cc_recipients", "bcc_recipients", "body", "body_size",
+    "is_html", "has_attachments", "received_datetime", "mailbox"
+]
+# Rows are sent in chunks of about this many bytes rather than one write each
+EXPORT_CHUNK_SIZE = 65536
+
+def parse_export_fields(fields: Optional[str]) -> List[str]:
+    """
+    Fields of a comma-separated `fields` parameter; all fields when empty.
+    Raises ValueError for unknown fields.
+    """
+    if not fields:
+        return list(EXPORT_FIELDS)
+    selected = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in selected if field not in EXPORT_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown export fields: {', '.join(unknown)}")
+    return selected
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{value.__class__.__name__} is not JSON serializable")
+
+def encode_row(document: dict) -> bytes:
+    """
+    JSON of a stored email document as exported: the MongoDB _id becomes
+    "id" and no model validation is done
+    """
+    row = {"id": str(document.pop("_id"))}
+    row.update(document)
+    if orjson is not None:
+        return orjson.dumps(row)
+    return json.dumps(row, default=_json_default, separators=(",", ":")).encode()
+
+async def export_stream(documents: AsyncIterator[dict], export_format: str = EXPORT_NDJSON) -> AsyncIterator[bytes]:
+    """
+    Encode exported emails as NDJSON lines or server-sent events. The SSE
+    stream ends with an "end" event carrying the number of emails.
+    """
+    buffer = bytearray()
+    count = 0
+    async for document in documents:
+        if export_format == EXPORT_SSE:
+            buffer += b"event: email\ndata: " + encode_row(document) + b"\n\n"
+        else:
+            buffer += encode_row(document) + b"\n"
+        count += 1
+        # The first row goes out at once so the client sees the export start
+        if count == 1 or len(buffer) >= EXPORT_CHUNK_SIZE:
+            yield bytes(buffer)
+            buffer.clear()
+    if export_format == EXPORT_SSE:
+        buffer += f'event: end\ndata: {{"count":{count}}}\n\n'.encode()
+    if buffer:
+        yield bytes(buffer)
@@ -1,11 +1,20 @@
+import asyncio
+import base64
 import logging
-import msal
 from datetime import datetime, timedelta
+from typing import Awaitable, Callable, List, Optional, Tuple
 
-import requests
+import httpx
 
-from app.models.email import EmailSendRequest
+from app.exceptions import GraphAPIError
+from app.models.email import EmailAttachment, EmailBatchResult, EmailSendRequest, EmailStoreResult
 from app.repositories.email_repository import EmailRepository
+from app.repositories.sync_state_repository import SyncStateRepository
+from app.services.attachment_service import AttachmentService
+from app.services.graph_client import GraphClient, decode_json, get_graph_client
+from app.services.graph_retry import mailbox_from_url, parse_retry_after
+from app.services.outbound_attachments import OutboundAttachmentStore
+from app.services.search_backend import SearchBackend, get_search_backend
 from app.services.token_service import token_cache
 from config import settings
 
@@ -13,18 +22,92 @@ from config import settings
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Microsoft Graph accepts at most 20 requests in one JSON $batch
+GRAPH_BATCH_MAX_REQUESTS = 20
+# Upload session chunks must be a multiple of 320 KiB
+UPLOAD_CHUNK_ALIGNMENT = 320 * 1024
+FILE_ATTACHMENT_TYPE = "#microsoft.graph.fileAttachment"
+
+EMAIL_SELECT_FIELDS = "id,subject,sender,toRecipients,ccRecipients,bccRecipients,body,receivedDateTime,hasAttachments"
+
+def mailbox_url(mailbox: str, collection: str) -> str:
+    """
+    Graph URL of the messages ("messages") or inbox delta ("delta") of a mailbox.
+    "me" is the signed-in user and keeps using the configured URLs.
+    """
+    if mailbox == "me":
+        return settings.RETRIEVE_EMAIL_URL if collection == "messages" else settings.DELTA_EMAIL_URL
+    base_url = f"{settings.GRAPH_API_BASE_URL}/users/{mailbox}"
+    if collection == "messages":
+        return f"{base_url}/messages"
+    return f"{base_url}/mailFolders/inbox/messages/delta"
+
+def recipient_count(email_request: EmailSendRequest) -> int:
+    return len(email_request.to_recipients) + len(email_request.cc_recipients) + len(email_request.bcc_recipients)
+
+def split_recipients(email_request: EmailSendRequest) -> List[EmailSendRequest]:
+    """
+    Split an email with more than SEND_MAX_RECIPIENTS recipients into several
+    emails, filling each with To, then Cc, then Bcc recipients in order
+    """
+    limit = settings.SEND_MAX_RECIPIENTS
+    if recipient_count(email_request) <= limit:
+        return [email_request]
+    recipients = [(field, recipient) for field in ("to_recipients", "cc_recipients", "bcc_recipients")
+                  for recipient in getattr(email_request, field)]
+    parts = []
+    for start in range(0, len(recipients), limit):
+        fields = {"to_recipients": [], "cc_recipients": [], "bcc_recipients": []}
+        for field, recipient in recipients[start:start + limit]:
+            fields[field].append(recipient)
+        parts.append(email_request.copy(update=fields))
+    return parts
+
+def upload_chunk_size() -> int:
+    """
+    SEND_UPLOAD_CHUNK_SIZE rounded down to a multiple of 320 KiB
+    """
+    return max(UPLOAD_CHUNK_ALIGNMENT, settings.SEND_UPLOAD_CHUNK_SIZE // UPLOAD_CHUNK_ALIGNMENT * UPLOAD_CHUNK_ALIGNMENT)
+
+def next_expected_offset(upload_session: dict, default: int) -> int:
+    """
+    Start of the first range in an upload session's nextExpectedRanges ("start-end" or "start-")
+    """
+    ranges = upload_session.get("nextExpectedRanges") or []
+    if not ranges:
+        return default
+    return int(ranges[0].split("-")[0])
+
+def graph_error(action: str, response: httpx.Response) -> GraphAPIError:
+    return GraphAPIError(
+        f"{action}: {response.status_code} - {response.text}",
+        response.status_code,
+        retry_after=parse_retry_after(response.headers.get("Retry-After"))
+    )
+
 class EmailService:
-    def __init__(self):
+    def __init__(self, graph_client: GraphClient = None, email_repository: EmailRepository = None,
+                 sync_state_repository: SyncStateRepository = None, search_backend: SearchBackend = None,
+                 attachment_service: AttachmentService = None, outbound_attachments: OutboundAttachmentStore = None):
         self.token_service = token_cache
-        self.email_repository = EmailRepository()
+        self.graph_client = graph_client or get_graph_client()
+        self.email_repository = email_repository or EmailRepository()
+        self.sync_state_repository = sync_state_repository or SyncStateRepository()
+        self.search_backend = search_backend or get_search_backend()
+        self.attachment_service = attachment_service or AttachmentService(self.graph_client)
+        self.outbound_attachments = outbound_attachments or OutboundAttachmentStore()
 
-    def send_email(self, email_request: EmailSendRequest):
+    async def send_email(self, email_request: EmailSendRequest, parts_sent: int = 0,
+                         on_part_sent: Optional[Callable[[int], Awaitable]] = None):
         """
-        Send an email using Microsoft Graph API
+        Send an email using Microsoft Graph API. An email with more than
+        SEND_MAX_RECIPIENTS recipients is sent as several emails: `parts_sent`
+        skips the ones a previous attempt already sent and `on_part_sent` is
+        awaited with the number sent so far after each one.
         """
         try:
             # Get access token
-            token = token_cache.get_access_token()
+            token = await token_cache.get_access_token_async()
             logger.info(f"Using Access Token To Send Email: {token}")
 
             # Prepare headers
@@ -32,60 +115,343 @@ class EmailService:
                 "Authorization": f"Bearer {token}",
                 "Content-Type": "application/json"
             }
-            
-            # Prepare email message
-            email_body = {
-                "message": {
-                    "subject": email_request.subject,
-                    "body": {
-                        "contentType": "html" if email_request.is_html else "text",
-                        "content": email_request.body
-                    },
-                    "toRecipients": [{
-                        "emailAddress": {
-                            "address": recipient
-                        }
-                    } for recipient in email_request.to_recipients],
-                    "ccRecipients": [{
-                        "emailAddress": {
-                            "address": recipient
-                        }
-                    } for recipient in email_request.cc_recipients],
-                    "bccRecipients": [{
-                        "emailAddress": {
-                            "address": recipient
-                        }
-                    } for recipient in email_request.bcc_recipients]
+
+            parts = split_recipients(email_request)
+            for index in range(parts_sent, len(parts)):
+                await self.send_part(parts[index], headers)
+                if on_part_sent is not None:
+                    await on_part_sent(index + 1)
+            logger.info(f"Email sent successfully to {email_request.to_recipients}"
+                        + (f" as {len(parts)} emails" if len(parts) > 1 else ""))
+            return "email_sent_successfully"
+        except Exception as e:
+            logger.error(f"Error sending email: {str(e)}")
+            raise
+
+    async def send_part(self, email_request: EmailSendRequest, headers: dict):
+        """
+        Send one email: with sendMail when its attachments fit in the request,
+        otherwise as a draft whose large attachments go through upload sessions
+        """
+        sizes = [self.attachment_size(attachment) for attachment in email_request.attachments]
+        if sum(sizes) > settings.SEND_INLINE_ATTACHMENT_LIMIT:
+            await self.send_with_upload_sessions(email_request, sizes, headers)
+            return
+
+        email_body = self.build_email_body(
+            email_request, [await self.file_attachment(attachment) for attachment in email_request.attachments]
+        )
+        response = await self.graph_client.post(
+            settings.SEND_EMAIL_URL,
+            headers=headers,
+            json=email_body
+        )
+        if response.status_code != 202:
+            logger.error(f"Failed to send email: {response.text}")
+            raise graph_error("Failed to send email", response)
+
+    async def send_with_upload_sessions(self, email_request: EmailSendRequest, sizes: List[int], headers: dict):
+        """
+        Create a draft, add attachments above SEND_INLINE_ATTACHMENT_LIMIT
+        through upload sessions and the others one request each, then send it
+        """
+        messages_url = f"{settings.GRAPH_API_BASE_URL}/me/messages"
+        response = await self.graph_client.post(messages_url, headers=headers,
+                                                json=self.build_email_body(email_request)["message"])
+        if response.status_code != 201:
+            raise graph_error("Failed to create draft", response)
+        message_url = f"{messages_url}/{response.json()['id']}"
+
+        try:
+            for attachment, size in zip(email_request.attachments, sizes):
+                if size > settings.SEND_INLINE_ATTACHMENT_LIMIT:
+                    await self.upload_attachment(message_url, attachment, size, headers)
+                    continue
+                response = await self.graph_client.post(f"{message_url}/attachments", headers=headers,
+                                                        json=await self.file_attachment(attachment))
+                if response.status_code != 201:
+                    raise graph_error("Failed to add attachment", response)
+
+            response = await self.graph_client.post(f"{message_url}/send", headers=headers)
+            if response.status_code != 202:
+                raise graph_error("Failed to send draft", response)
+        except Exception:
+            # Do not leave a half-built draft behind; a retry starts from a new one
+            await self.delete_draft(message_url, headers)
+            raise
+
+    async def upload_attachment(self, message_url: str, attachment: EmailAttachment, size: int, headers: dict):
+        """
+        Upload a staged file through an upload session, SEND_UPLOAD_CHUNK_SIZE
+        bytes per request, streamed from disk. An interrupted
+        upload resumes from the range Graph still expects, up to
+        SEND_UPLOAD_MAX_RESUMES times.
+        """
+        attachment_item = {
+            "attachmentType": "file",
+            "name": attachment.name,
+            "size": size,
+            "contentType": attachment.content_type,
+            "isInline": attachment.is_inline
+        }
+        if attachment.content_id:
+            attachment_item["contentId"] = attachment.content_id
+        response = await self.graph_client.post(f"{message_url}/attachments/createUploadSession", headers=headers,
+                                                json={"AttachmentItem": attachment_item})
+        if response.status_code != 201:
+            raise graph_error("Failed to create upload session", response)
+        # The upload URL is pre-authenticated: no Authorization header
+        upload_url = response.json()["uploadUrl"]
+
+        chunk_size = upload_chunk_size()
+        offset = 0
+        resumes = 0
+        while offset < size:
+            length = min(chunk_size, size - offset)
+            try:
+                # Streamed from disk: only a small piece of the chunk is in memory at a time
+                response = await self.graph_client.put(
+                    upload_url,
+                    content=self.outbound_attachments.range(attachment.file_id, offset, length, UPLOAD_CHUNK_ALIGNMENT),
+                    headers={"Content-Length": str(length), "Content-Range": f"bytes {offset}-{offset + length - 1}/{size}"}
+                )
+            except httpx.TransportError as e:
+                response, error = None, f"{e.__class__.__name__}: {e}"
+            else:
+                if response.status_code == 201:
+                    return
+                if response.status_code == 200:
+                    offset = next_expected_offset(response.json(), offset + length)
+                    continue
+                error = f"{response.status_code} - {response.text}"
+
+            if resumes >= settings.SEND_UPLOAD_MAX_RESUMES:
+                raise GraphAPIError(f"Failed to upload attachment {attachment.name}: {error}",
+                                    response.status_code if response is not None else 503)
+            resumes += 1
+            offset = await self.upload_session_offset(upload_url)
+            logger.warning(f"Upload of {attachment.name} interrupted ({error}), resuming at byte {offset}")
+
+    async def upload_session_offset(self, upload_url: str) -> int:
+        """
+        First byte an upload session still expects
+        """
+        response = await self.graph_client.get(upload_url)
+        if response.status_code != 200:
+            raise graph_error("Failed to get upload session status", response)
+        return next_expected_offset(response.json(), 0)
+
+    async def delete_draft(self, message_url: str, headers: dict):
+        try:
+            await self.graph_client.delete(message_url, headers=headers)
+        except Exception as e:
+            logger.warning(f"Failed to delete draft {message_url}: {str(e)}")
+
+    def attachment_size(self, attachment: EmailAttachment) -> int:
+        if attachment.file_id is not None:
+            return self.outbound_attachments.size(attachment.file_id)
+        return len(base64.b64decode(attachment.content_bytes))
+
+    async def file_attachment(self, attachment: EmailAttachment) -> dict:
+        """
+        Graph fileAttachment of an attachment small enough to send in one request
+        """
+        if attachment.file_id is not None:
+            content_bytes = base64.b64encode(await self.outbound_attachments.read(attachment.file_id)).decode("ascii")
+        else:
+            content_bytes = attachment.content_bytes
+        file_attachment = {
+            "@odata.type": FILE_ATTACHMENT_TYPE,
+            "name": attachment.name,
+            "contentType": attachment.content_type,
+            "contentBytes": content_bytes,
+            "isInline": attachment.is_inline
+        }
+        if attachment.content_id:
+            file_attachment["contentId"] = attachment.content_id
+        return file_attachment
+
+    async def send_batch(self, email_requests: List[EmailSendRequest]) -> List[EmailBatchResult]:
+        """
+        Send many emails by packing up to 20 sendMail calls into each Microsoft
+        Graph JSON $batch request, running up to EMAIL_BATCH_CONCURRENCY batches at once.
+        Emails with attachments or too many recipients for one sendMail call are
+        sent on their own with send_email.
+        """
+        token = await token_cache.get_access_token_async()
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json"
+        }
+        semaphore = asyncio.Semaphore(settings.EMAIL_BATCH_CONCURRENCY)
+
+        async def send_chunk(chunk: List[Tuple[int, EmailSendRequest]]) -> List[EmailBatchResult]:
+            sub_requests = [{
+                "id": str(index),
+                "method": "POST",
+                "url": settings.GRAPH_BATCH_SEND_PATH,
+                "headers": {"Content-Type": "application/json"},
+                "body": self.build_email_body(email_request)
+            } for index, email_request in chunk]
+            async with semaphore:
+                try:
+                    responses = await self.graph_client.batch(sub_requests, headers,
+                                                              mailbox=mailbox_from_url(settings.GRAPH_BATCH_SEND_PATH))
+                except GraphAPIError as e:
+                    logger.error(f"Failed to send email batch: {str(e)}")
+                    return [EmailBatchResult(index=index, success=False, status_code=e.status_code, error=str(e))
+                            for index, _ in chunk]
+                except Exception as e:
+                    logger.error(f"Error sending email batch: {str(e)}")
+                    return [EmailBatchResult(index=index, success=False, error=str(e)) for index, _ in chunk]
+
+            # Map every sub-response back to the message it belongs to
+            results = []
+            for index, _ in chunk:
+                item = responses.get(str(index))
+                if item is None:
+                    results.append(EmailBatchResult(index=index, success=False, error="No response in batch"))
+                    continue
+                status_code = item.get("status")
+                error = None
+                if status_code != 202:
+                    error = (item.get("body") or {}).get("error", {}).get("message") or f"Failed to send email: {status_code}"
+                results.append(EmailBatchResult(index=index, success=status_code == 202, status_code=status_code, error=error))
+            return results
+
+        async def send_single(index: int, email_request: EmailSendRequest) -> List[EmailBatchResult]:
+            async with semaphore:
+                try:
+                    await self.send_email(email_request)
+                except GraphAPIError as e:
+                    return [EmailBatchResult(index=index, success=False, status_code=e.status_code, error=str(e))]
+                except Exception as e:
+                    return [EmailBatchResult(index=index, success=False, error=str(e))]
+            return [EmailBatchResult(index=index, success=True, status_code=202)]
+
+        batchable = [(index, email_request) for index, email_request in enumerate(email_requests)
+                     if not email_request.attachments and recipient_count(email_request) <= settings.SEND_MAX_RECIPIENTS]
+        batchable_indexes = {index for index, _ in batchable}
+        chunks = [
+            send_chunk(batchable[offset:offset + GRAPH_BATCH_MAX_REQUESTS])
+            for offset in range(0, len(batchable), GRAPH_BATCH_MAX_REQUESTS)
+        ]
+        singles = [send_single(index, email_request) for index, email_request in enumerate(email_requests)
+                   if index not in batchable_indexes]
+        results = [result for results in await asyncio.gather(*chunks, *singles) for result in results]
+        results.sort(key=lambda result: result.index)
+        sent = sum(1 for result in results if result.success)
+        logger.info(f"Batch send finished: {sent} sent, {len(results) - sent} failed in {len(chunks)} Graph batches"
+                    f" and {len(singles)} single sends")
+        return results
+
+    def build_email_body(self, email_request: EmailSendRequest, attachments: Optional[List[dict]] = None) -> dict:
+        """
+        Build the Microsoft Graph sendMail payload for an email request, with
+        the given fileAttachments
+        """
+        email_body = {
+            "message": {
+                "subject": email_request.subject,
+                "body": {
+                    "contentType": "html" if email_request.is_html else "text",
+                    "content": email_request.body
                 },
-                "saveToSentItems": True
+                "toRecipients": [{
+                    "emailAddress": {
+                        "address": recipient
+                    }
+                } for recipient in email_request.to_recipients],
+                "ccRecipients": [{
+                    "emailAddress": {
+                        "address": recipient
+                    }
+                } for recipient in email_request.cc_recipients],
+                "bccRecipients": [{
+                    "emailAddress": {
+                        "address": recipient
+                    }
+                } for recipient in email_request.bcc_recipients]
+            },
+            "saveToSentItems": True
+        }
+        if attachments:
+            email_body["message"]["attachments"] = attachments
+        return email_body
+
+    async def retrieve_emails(self, mailbox: str = "me"):
+        """
+        Retrieve emails of a mailbox using Microsoft Graph API and store them in
+        MongoDB, either incrementally (delta sync) or by re-scanning the past 24 hours
+        """
+        if settings.EMAIL_SYNC_MODE == "delta":
+            return await self.sync_emails_delta(mailbox)
+        return await self.retrieve_emails_window(mailbox)
+
+    async def sync_emails_delta(self, mailbox: str = "me"):
+        """
+        Fetch only the inbox messages that were created, changed or removed
+        since the last sync using Microsoft Graph /messages/delta and apply them
+        to MongoDB. Messages moved out of the inbox are reported as removed and
+        deleted, unlike in the window mode, which reads every folder.
+        """
+        try:
+            # Get access token
+            token = await self.token_service.get_access_token_async()
+
+            # Prepare headers
+            headers = {
+                "Authorization": f"Bearer {token}",
+                "Content-Type": "application/json",
+                "Prefer": f"odata.maxpagesize={settings.EMAIL_PAGE_SIZE}"
             }
-            
-            # Send the email
-            response = requests.post(
-                url=settings.SEND_EMAIL_URL,
-                headers=headers,
-                json=email_body
-            )
-            
-            # Check response
-            if response.status_code == 202:
-                logger.info(f"Email sent successfully to {email_request.to_recipients}")
-                return "email_sent_successfully"
+
+            delta_link = await self.sync_state_repository.get_delta_link_async(mailbox)
+            if delta_link:
+                # The deltaLink already carries the $select and the sync state
+                url, params = delta_link, None
             else:
-                logger.error(f"Failed to send email: {response.text}")
-                raise Exception(f"Failed to send email: {response.status_code} - {response.text}")
+                # Initial sync: start from the past 24 hours like the window mode
+                past_24_hours = datetime.utcnow() - timedelta(days=1)
+                date_filter = past_24_hours.strftime("%Y-%m-%dT%H:%M:%SZ")
+                url = mailbox_url(mailbox, "delta")
+                params = {
+                    "$filter": f"receivedDateTime ge {date_filter}",
+                    "$select": EMAIL_SELECT_FIELDS
+                }
+
+            try:
+                summary, last_page = await self.store_email_pages(
+                    self.iter_email_pages(url, headers, params, "sync emails"), mailbox
+                )
+            except GraphAPIError as e:
+                if e.status_code != 410 or not delta_link:
+                    raise
+                # Sync state expired on the Graph side, start over with a full sync
+                logger.warning(f"Delta link for {mailbox} expired, restarting sync")
+                await self.sync_state_repository.clear_delta_link_async(mailbox)
+                return await self.sync_emails_delta(mailbox)
+
+            # Only advance the watermark once every page has been stored. When the
+            # page cap cut the sync short, the nextLink is where the next tick resumes.
+            watermark = last_page.get("@odata.deltaLink") or last_page.get("@odata.nextLink")
+            if watermark:
+                await self.sync_state_repository.save_delta_link_async(mailbox, watermark)
+
+            logger.info(f"Delta sync for {mailbox}: {summary['emails']} new or changed, {summary['removed']} removed in {summary['pages']} pages")
+            return summary
         except Exception as e:
-            logger.error(f"Error sending email: {str(e)}")
+            logger.error(f"Error syncing emails: {str(e)}")
             raise
 
-    def retrieve_emails(self):
+    async def retrieve_emails_window(self, mailbox: str = "me"):
         """
         Retrieve emails from the past 24 hours using Microsoft Graph API
         and store them in MongoDB
         """
         try:
             # Get access token
-            token = self.token_service.get_access_token()
+            token = await self.token_service.get_access_token_async()
             
             # Prepare headers
             headers = {
@@ -100,26 +466,129 @@ class EmailService:
             # Query parameters
             params = {
                 "$filter": f"receivedDateTime ge {date_filter}",
-                "$select": "id,subject,sender,toRecipients,ccRecipients,bccRecipients,body,receivedDateTime",
-                "$top": 50  # Limit to 50 emails
+                "$select": EMAIL_SELECT_FIELDS,
+                "$top": settings.EMAIL_PAGE_SIZE
             }
             
-            # Get emails
-            response = requests.get(
-                settings.RETRIEVE_EMAIL_URL,
-                headers=headers,
-                params=params
+            # Get emails page by page
+            summary, last_page = await self.store_email_pages(
+                self.iter_email_pages(mailbox_url(mailbox, "messages"), headers, params, "retrieve emails"), mailbox
             )
-
-            # Check response
-            if response.status_code == 200:
-                emails_data = response.json().get("value", [])
-                logger.info(f"Retrieved {len(emails_data)} emails from the past 24 hours")
-                self.email_repository.store_emails(emails_data)
-                return emails_data
-            else:
-                logger.error(f"Failed to retrieve emails: {response.text}")
-                raise Exception(f"Failed to retrieve emails: {response.status_code} - {response.text}")
+            if last_page.get("@odata.nextLink"):
+                logger.warning(f"Stopped after {settings.EMAIL_MAX_PAGES} pages, older emails were not retrieved")
+            logger.info(f"Retrieved {summary['emails']} emails of {mailbox} from the past 24 hours in {summary['pages']} pages")
+            return summary
         except Exception as e:
             logger.error(f"Error retrieving emails: {str(e)}")
             raise
+
+    async def fetch_emails(self, mailbox: str, email_ids: List[str]) -> dict:
+        """
+        Fetch specific messages of a mailbox by id (e.g. from change
+        notifications) through Microsoft Graph JSON $batch and store them
+        """
+        token = await self.token_service.get_access_token_async()
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json"
+        }
+        path = "/me" if mailbox == "me" else f"/users/{mailbox}"
+        email_ids = list(dict.fromkeys(email_ids))  # drop duplicate notifications
+        summary = {"requested": len(email_ids), "emails": 0, "missing": 0, "inserted": 0, "updated": 0, "unchanged": 0}
+
+        for offset in range(0, len(email_ids), GRAPH_BATCH_MAX_REQUESTS):
+            chunk = email_ids[offset:offset + GRAPH_BATCH_MAX_REQUESTS]
+            responses = await self.graph_client.batch([{
+                "id": str(i),
+                "method": "GET",
+                "url": f"{path}/messages/{email_id}?$select={EMAIL_SELECT_FIELDS}"
+            } for i, email_id in enumerate(chunk)], headers, mailbox=mailbox)
+
+            emails_data = []
+            for item in responses.values():
+                if item.get("status") == 200:
+                    emails_data.append(item["body"])
+                else:
+                    # Deleted or moved again before we fetched it
+                    summary["missing"] += 1
+            if emails_data:
+                result = await self.store_emails(emails_data, mailbox)
+                summary["emails"] += len(emails_data)
+                summary["inserted"] += result.inserted
+                summary["updated"] += result.updated
+                summary["unchanged"] += result.unchanged
+
+        logger.info(f"Fetched {summary['emails']} notified emails of {mailbox} ({summary['missing']} missing)")
+        return summary
+
+    async def store_emails(self, emails_data: List[dict], mailbox: str) -> EmailStoreResult:
+        """
+        Store Graph messages, add them to the search index and download their
+        attachments
+        """
+        # Built once for storage and indexing; malformed messages are already left out
+        documents = self.email_repository.email_documents(emails_data, mailbox)
+        result = await self.email_repository.store_documents_async(documents, mailbox)
+        self.search_backend.index_documents(documents)
+        if settings.ATTACHMENTS_ENABLED:
+            stored_ids = {document["email_id"] for document in documents}
+            email_ids = [email["id"] for email in emails_data
+                         if email.get("hasAttachments") and email.get("id") in stored_ids]
+            if email_ids:
+                await self.attachment_service.ingest_emails(mailbox, email_ids)
+        return result
+
+    async def delete_emails(self, email_ids: List[str]) -> int:
+        deleted = await self.email_repository.delete_emails_async(email_ids)
+        self.search_backend.remove_emails(email_ids)
+        return deleted
+
+    async def iter_email_pages(self, url, headers, params=None, action="retrieve emails"):
+        """
+        Yield the pages of a Microsoft Graph message collection one at a time,
+        following @odata.nextLink until it runs out or EMAIL_MAX_PAGES is reached
+        """
+        pages = 0
+        while True:
+            response = await self.graph_client.get(url, headers=headers, params=params)
+            params = None  # nextLink/deltaLink already contain the query
+
+            if response.status_code != 200:
+                logger.error(f"Failed to {action}: {response.text}")
+                raise GraphAPIError(
+                    f"Failed to {action}: {response.status_code} - {response.text}",
+                    response.status_code,
+                    retry_after=parse_retry_after(response.headers.get("Retry-After"))
+                )
+
+            page = decode_json(response)
+            pages += 1
+            yield page
+
+            url = page.get("@odata.nextLink")
+            if not url or (settings.EMAIL_MAX_PAGES and pages >= settings.EMAIL_MAX_PAGES):
+                return
+
+    async def store_email_pages(self, pages, mailbox: str = "me"):
+        """
+        Store every page in MongoDB as soon as it arrives so that only one
+        page is held in memory. Returns a summary and the last page seen.
+        """
+        summary = {"pages": 0, "emails": 0, "inserted": 0, "updated": 0, "unchanged": 0, "removed": 0}
+        last_page = {}
+        async for page in pages:
+            emails_data = [email for email in page.get("value", []) if "@removed" not in email]
+            removed_ids = [email["id"] for email in page.get("value", []) if "@removed" in email]
+
+            if emails_data:
+                result = await self.store_emails(emails_data, mailbox)
+                summary["inserted"] += result.inserted
+                summary["updated"] += result.updated
+                summary["unchanged"] += result.unchanged
+            if removed_ids:
+                summary["removed"] += await self.delete_emails(removed_ids)
+
+            summary["pages"] += 1
+            summary["emails"] += len(emails_data)
+            last_page = page
+        return summary, last_page
@@ -0,0 +1,229 @@
+import asyncio
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+from app.exceptions import GraphAPIError
+from app.metrics import GRAPH_REQUESTS_IN_FLIGHT, observe_graph_request
+from app.services.graph_retry import (
+    RETRYABLE_STATUS_CODES, GraphRetryStats, TokenBucket, backoff_delay, mailbox_from_url, parse_retry_after
+)
+from config import settings
+
+try:
+    import orjson
+except ImportError:  # optional dependency, the json module is used without it
+    orjson = None
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def decode_json(response: httpx.Response):
+    """
+    Decode a Graph JSON response, with orjson when it is installed (several
+    times faster on large message pages)
+    """
+    if orjson is not None:
+        return orjson.loads(response.content)
+    return json.loads(response.content)
+
+class GraphClient:
+    """
+    Async Microsoft Graph API client sharing one pooled HTTP/2 connection pool.
+    Every request goes through a per-mailbox token bucket and is retried on
+    throttling (429/503/504) honoring Retry-After.
+    """
+    def __init__(self, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self._client = httpx.AsyncClient(
+            http2=settings.GRAPH_HTTP2,
+            limits=httpx.Limits(
+                max_connections=settings.GRAPH_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.GRAPH_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.GRAPH_KEEPALIVE_EXPIRY
+            ),
+            timeout=httpx.Timeout(settings.GRAPH_TIMEOUT, connect=settings.GRAPH_CONNECT_TIMEOUT),
+            transport=transport
+        )
+        self._buckets: Dict[str, TokenBucket] = {}
+        self.stats = GraphRetryStats()
+
+    def bucket(self, mailbox: str) -> TokenBucket:
+        """
+        Get the token bucket of a mailbox
+        """
+        # Addresses taken from URLs are lowercased, so are the ones given by callers
+        mailbox = mailbox.lower()
+        if mailbox not in self._buckets:
+            self._buckets[mailbox] = TokenBucket(settings.GRAPH_RATE_LIMIT_PER_SECOND, settings.GRAPH_RATE_LIMIT_BURST)
+        return self._buckets[mailbox]
+
+    async def request(self, method: str, url: str, mailbox: Optional[str] = None, **kwargs) -> httpx.Response:
+        """
+        Send a request to Microsoft Graph API over the shared connection pool,
+        retrying throttled and transient failures with jittered exponential
+        backoff. The last response is returned once retries are exhausted.
+        """
+        return await self._send_with_retries(method, url, mailbox, lambda: self._client.request(method, url, **kwargs))
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, mailbox: Optional[str] = None, **kwargs) -> AsyncIterator[httpx.Response]:
+        """
+        Send a request and hand over the response before its body is read, so
+        large downloads can be consumed chunk by chunk. Throttled responses
+        and transport failures are retried like in `request`, until the
+        response is handed over.
+        """
+        response = await self._send_with_retries(
+            method, url, mailbox,
+            lambda: self._client.send(self._client.build_request(method, url, **kwargs), stream=True)
+        )
+        try:
+            yield response
+        finally:
+            await response.aclose()
+
+    async def _send_with_retries(self, method: str, url: str, mailbox: Optional[str],
+                                 send: Callable[[], Awaitable[httpx.Response]]) -> httpx.Response:
+        """
+        Run `send` through the token bucket of the mailbox, retrying throttled
+        responses and transport failures. The histogram and in-flight gauge
+        cover the time to the response headers (a streamed body is read later).
+        """
+        bucket = self.bucket(mailbox or mailbox_from_url(url))
+        attempt = 0
+        while True:
+            self.stats.rate_limit_wait_seconds += await bucket.acquire()
+            self.stats.requests += 1
+            started = time.perf_counter()
+            GRAPH_REQUESTS_IN_FLIGHT.inc()
+            try:
+                response = await send()
+            except httpx.TransportError as e:
+                GRAPH_REQUESTS_IN_FLIGHT.dec()
+                observe_graph_request(method, url, "error", started)
+                # Only retry a non-GET when the request never reached Graph
+                if attempt >= settings.GRAPH_MAX_RETRIES or (method != "GET" and not isinstance(e, httpx.ConnectError)):
+                    raise
+                delay = backoff_delay(attempt)
+                logger.warning(f"Graph {method} {url} failed ({e.__class__.__name__}), retrying in {delay:.2f}s")
+            else:
+                GRAPH_REQUESTS_IN_FLIGHT.dec()
+                observe_graph_request(method, url, response.status_code, started)
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    return response
+                self.stats.throttled += 1
+                if attempt >= settings.GRAPH_MAX_RETRIES:
+                    logger.error(f"Graph {method} {url} still throttled after {attempt} retries")
+                    return response
+                # Release the connection of the throttled response before waiting
+                await response.aclose()
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                if retry_after is not None:
+                    delay = min(retry_after, settings.GRAPH_BACKOFF_MAX)
+                    # The whole mailbox is throttled, hold back the other requests to it too
+                    bucket.pause(delay)
+                else:
+                    delay = backoff_delay(attempt)
+                logger.warning(f"Graph {method} {url} returned {response.status_code}, retrying in {delay:.2f}s")
+
+            self.stats.retries += 1
+            self.stats.retry_wait_seconds += delay
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def batch(self, sub_requests: List[dict], headers: dict, mailbox: Optional[str] = None) -> Dict[str, dict]:
+        """
+        Run up to 20 sub-requests to `mailbox` in one Microsoft Graph JSON
+        $batch call and return the sub-responses by id. The call is rate
+        limited with the other requests to the mailbox (the one of the first
+        sub-request when not given). Throttled sub-requests are sent again
+        on their own after their Retry-After. Raises GraphAPIError when the
+        $batch call itself fails.
+        """
+        if mailbox is None and sub_requests:
+            mailbox = mailbox_from_url(sub_requests[0]["url"])
+        pending = {sub_request["id"]: sub_request for sub_request in sub_requests}
+        responses = {}
+        attempt = 0
+        while pending:
+            response = await self.post(settings.GRAPH_BATCH_URL, mailbox=mailbox, headers=headers,
+                                       json={"requests": list(pending.values())})
+            if response.status_code != 200:
+                raise GraphAPIError(
+                    f"Failed to send batch: {response.status_code} - {response.text}",
+                    response.status_code,
+                    retry_after=parse_retry_after(response.headers.get("Retry-After"))
+                )
+
+            throttled = {}
+            delay = 0.0
+            for item in decode_json(response).get("responses", []):
+                if item.get("status") in RETRYABLE_STATUS_CODES and attempt < settings.GRAPH_MAX_RETRIES and item["id"] in pending:
+                    throttled[item["id"]] = pending[item["id"]]
+                    retry_after = parse_retry_after((item.get("headers") or {}).get("Retry-After"))
+                    delay = max(delay, retry_after if retry_after is not None else backoff_delay(attempt))
+                    continue
+                responses[item["id"]] = item
+
+            pending = throttled
+            if pending:
+                delay = min(delay, settings.GRAPH_BACKOFF_MAX)
+                self.bucket(mailbox).pause(delay)
+                logger.warning(f"{len(pending)} batched requests throttled, retrying in {delay:.2f}s")
+                self.stats.retries += len(pending)
+                self.stats.throttled += len(pending)
+                self.stats.retry_wait_seconds += delay
+                await asyncio.sleep(delay)
+                attempt += 1
+        return responses
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    async def patch(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("PATCH", url, **kwargs)
+
+    async def put(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("PUT", url, **kwargs)
+
+    async def delete(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("DELETE", url, **kwargs)
+
+    async def close(self):
+        """
+        Close every pooled connection
+        """
+        await self._client.aclose()
+
+# Shared client instance
+_graph_client: Optional[GraphClient] = None
+
+def get_graph_client() -> GraphClient:
+    """
+    Get or create the shared Graph API client instance
+    """
+    global _graph_client
+
+    if _graph_client is None:
+        _graph_client = GraphClient()
+        logger.info(f"Graph API client created (http2={settings.GRAPH_HTTP2}, max_connections={settings.GRAPH_MAX_CONNECTIONS})")
+    return _graph_client
+
+async def close_graph_client():
+    """
+    Close the shared Graph API client
+    """
+    global _graph_client
+
+    if _graph_client is not None:
+        await _graph_client.close()
+        _graph_client = None
+        logger.info("Graph API client closed")
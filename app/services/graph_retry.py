@@ -0,0 +1,102 @@
+import asyncio
+import random
+import re
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+from config import settings
+
+# Status codes Microsoft Graph uses for throttling and transient outages
+RETRYABLE_STATUS_CODES = {429, 503, 504}
+
+_MAILBOX_PATTERN = re.compile(r"/users/([^/?]+)")
+
+def mailbox_from_url(url: str) -> str:
+    """
+    Get the mailbox a Graph URL targets ("me" for the signed-in user)
+    """
+    match = _MAILBOX_PATTERN.search(str(url))
+    return match.group(1).lower() if match else "me"
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a Retry-After header given either in seconds or as an HTTP date
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+def backoff_delay(attempt: int) -> float:
+    """
+    Exponential backoff with full jitter for the given (zero based) attempt
+    """
+    ceiling = min(settings.GRAPH_BACKOFF_MAX, settings.GRAPH_BACKOFF_BASE * (2 ** attempt))
+    return random.uniform(0, ceiling)
+
+class TokenBucket:
+    """
+    Token bucket spacing out requests to one mailbox. Callers reserve a token
+    and sleep until it is available, so bursts are smoothed instead of rejected.
+    """
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> float:
+        """
+        Take one token, waiting for it if needed. Returns the seconds waited.
+        """
+        self._refill()
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        wait = -self.tokens / self.rate
+        await asyncio.sleep(wait)
+        return wait
+
+    def pause(self, seconds: float):
+        """
+        Hold back every following request for the given number of seconds,
+        used when Graph has already throttled this mailbox
+        """
+        self._refill()
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+class GraphRetryStats:
+    """
+    Counters for Graph API retries and the time spent waiting on them
+    """
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+        self.retry_wait_seconds = 0.0
+        self.rate_limit_wait_seconds = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "throttled": self.throttled,
+            "retry_wait_seconds": round(self.retry_wait_seconds, 3),
+            "rate_limit_wait_seconds": round(self.rate_limit_wait_seconds, 3)
+        }
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from typing import AsyncIterator, Optional, Tuple
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+class FileRange:
+    """
+    Byte range of a file, read piece by piece each time it is iterated.
+    Used as request content: nothing outlives the request but this small
+    object, and a retried request can send the range again.
+    """
+    def __init__(self, path: str, offset: int, length: int, piece_size: int):
+        self.path = path
+        self.offset = offset
+        self.length = length
+        self.piece_size = piece_size
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            remaining = self.length
+            while remaining > 0:
+                piece = await asyncio.to_thread(f.read, min(self.piece_size, remaining))
+                if not piece:
+                    raise EOFError(f"{self.path} is shorter than expected")
+                remaining -= len(piece)
+                yield piece
+
+class OutboundAttachmentStore:
+    """
+    Files uploaded to attach to outbound emails, staged on disk under
+    OUTBOUND_ATTACHMENT_DIR. Uploads are written and read back chunk by chunk
+    so no file is ever held in memory whole. Files are kept for
+    OUTBOUND_ATTACHMENT_TTL seconds, letting queued sends be retried.
+    """
+    def __init__(self, root: Optional[str] = None):
+        self.root = root or settings.OUTBOUND_ATTACHMENT_DIR
+
+    def path(self, file_id: str) -> str:
+        return os.path.join(self.root, file_id)
+
+    def exists(self, file_id: str) -> bool:
+        return os.path.isfile(self.path(file_id))
+
+    def size(self, file_id: str) -> int:
+        return os.path.getsize(self.path(file_id))
+
+    async def save(self, chunks: AsyncIterator[bytes]) -> Tuple[str, int]:
+        """
+        Write a stream of chunks to a new file and return its id and size
+        """
+        os.makedirs(self.root, exist_ok=True)
+        file_id = uuid.uuid4().hex
+        partial = os.path.join(self.root, f".partial-{file_id}")
+        size = 0
+        try:
+            with open(partial, "wb") as f:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    # Keep disk writes off the event loop
+                    await asyncio.to_thread(f.write, chunk)
+            os.replace(partial, self.path(file_id))
+        except BaseException:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+        return file_id, size
+
+    async def read(self, file_id: str, offset: int = 0, length: int = -1) -> bytes:
+        """
+        Read `length` bytes of a file from `offset` (the whole rest by default)
+        """
+        def read_range():
+            with open(self.path(file_id), "rb") as f:
+                f.seek(offset)
+                return f.read(length)
+
+        return await asyncio.to_thread(read_range)
+
+    def range(self, file_id: str, offset: int, length: int, piece_size: int = 327680) -> FileRange:
+        """
+        Stream `length` bytes of a file from `offset`, `piece_size` bytes at a time
+        """
+        return FileRange(self.path(file_id), offset, length, piece_size)
+
+    def purge_expired(self, max_age: Optional[int] = None) -> int:
+        """
+        Delete the files older than `max_age` (OUTBOUND_ATTACHMENT_TTL) seconds
+        """
+        if not os.path.isdir(self.root):
+            return 0
+        cutoff = time.time() - (max_age if max_age is not None else settings.OUTBOUND_ATTACHMENT_TTL)
+        purged = 0
+        for entry in os.scandir(self.root):
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    purged += 1
+            except FileNotFoundError:
+                continue
+        if purged:
+            logger.info(f"Purged {purged} expired outbound attachments")
+        return purged
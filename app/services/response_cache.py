@@ -0,0 +1,284 @@
+import abc
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Iterable, NamedTuple, Optional, Tuple
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+from pymongo import UpdateOne
+from starlette.requests import Request
+from starlette.responses import Response
+
+from app.backends import create_backend, lazy_attribute
+from app.db.mongodb import get_async_response_cache_collection
+from app.metrics import RESPONSE_CACHE_LOOKUPS
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Scope of reads that are not filtered by mailbox: a write to any mailbox changes them
+ALL_MAILBOXES = "*"
+# BSON documents are limited to 16MB; larger responses are not shared
+MONGO_MAX_ENTRY_BYTES = 8 * 1024 * 1024
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    etag: str
+    # Mailbox the response depends on and its version when it was computed;
+    # no scope means the entry only expires with its TTL
+    scope: Optional[str]
+    version: int
+
+class CacheBackend(abc.ABC):
+    """
+    Storage of cached responses and of the mailbox versions invalidating them.
+
+    Writing emails of a mailbox bumps the version of the mailbox and of
+    ALL_MAILBOXES; an entry computed at an older version of its scope is
+    stale. Bumping a counter rather than deleting entries works the same for
+    a shared backend and leaves stale entries to the TTL and LRU eviction.
+    """
+    @abc.abstractmethod
+    async def get(self, key: str) -> Optional[CachedResponse]:
+        """
+        Unexpired entry of `key`, stale or not
+        """
+
+    @abc.abstractmethod
+    async def set(self, key: str, entry: CachedResponse, ttl: float):
+        pass
+
+    @abc.abstractmethod
+    async def version(self, scope: str) -> int:
+        pass
+
+    @abc.abstractmethod
+    async def invalidate(self, scopes: Iterable[str]):
+        """
+        Bump the version of every scope
+        """
+
+class InMemoryCacheBackend(CacheBackend):
+    """
+    Cache local to the process, bounded by entry count and total body size;
+    the least recently used entries are evicted first. Only used from the
+    event loop, so it needs no lock.
+    """
+    def __init__(self, max_entries: int = None, max_bytes: int = None):
+        self.max_entries = max_entries or settings.RESPONSE_CACHE_MAX_ENTRIES
+        self.max_bytes = max_bytes or settings.RESPONSE_CACHE_MAX_BYTES
+        self._entries: "OrderedDict[str, Tuple[float, CachedResponse]]" = OrderedDict()
+        self._bytes = 0
+        self._versions: Dict[str, int] = {}
+
+    def _remove(self, key: str):
+        _, entry = self._entries.pop(key)
+        self._bytes -= len(entry.body)
+
+    async def get(self, key: str) -> Optional[CachedResponse]:
+        item = self._entries.get(key)
+        if item is None:
+            return None
+        expires_at, entry = item
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    async def set(self, key: str, entry: CachedResponse, ttl: float):
+        if len(entry.body) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + ttl, entry)
+        self._bytes += len(entry.body)
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    async def version(self, scope: str) -> int:
+        return self._versions.get(scope, 0)
+
+    async def invalidate(self, scopes: Iterable[str]):
+        for scope in scopes:
+            self._versions[scope] = self._versions.get(scope, 0) + 1
+
+class MongoCacheBackend(CacheBackend):
+    """
+    Cache shared by every worker and replica through MongoDB, so a write seen
+    by one replica invalidates the responses cached by all of them. Entries
+    are removed by a TTL index on expires_at.
+    """
+    async_collection = lazy_attribute(get_async_response_cache_collection)
+
+    def __init__(self, async_collection=None):
+        self._async_collection = async_collection
+
+    @staticmethod
+    def _entry_id(key: str) -> str:
+        # Keys embed the query string and can be long
+        return "entry:" + hashlib.sha1(key.encode()).hexdigest()
+
+    async def get(self, key: str) -> Optional[CachedResponse]:
+        document = await self.async_collection.find_one(
+            {"_id": self._entry_id(key), "expires_at": {"$gt": datetime.utcnow()}}
+        )
+        if document is None:
+            return None
+        return CachedResponse(document["body"], document["etag"], document["scope"], document["version"])
+
+    async def set(self, key: str, entry: CachedResponse, ttl: float):
+        if len(entry.body) > MONGO_MAX_ENTRY_BYTES:
+            return
+        document = dict(entry._asdict(), expires_at=datetime.utcnow() + timedelta(seconds=ttl))
+        await self.async_collection.replace_one({"_id": self._entry_id(key)}, document, upsert=True)
+
+    async def version(self, scope: str) -> int:
+        document = await self.async_collection.find_one({"_id": f"version:{scope}"})
+        return document["version"] if document else 0
+
+    async def invalidate(self, scopes: Iterable[str]):
+        bumps = [UpdateOne({"_id": f"version:{scope}"}, {"$inc": {"version": 1}}, upsert=True) for scope in scopes]
+        await self.async_collection.bulk_write(bumps, ordered=False)
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Whether an If-None-Match header names `etag` (weak comparison, as for GET)
+    """
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in (candidate[2:] if candidate.startswith("W/") else candidate
+                                         for candidate in candidates)
+
+def encode_json(content: Any, exclude_none: bool = False) -> bytes:
+    # Same encoding as FastAPI's JSONResponse; models serialize themselves,
+    # which is several times faster than jsonable_encoder
+    if isinstance(content, BaseModel):
+        return content.json(exclude_none=exclude_none, ensure_ascii=False, separators=(",", ":")).encode()
+    return json.dumps(
+        jsonable_encoder(content, exclude_none=exclude_none), ensure_ascii=False, separators=(",", ":")
+    ).encode()
+
+def etag_response(request: Request, body: bytes, etag: str = None, cache_status: str = None) -> Response:
+    """
+    JSON response carrying an ETag, or 304 without a body when the request's
+    If-None-Match already names it
+    """
+    etag = etag or make_etag(body)
+    # Clients may keep the response but must revalidate it before reuse
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if cache_status:
+        headers["X-Cache"] = cache_status
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+class ResponseCache:
+    """
+    Cache of read responses keyed by path and query string. Concurrent
+    misses of the same key in a process wait for a single computation.
+    A request with Cache-Control: no-cache skips the lookup and refreshes
+    the entry.
+    """
+    def __init__(self, backend: Optional[CacheBackend]):
+        # Without a backend responses are computed every time, still with an ETag
+        self.backend = backend
+        self._locks: Dict[str, asyncio.Lock] = {}
+        # Requests holding or waiting for each lock; the last one out removes it
+        self._lock_users: Dict[str, int] = {}
+
+    @staticmethod
+    def cache_key(request: Request) -> str:
+        return request.url.path + "?" + "&".join(f"{name}={value}" for name, value in sorted(request.query_params.multi_items()))
+
+    async def _lookup(self, key: str) -> Optional[CachedResponse]:
+        entry = await self.backend.get(key)
+        if entry is not None and entry.scope is not None and entry.version != await self.backend.version(entry.scope):
+            return None
+        return entry
+
+    async def respond(self, request: Request, compute: Callable[[], Awaitable[Any]], scope: Optional[str] = ALL_MAILBOXES,
+                      ttl: float = None, exclude_none: bool = False) -> Response:
+        """
+        Serve the cached response of the request, or compute, encode and
+        cache it. `scope` is the mailbox the response depends on
+        (ALL_MAILBOXES when not filtered by mailbox, None to rely on the TTL
+        only).
+        """
+        ttl = settings.RESPONSE_CACHE_TTL if ttl is None else ttl
+        if self.backend is None or ttl <= 0:
+            return etag_response(request, encode_json(await compute(), exclude_none))
+
+        key = self.cache_key(request)
+        route = getattr(request.scope.get("route"), "path", request.url.path)
+        refresh = "no-cache" in request.headers.get("cache-control", "")
+        entry = None if refresh else await self._lookup(key)
+        if entry is None:
+            lock = self._locks.setdefault(key, asyncio.Lock())
+            self._lock_users[key] = self._lock_users.get(key, 0) + 1
+            waited = lock.locked()
+            try:
+                async with lock:
+                    # Another request computed it while this one waited; if
+                    # that computation failed, this one computes in its turn
+                    entry = await self._lookup(key) if waited and not refresh else None
+                    if entry is None:
+                        # Read before computing: a write landing meanwhile leaves the entry stale, not wrong
+                        version = await self.backend.version(scope) if scope is not None else 0
+                        body = encode_json(await compute(), exclude_none)
+                        computed = CachedResponse(body, make_etag(body), scope, version)
+                        await self.backend.set(key, computed, ttl)
+            finally:
+                self._lock_users[key] -= 1
+                if not self._lock_users[key]:
+                    del self._lock_users[key]
+                    del self._locks[key]
+            if entry is None:
+                RESPONSE_CACHE_LOOKUPS.labels(route, "miss").inc()
+                return etag_response(request, computed.body, computed.etag, "MISS")
+        RESPONSE_CACHE_LOOKUPS.labels(route, "hit").inc()
+        return etag_response(request, entry.body, entry.etag, "HIT")
+
+    async def invalidate_mailbox(self, mailbox: Optional[str]):
+        """
+        Drop the cached reads that may include emails of `mailbox`
+        """
+        if self.backend is not None:
+            try:
+                await self.backend.invalidate(_mailbox_scopes(mailbox))
+            except Exception as e:
+                logger.error(f"Failed to invalidate cached responses of {mailbox}: {str(e)}")
+
+def _mailbox_scopes(mailbox: Optional[str]) -> list:
+    return [ALL_MAILBOXES] if not mailbox else [mailbox, ALL_MAILBOXES]
+
+def create_response_cache() -> ResponseCache:
+    """
+    Create the response cache selected by RESPONSE_CACHE_BACKEND
+    """
+    backend = create_backend("RESPONSE_CACHE_BACKEND", settings.RESPONSE_CACHE_BACKEND, {
+        "none": lambda: None, "memory": InMemoryCacheBackend, "mongo": MongoCacheBackend
+    }, default="memory")
+    return ResponseCache(backend)
+
+# Shared cache instance
+_response_cache: Optional[ResponseCache] = None
+
+def get_response_cache() -> ResponseCache:
+    """
+    Get or create the shared response cache
+    """
+    global _response_cache
+
+    if _response_cache is None:
+        _response_cache = create_response_cache()
+    return _response_cache
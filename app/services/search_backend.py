@@ -0,0 +1,176 @@
+import abc
+import heapq
+import logging
+import math
+import re
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from app.backends import create_backend, lazy_attribute
+from app.repositories.email_repository import EmailRepository
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Subject matches count as much as SUBJECT_WEIGHT body matches, like the
+# weights of the MongoDB text index
+SUBJECT_WEIGHT = 10
+TOKEN_PATTERN = re.compile(r"\w+")
+HTML_TAG_PATTERN = re.compile(r"<[^>]+>")
+
+class SearchBackend(abc.ABC):
+    """
+    Full-text search over stored emails.
+
+    `search` returns one page of documents (without body, each with a
+    "score"), best match first, and whether more results follow. Backends
+    that keep their own index are fed through `index_documents`/`remove_emails`
+    whenever emails are stored or deleted.
+    """
+    @abc.abstractmethod
+    async def search(self, text: str, mailbox: Optional[str] = None, offset: int = 0,
+                     limit: int = 25) -> Tuple[List[dict], bool]:
+        pass
+
+    # Indexing is optional: backends searching the stored emails directly ignore it
+
+    def index_documents(self, documents: List[dict]):
+        """
+        Add or replace EmailDB documents in the index
+        """
+
+    def remove_emails(self, email_ids: List[str]):
+        """
+        Drop emails from the index
+        """
+
+class MongoSearchBackend(SearchBackend):
+    """
+    Search through the MongoDB text index on subject and body, which MongoDB
+    keeps up to date on every write
+    """
+    email_repository: EmailRepository = lazy_attribute(EmailRepository)
+
+    def __init__(self, email_repository: EmailRepository = None):
+        self._email_repository = email_repository
+
+    async def search(self, text: str, mailbox: Optional[str] = None, offset: int = 0,
+                     limit: int = 25) -> Tuple[List[dict], bool]:
+        return await self.email_repository.search_emails_async(text, mailbox=mailbox, offset=offset, limit=limit)
+
+class InMemorySearchBackend(SearchBackend):
+    """
+    Inverted index held in the process, ranked with BM25. Meant for tests and
+    small single-process deployments: it only knows the emails stored since
+    the process started.
+    """
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        # term -> {email_id: weighted term frequency}
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._documents: Dict[str, dict] = {}
+        self._terms: Dict[str, Counter] = {}
+        self._lengths: Dict[str, int] = {}
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def index_documents(self, documents: List[dict]):
+        with self._lock:
+            for document in documents:
+                self._add(document)
+
+    def remove_emails(self, email_ids: List[str]):
+        with self._lock:
+            for email_id in email_ids:
+                self._remove(email_id)
+
+    async def search(self, text: str, mailbox: Optional[str] = None, offset: int = 0,
+                     limit: int = 25) -> Tuple[List[dict], bool]:
+        terms = set(tokenize(text))
+        with self._lock:
+            count = len(self._documents)
+            if not terms or not count:
+                return [], False
+            average_length = self._total_length / count
+            lengths = self._lengths
+            k1, b = self.k1, self.b
+            scores: Dict[str, float] = {}
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for email_id, frequency in postings.items():
+                    norm = k1 * (1 - b + b * lengths[email_id] / average_length)
+                    scores[email_id] = scores.get(email_id, 0.0) + idf * frequency * (k1 + 1) / (frequency + norm)
+
+            if mailbox:
+                scores = {email_id: score for email_id, score in scores.items()
+                          if self._documents[email_id].get("mailbox") == mailbox}
+            # Only the requested page has to be ordered, not every match
+            top = heapq.nlargest(offset + limit, scores.items(), key=lambda item: item[1])
+            top.sort(key=lambda item: (-item[1], -self._documents[item[0]]["received_datetime"].timestamp(), item[0]))
+            documents = [dict(self._documents[email_id], score=score) for email_id, score in top[offset:]]
+        return documents, len(scores) > offset + limit
+
+    def _add(self, document: dict):
+        email_id = document["email_id"]
+        self._remove(email_id)
+        terms = Counter()
+        for term in tokenize(document.get("subject", "")):
+            terms[term] += SUBJECT_WEIGHT
+        body = document.get("body", "")
+        if document.get("is_html"):
+            body = HTML_TAG_PATTERN.sub(" ", body)
+        terms.update(tokenize(body))
+
+        for term, frequency in terms.items():
+            self._postings.setdefault(term, {})[email_id] = frequency
+        self._terms[email_id] = terms
+        self._lengths[email_id] = sum(terms.values())
+        self._total_length += self._lengths[email_id]
+        # Keep what the list API returns; the body is only needed for indexing
+        self._documents[email_id] = {
+            key: value for key, value in document.items() if key not in ("body", "created_at")
+        }
+        self._documents[email_id]["_id"] = email_id
+
+    def _remove(self, email_id: str):
+        terms = self._terms.pop(email_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = self._postings[term]
+            del postings[email_id]
+            if not postings:
+                del self._postings[term]
+        self._total_length -= self._lengths.pop(email_id)
+        del self._documents[email_id]
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+def create_search_backend() -> SearchBackend:
+    """
+    Create the search backend selected by SEARCH_BACKEND
+    """
+    return create_backend("SEARCH_BACKEND", settings.SEARCH_BACKEND,
+                          {"mongo": MongoSearchBackend, "memory": InMemorySearchBackend}, default="mongo")
+
+# Shared backend instance
+_search_backend: Optional[SearchBackend] = None
+
+def get_search_backend() -> SearchBackend:
+    """
+    Get or create the shared search backend
+    """
+    global _search_backend
+
+    if _search_backend is None:
+        _search_backend = create_search_backend()
+    return _search_backend
@@ -0,0 +1,123 @@
+import logging
+from datetime import datetime, timedelta
+from typing import List
+
+from app.exceptions import GraphAPIError
+from app.repositories.subscription_repository import SubscriptionRepository
+from app.services.graph_client import GraphClient, get_graph_client
+from app.services.graph_retry import parse_retry_after
+from app.services.token_service import token_cache
+from config import settings
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class SubscriptionService:
+    """
+    Creates and renews Microsoft Graph change-notification subscriptions for
+    new messages in the inbox of each mailbox
+    """
+    def __init__(self, graph_client: GraphClient = None):
+        self.token_service = token_cache
+        self.graph_client = graph_client or get_graph_client()
+        self.subscription_repository = SubscriptionRepository()
+
+    async def ensure_subscriptions(self, mailboxes: List[str]):
+        """
+        Make sure every mailbox has a subscription that is not about to expire
+        """
+        for mailbox in mailboxes:
+            try:
+                await self.ensure_subscription(mailbox)
+            except Exception as e:
+                logger.error(f"Failed to subscribe to {mailbox}: {str(e)}")
+
+    async def ensure_subscription(self, mailbox: str) -> dict:
+        """
+        Create the subscription of a mailbox, or renew it when it expires
+        within two renewal intervals
+        """
+        if not settings.WEBHOOK_CLIENT_STATE:
+            raise ValueError("WEBHOOK_CLIENT_STATE must be set to subscribe to change notifications")
+        existing = await self.subscription_repository.get_subscription_async(mailbox)
+        renew_before = datetime.utcnow() + timedelta(seconds=2 * settings.WEBHOOK_RENEWAL_INTERVAL)
+        if existing and existing["expiration_datetime"] > renew_before:
+            return existing
+
+        headers = {
+            "Authorization": f"Bearer {await self.token_service.get_access_token_async()}",
+            "Content-Type": "application/json"
+        }
+        expiration = datetime.utcnow() + timedelta(minutes=settings.WEBHOOK_SUBSCRIPTION_MINUTES)
+        expiration_value = expiration.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+        if existing:
+            response = await self.graph_client.patch(
+                f"{settings.GRAPH_API_BASE_URL}/subscriptions/{existing['subscription_id']}",
+                headers=headers,
+                json={"expirationDateTime": expiration_value}
+            )
+            if response.status_code == 200:
+                await self.subscription_repository.save_subscription_async(mailbox, existing["subscription_id"], expiration)
+                logger.info(f"Renewed subscription of {mailbox} until {expiration_value}")
+                return await self.subscription_repository.get_subscription_async(mailbox)
+            if response.status_code != 404:
+                raise GraphAPIError(
+                    f"Failed to renew subscription: {response.status_code} - {response.text}",
+                    response.status_code,
+                    retry_after=parse_retry_after(response.headers.get("Retry-After"))
+                )
+            # The subscription expired or was removed on the Graph side: create a new one
+            logger.warning(f"Subscription of {mailbox} no longer exists, creating a new one")
+
+        resource = "me" if mailbox == "me" else f"users/{mailbox}"
+        response = await self.graph_client.post(
+            f"{settings.GRAPH_API_BASE_URL}/subscriptions",
+            headers=headers,
+            json={
+                "changeType": "created",
+                "notificationUrl": settings.WEBHOOK_NOTIFICATION_URL,
+                "resource": f"{resource}/mailFolders('inbox')/messages",
+                "expirationDateTime": expiration_value,
+                "clientState": settings.WEBHOOK_CLIENT_STATE
+            }
+        )
+        if response.status_code != 201:
+            raise GraphAPIError(
+                f"Failed to create subscription: {response.status_code} - {response.text}",
+                response.status_code,
+                retry_after=parse_retry_after(response.headers.get("Retry-After"))
+            )
+        subscription_id = response.json()["id"]
+        await self.subscription_repository.save_subscription_async(mailbox, subscription_id, expiration)
+        logger.info(f"Created subscription {subscription_id} for {mailbox} until {expiration_value}")
+        return await self.subscription_repository.get_subscription_async(mailbox)
+
+    async def remove_subscriptions(self, mailboxes: List[str]):
+        """
+        Delete the subscriptions of mailboxes that are no longer retrieved
+        """
+        for mailbox in mailboxes:
+            try:
+                await self.remove_subscription(mailbox)
+            except Exception as e:
+                logger.error(f"Failed to unsubscribe from {mailbox}: {str(e)}")
+
+    async def remove_subscription(self, mailbox: str):
+        existing = await self.subscription_repository.get_subscription_async(mailbox)
+        if existing is None:
+            return
+        response = await self.graph_client.delete(
+            f"{settings.GRAPH_API_BASE_URL}/subscriptions/{existing['subscription_id']}",
+            headers={"Authorization": f"Bearer {await self.token_service.get_access_token_async()}"}
+        )
+        # 404: the subscription already expired on the Graph side
+        if response.status_code not in (204, 404):
+            raise GraphAPIError(
+                f"Failed to delete subscription: {response.status_code} - {response.text}",
+                response.status_code,
+                retry_after=parse_retry_after(response.headers.get("Retry-After"))
+            )
+        await self.subscription_repository.delete_subscription_async(mailbox)
+        logger.info(f"Deleted subscription {existing['subscription_id']} of {mailbox}")
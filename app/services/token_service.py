@@ -1,6 +1,15 @@
+import asyncio
 import logging
-import requests
+import os
+import socket
+import threading
+import time
+import uuid
 
+import httpx
+
+from app.metrics import TOKEN_REFRESH_DURATION, TOKEN_REFRESHES
+from app.services.token_store import TokenStore, create_token_store
 from config import settings
 
 # Configure logging
@@ -11,53 +20,260 @@ from datetime import datetime, timedelta
 from typing import Optional
 
 class TokenCache:
-    def __init__(self):
+    """
+    Process-local view of the tokens held in the shared token store. Reads are
+    served from the local copy; refreshes go through the store so that all
+    workers share one token and one refresh per expiry.
+    """
+    def __init__(self, store: TokenStore = None):
         self.access_token: Optional[str] = None
         self.refresh_token: Optional[str] = None
         self.expiry: Optional[datetime] = None
+        self.store = store or create_token_store()
+        self._owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        # Single-flight refresh: one caller refreshes, the others wait for the lock
+        # and share its outcome (identified by the refresh generation)
+        self._refresh_lock = threading.Lock()
+        self._refresh_generation = 0
+        self._refresh_error: Optional[Exception] = None
+        # Refresh shared by the coroutines of the event loop awaiting a token
+        self._refresh_task: Optional[asyncio.Future] = None
+        self._renewal_thread: Optional[threading.Thread] = None
+        self._stop_renewal = threading.Event()
 
     def is_token_valid(self) -> bool:
-        return self.access_token is not None and self.expiry is not None and datetime.now() < self.expiry
+        return self.access_token is not None and self.expiry is not None and datetime.utcnow() < self.expiry
+
+    def is_token_expiring(self) -> bool:
+        """
+        True when the token expires within TOKEN_REFRESH_SKEW seconds
+        """
+        return self.expiry is None or datetime.utcnow() >= self.expiry - timedelta(seconds=settings.TOKEN_REFRESH_SKEW)
 
     def set_tokens(self, access_token: str, expires_in: int, refresh_token: str):
-        self.access_token = access_token
-        self.refresh_token = refresh_token
-        self.expiry = datetime.now() + timedelta(seconds=expires_in)  # small buffer
+        expiry = datetime.utcnow() + timedelta(seconds=expires_in)  # small buffer
+        self._adopt(self.store.save(access_token, refresh_token, expiry))
         logger.info(f"Tokens set: access_token={access_token}, refresh_token={refresh_token}, expires_in={expires_in}")
 
+    def _adopt(self, record: Optional[dict]):
+        # Take over the tokens stored in the shared store
+        if record is None:
+            return
+        self.access_token = record["access_token"]
+        self.refresh_token = record["refresh_token"]
+        self.expiry = record["expiry"]
+
     def get_access_token(self):
         logger.info("Getting access token...")
         if self.is_token_valid():
             logger.info("Token is valid. Returning...")
             return self.access_token
-        if self.refresh_token:
-            # Refresh using the refresh token
-            logger.info("Refreshing token...")
-            token_url = f"{settings.MS_AUTHORITY}/oauth2/v2.0/token"
-            refresh_response = requests.post(
-                url=token_url,
-                data={
-                    "client_id": settings.MS_CLIENT_ID,
-                    "client_secret": settings.MS_CLIENT_SECRET,
-                    "refresh_token": self.refresh_token,
-                    "grant_type": "refresh_token",
-                    "scope": settings.MAIL_SCOPE,
-                },
-                headers={"Content-Type": "application/x-www-form-urlencoded"}
-            )
-
-            if refresh_response.status_code == 200:
-                logger.info(f"Refresh Response: {refresh_response.json()}")
-                tokens = refresh_response.json()
-                self.set_tokens(
-                    access_token=tokens["access_token"],
-                    refresh_token=tokens["refresh_token"],
-                    expires_in=tokens["expires_in"]
+        return self._refresh_single_flight(force=True)
+
+    async def get_access_token_async(self) -> str:
+        """
+        get_access_token for coroutines. Concurrent callers await one shared
+        refresh, which goes through the store's async API and the async HTTP
+        client so the event loop is never blocked.
+        """
+        if self.is_token_valid():
+            return self.access_token
+        refresh = self._refresh_task
+        if refresh is None or refresh.done() or refresh.get_loop() is not asyncio.get_running_loop():
+            refresh = self._refresh_task = asyncio.ensure_future(self._refresh_shared_async())
+        # A cancelled caller must not cancel the refresh the others are waiting on
+        return await asyncio.shield(refresh)
+
+    def refresh_if_expiring(self):
+        """
+        Renew the token ahead of its expiry so request paths never wait on the
+        token endpoint. Does nothing when the token is not about to expire.
+        """
+        if self.refresh_token is None:
+            # This worker never saw a login: pick up the tokens another worker stored
+            self._adopt(self.store.load())
+        if self.refresh_token and self.is_token_expiring():
+            self._refresh_single_flight(force=False)
+
+    def _refresh_single_flight(self, force: bool):
+        generation = self._refresh_generation
+        with self._refresh_lock:
+            if self._refresh_generation != generation:
+                # A refresh finished while we were waiting: share its outcome
+                if self._refresh_error is not None:
+                    raise self._refresh_error
+                return self.access_token
+            if self.is_token_valid() and (force or not self.is_token_expiring()):
+                return self.access_token
+            try:
+                self._refresh_shared(force)
+                self._refresh_error = None
+            except Exception as e:
+                self._refresh_error = e
+                raise
+            finally:
+                self._refresh_generation += 1
+            return self.access_token
+
+    def _refresh_shared(self, force: bool):
+        """
+        Refresh through the shared store: adopt tokens another worker already
+        refreshed, otherwise take the refresh lease (compare-and-swap on the
+        record version), refresh, and publish the new tokens
+        """
+        deadline = time.monotonic() + settings.TOKEN_REFRESH_LEASE
+        while True:
+            record = self.store.load()
+            self._adopt(record)
+            if self.is_token_valid() and (force or not self.is_token_expiring()):
+                return
+            if record is None or not self.refresh_token:
+                raise Exception("No refresh token available. Please Re-authentication.")
+
+            if self.store.try_acquire_refresh(record["version"], self._owner, settings.TOKEN_REFRESH_LEASE):
+                try:
+                    tokens = self._request_tokens(self.refresh_token)
+                except Exception:
+                    self.store.release_refresh(self._owner)
+                    raise
+                expiry = datetime.utcnow() + timedelta(seconds=tokens["expires_in"])
+                # The token endpoint does not always rotate the refresh token
+                refresh_token = tokens.get("refresh_token", self.refresh_token)
+                refreshed = self.store.complete_refresh(
+                    record["version"], self._owner, tokens["access_token"], refresh_token, expiry
+                )
+                if refreshed is not None:
+                    self._adopt(refreshed)
+                    logger.info(f"Token refreshed, expires at {expiry}")
+                    return
+                # Someone wrote newer tokens (e.g. a new login) in the meantime: use those
+                continue
+
+            # Another worker is refreshing: wait for it to publish the new tokens
+            if time.monotonic() >= deadline:
+                raise Exception("Timed out waiting for another worker to refresh the token.")
+            time.sleep(settings.TOKEN_STORE_POLL_INTERVAL)
+
+    async def _refresh_shared_async(self) -> str:
+        """
+        _refresh_shared for the event loop: the store is read through its
+        async API and the wait for another worker's refresh is an asyncio.sleep
+        """
+        deadline = time.monotonic() + settings.TOKEN_REFRESH_LEASE
+        while True:
+            record = await self.store.load_async()
+            self._adopt(record)
+            if self.is_token_valid():
+                return self.access_token
+            if record is None or not self.refresh_token:
+                raise Exception("No refresh token available. Please Re-authentication.")
+
+            if await self.store.try_acquire_refresh_async(record["version"], self._owner, settings.TOKEN_REFRESH_LEASE):
+                try:
+                    tokens = await self._request_tokens_async(self.refresh_token)
+                except Exception:
+                    await self.store.release_refresh_async(self._owner)
+                    raise
+                expiry = datetime.utcnow() + timedelta(seconds=tokens["expires_in"])
+                refresh_token = tokens.get("refresh_token", self.refresh_token)
+                refreshed = await self.store.complete_refresh_async(
+                    record["version"], self._owner, tokens["access_token"], refresh_token, expiry
                 )
-            else:
-                raise Exception("Failed to refresh token. Re-authentication needed.")
-        else:
-            raise Exception("No refresh token available. Please Re-authentication.")
+                if refreshed is not None:
+                    self._adopt(refreshed)
+                    logger.info(f"Token refreshed, expires at {expiry}")
+                    return self.access_token
+                continue
+
+            if time.monotonic() >= deadline:
+                raise Exception("Timed out waiting for another worker to refresh the token.")
+            await asyncio.sleep(settings.TOKEN_STORE_POLL_INTERVAL)
+
+    @staticmethod
+    def _token_request(refresh_token: str) -> dict:
+        return {
+            "url": f"{settings.MS_AUTHORITY}/oauth2/v2.0/token",
+            "data": {
+                "client_id": settings.MS_CLIENT_ID,
+                "client_secret": settings.MS_CLIENT_SECRET,
+                "refresh_token": refresh_token,
+                "grant_type": "refresh_token",
+                "scope": settings.MAIL_SCOPE,
+            },
+            "headers": {"Content-Type": "application/x-www-form-urlencoded"}
+        }
+
+    @staticmethod
+    def _token_response(refresh_response: httpx.Response) -> dict:
+        if refresh_response.status_code == 200:
+            TOKEN_REFRESHES.labels("success").inc()
+            return refresh_response.json()
+        TOKEN_REFRESHES.labels("failure").inc()
+        raise Exception("Failed to refresh token. Re-authentication needed.")
+
+    def _request_tokens(self, refresh_token: str) -> dict:
+        # Refresh using the refresh token
+        logger.info("Refreshing token...")
+        started = time.perf_counter()
+        try:
+            refresh_response = httpx.post(**self._token_request(refresh_token))
+        except httpx.HTTPError:
+            TOKEN_REFRESHES.labels("error").inc()
+            raise
+        finally:
+            TOKEN_REFRESH_DURATION.observe(time.perf_counter() - started)
+        return self._token_response(refresh_response)
+
+    async def _request_tokens_async(self, refresh_token: str) -> dict:
+        logger.info("Refreshing token...")
+        started = time.perf_counter()
+        try:
+            async with httpx.AsyncClient() as client:
+                refresh_response = await client.post(**self._token_request(refresh_token))
+        except httpx.HTTPError:
+            TOKEN_REFRESHES.labels("error").inc()
+            raise
+        finally:
+            TOKEN_REFRESH_DURATION.observe(time.perf_counter() - started)
+        return self._token_response(refresh_response)
+
+    def start_background_refresh(self):
+        """
+        Start a daemon thread renewing the token TOKEN_REFRESH_SKEW seconds
+        before it expires
+        """
+        if self._renewal_thread is not None and self._renewal_thread.is_alive():
+            return
+        self._stop_renewal.clear()
+        self._renewal_thread = threading.Thread(target=self._renewal_loop, name="token-renewal", daemon=True)
+        self._renewal_thread.start()
+        logger.info("Background token renewal started")
+
+    def stop_background_refresh(self):
+        """
+        Stop the background renewal thread
+        """
+        self._stop_renewal.set()
+        if self._renewal_thread is not None:
+            self._renewal_thread.join(timeout=5)
+            self._renewal_thread = None
+            logger.info("Background token renewal stopped")
+
+    def _renewal_loop(self):
+        while not self._stop_renewal.is_set():
+            try:
+                self.refresh_if_expiring()
+            except Exception as e:
+                logger.error(f"Background token renewal failed: {str(e)}")
+            self._stop_renewal.wait(self._seconds_until_renewal())
+
+    def _seconds_until_renewal(self) -> float:
+        interval = settings.TOKEN_REFRESH_CHECK_INTERVAL
+        if self.expiry is None or not self.refresh_token:
+            return interval
+        seconds = (self.expiry - timedelta(seconds=settings.TOKEN_REFRESH_SKEW) - datetime.utcnow()).total_seconds()
+        # Past the renewal point means the last renewal failed: retry at the normal interval
+        return min(interval, max(1.0, seconds)) if seconds > 0 else interval
 
 # global token cache
-token_cache = TokenCache()
\ No newline at end of file
+token_cache = TokenCache()
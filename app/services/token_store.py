@@ -0,0 +1,224 @@
+import abc
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from app.backends import create_backend, lazy_attribute
+from app.db.mongodb import get_async_token_collection, get_token_collection
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+class TokenStore(abc.ABC):
+    """
+    Storage for the OAuth tokens shared by every worker process.
+
+    A record holds access_token, refresh_token, expiry and a version that is
+    bumped on every write. Refreshes are coordinated with compare-and-swap on
+    the version: a worker first takes a short refresh lease, refreshes, then
+    writes the new tokens only if nobody else wrote in between.
+
+    The refresh operations have async counterparts for refreshes awaited on
+    the event loop.
+    """
+    @abc.abstractmethod
+    def load(self) -> Optional[dict]:
+        pass
+
+    @abc.abstractmethod
+    def save(self, access_token: str, refresh_token: str, expiry: datetime) -> dict:
+        """
+        Unconditionally store new tokens (e.g. after an interactive login)
+        """
+
+    @abc.abstractmethod
+    def try_acquire_refresh(self, version: int, owner: str, lease_seconds: float) -> bool:
+        """
+        Take the refresh lease if the record is still at `version` and no other
+        worker holds an unexpired lease
+        """
+
+    @abc.abstractmethod
+    def complete_refresh(self, version: int, owner: str, access_token: str, refresh_token: str,
+                         expiry: datetime) -> Optional[dict]:
+        """
+        Store refreshed tokens if `owner` still holds the lease on `version`.
+        Returns the new record, or None when the swap lost.
+        """
+
+    @abc.abstractmethod
+    def release_refresh(self, owner: str):
+        """
+        Give the refresh lease back after a failed refresh
+        """
+
+    @abc.abstractmethod
+    async def load_async(self) -> Optional[dict]:
+        pass
+
+    @abc.abstractmethod
+    async def try_acquire_refresh_async(self, version: int, owner: str, lease_seconds: float) -> bool:
+        pass
+
+    @abc.abstractmethod
+    async def complete_refresh_async(self, version: int, owner: str, access_token: str, refresh_token: str,
+                                     expiry: datetime) -> Optional[dict]:
+        pass
+
+    @abc.abstractmethod
+    async def release_refresh_async(self, owner: str):
+        pass
+
+class InMemoryTokenStore(TokenStore):
+    """
+    Token store local to the process, for single-worker deployments and tests
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._record: Optional[dict] = None
+
+    def load(self) -> Optional[dict]:
+        with self._lock:
+            return dict(self._record) if self._record else None
+
+    def save(self, access_token: str, refresh_token: str, expiry: datetime) -> dict:
+        with self._lock:
+            version = self._record["version"] + 1 if self._record else 1
+            self._record = _token_record(access_token, refresh_token, expiry, version)
+            return dict(self._record)
+
+    def try_acquire_refresh(self, version: int, owner: str, lease_seconds: float) -> bool:
+        now = datetime.utcnow()
+        with self._lock:
+            record = self._record
+            if record is None or record["version"] != version:
+                return False
+            if record["refresh_lease_until"] is not None and record["refresh_lease_until"] > now:
+                return False
+            record["refresh_owner"] = owner
+            record["refresh_lease_until"] = now + timedelta(seconds=lease_seconds)
+            return True
+
+    def complete_refresh(self, version: int, owner: str, access_token: str, refresh_token: str,
+                         expiry: datetime) -> Optional[dict]:
+        with self._lock:
+            record = self._record
+            if record is None or record["version"] != version or record["refresh_owner"] != owner:
+                return None
+            self._record = _token_record(access_token, refresh_token, expiry, version + 1)
+            return dict(self._record)
+
+    def release_refresh(self, owner: str):
+        with self._lock:
+            if self._record and self._record["refresh_owner"] == owner:
+                self._record["refresh_owner"] = None
+                self._record["refresh_lease_until"] = None
+
+    # The lock is only held for a few assignments, the async API can share it
+
+    async def load_async(self) -> Optional[dict]:
+        return self.load()
+
+    async def try_acquire_refresh_async(self, version: int, owner: str, lease_seconds: float) -> bool:
+        return self.try_acquire_refresh(version, owner, lease_seconds)
+
+    async def complete_refresh_async(self, version: int, owner: str, access_token: str, refresh_token: str,
+                                     expiry: datetime) -> Optional[dict]:
+        return self.complete_refresh(version, owner, access_token, refresh_token, expiry)
+
+    async def release_refresh_async(self, owner: str):
+        self.release_refresh(owner)
+
+class MongoTokenStore(TokenStore):
+    """
+    Token store shared by every worker and replica through MongoDB
+    """
+    collection = lazy_attribute(get_token_collection)
+    async_collection = lazy_attribute(get_async_token_collection)
+
+    def __init__(self, collection=None, key: str = None, async_collection=None):
+        self._collection = collection
+        self._async_collection = async_collection
+        self.key = key or settings.TOKEN_STORE_KEY
+
+    def load(self) -> Optional[dict]:
+        return self.collection.find_one({"_id": self.key})
+
+    def save(self, access_token: str, refresh_token: str, expiry: datetime) -> dict:
+        record = _token_record(access_token, refresh_token, expiry, version=None)
+        del record["version"]
+        self.collection.update_one({"_id": self.key}, {"$set": record, "$inc": {"version": 1}}, upsert=True)
+        return self.load()
+
+    def _acquire_update(self, version: int, owner: str, lease_seconds: float) -> Tuple[dict, dict]:
+        now = datetime.utcnow()
+        return (
+            {
+                "_id": self.key,
+                "version": version,
+                "$or": [{"refresh_lease_until": None}, {"refresh_lease_until": {"$lt": now}}]
+            },
+            {"$set": {"refresh_owner": owner, "refresh_lease_until": now + timedelta(seconds=lease_seconds)}}
+        )
+
+    def _complete_update(self, version: int, owner: str, access_token: str, refresh_token: str,
+                         expiry: datetime) -> Tuple[dict, dict]:
+        record = _token_record(access_token, refresh_token, expiry, version=None)
+        del record["version"]
+        return {"_id": self.key, "version": version, "refresh_owner": owner}, {"$set": record, "$inc": {"version": 1}}
+
+    def _release_update(self, owner: str) -> Tuple[dict, dict]:
+        return {"_id": self.key, "refresh_owner": owner}, {"$set": {"refresh_owner": None, "refresh_lease_until": None}}
+
+    def try_acquire_refresh(self, version: int, owner: str, lease_seconds: float) -> bool:
+        result = self.collection.update_one(*self._acquire_update(version, owner, lease_seconds))
+        return result.modified_count == 1
+
+    def complete_refresh(self, version: int, owner: str, access_token: str, refresh_token: str,
+                         expiry: datetime) -> Optional[dict]:
+        result = self.collection.update_one(
+            *self._complete_update(version, owner, access_token, refresh_token, expiry)
+        )
+        if result.modified_count != 1:
+            return None
+        return self.load()
+
+    def release_refresh(self, owner: str):
+        self.collection.update_one(*self._release_update(owner))
+
+    async def load_async(self) -> Optional[dict]:
+        return await self.async_collection.find_one({"_id": self.key})
+
+    async def try_acquire_refresh_async(self, version: int, owner: str, lease_seconds: float) -> bool:
+        result = await self.async_collection.update_one(*self._acquire_update(version, owner, lease_seconds))
+        return result.modified_count == 1
+
+    async def complete_refresh_async(self, version: int, owner: str, access_token: str, refresh_token: str,
+                                     expiry: datetime) -> Optional[dict]:
+        result = await self.async_collection.update_one(
+            *self._complete_update(version, owner, access_token, refresh_token, expiry)
+        )
+        if result.modified_count != 1:
+            return None
+        return await self.load_async()
+
+    async def release_refresh_async(self, owner: str):
+        await self.async_collection.update_one(*self._release_update(owner))
+
+def _token_record(access_token: str, refresh_token: str, expiry: datetime, version: Optional[int]) -> dict:
+    return {
+        "access_token": access_token,
+        "refresh_token": refresh_token,
+        "expiry": expiry,
+        "version": version,
+        "refresh_owner": None,
+        "refresh_lease_until": None
+    }
+
+def create_token_store() -> TokenStore:
+    """
+    Create the token store selected by TOKEN_STORE_BACKEND
+    """
+    return create_backend("TOKEN_STORE_BACKEND", settings.TOKEN_STORE_BACKEND,
+                          {"memory": InMemoryTokenStore, "mongo": MongoTokenStore}, default="memory")
@@ -0,0 +1,97 @@
+import asyncio
+import logging
+from typing import Optional
+
+from app.db.mongodb import ensure_indexes, get_async_mongo_client
+from app.schedulers.scheduler import start_scheduler
+from app.services.token_service import token_cache
+from app.workers.notification_worker import start_notification_worker
+from app.workers.send_worker import start_send_workers
+from config import settings
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class StartupState:
+    """
+    Progress of the background startup, reported by GET /readyz
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.mongo_ready = False
+        self.indexes_ready = False
+        self.services_started = False
+        self.error: Optional[str] = None
+
+    @property
+    def ready(self) -> bool:
+        # Index builds do not gate readiness: queries work, only slower, until they finish
+        return self.mongo_ready and self.services_started
+
+    def checks(self) -> dict:
+        return {"mongo": self.mongo_ready, "indexes": self.indexes_ready, "services": self.services_started}
+
+startup_state = StartupState()
+_startup_task: Optional[asyncio.Task] = None
+
+async def wait_for_mongo():
+    """
+    Ping MongoDB until it answers, every MONGODB_STARTUP_RETRY_INTERVAL seconds
+    """
+    while True:
+        try:
+            await get_async_mongo_client().admin.command("ping")
+            logger.info(f"Connected to MongoDB at {settings.MONGODB_URI}")
+            startup_state.error = None
+            return
+        except Exception as e:
+            startup_state.error = str(e)
+            logger.warning(f"MongoDB is not reachable yet, retrying in {settings.MONGODB_STARTUP_RETRY_INTERVAL}s: {str(e)}")
+            await asyncio.sleep(settings.MONGODB_STARTUP_RETRY_INTERVAL)
+
+async def create_indexes():
+    try:
+        await asyncio.to_thread(ensure_indexes)
+        startup_state.indexes_ready = True
+    except Exception as e:
+        logger.error(f"Failed to create MongoDB indexes: {str(e)}")
+
+async def start_services():
+    """
+    Wait for MongoDB, then create the indexes while the token renewal, the
+    scheduler and the workers start
+    """
+    await wait_for_mongo()
+    startup_state.mongo_ready = True
+    indexes = asyncio.create_task(create_indexes())
+    token_cache.start_background_refresh()
+    start_scheduler()
+    start_send_workers()
+    start_notification_worker()
+    startup_state.services_started = True
+    logger.info("Background services started")
+    await indexes
+
+def start_background_startup():
+    """
+    Run the startup in the background so the application serves /healthz
+    (and answers /readyz with 503) while MongoDB is being reached
+    """
+    global _startup_task
+
+    startup_state.reset()
+    _startup_task = asyncio.create_task(start_services())
+
+async def stop_background_startup():
+    """
+    Cancel a startup still in progress
+    """
+    global _startup_task
+
+    if _startup_task is not None:
+        _startup_task.cancel()
+        await asyncio.gather(_startup_task, return_exceptions=True)
+        _startup_task = None
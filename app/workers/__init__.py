@@ -0,0 +1 @@
+# Initialize the workers package
\ No newline at end of file
@@ -0,0 +1,151 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from app.dependencies import container
+from app.repositories.subscription_repository import SubscriptionRepository
+from config import settings
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class NotificationWorker:
+    """
+    Drains the queue of Graph change notifications received on POST /notifications
+    and fetches only the notified messages, batching them per mailbox
+    """
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # Subscription id -> (mailbox, expiration of the subscription)
+        self._mailboxes: Dict[str, Tuple[str, datetime]] = {}
+        self.email_service = None
+        self.subscription_repository = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def start(self):
+        """
+        Start the worker on the running event loop
+        """
+        if self.running:
+            return
+        self.email_service = self.email_service or container.email_service
+        self.subscription_repository = self.subscription_repository or SubscriptionRepository()
+        self._queue = asyncio.Queue(maxsize=settings.WEBHOOK_QUEUE_MAX_SIZE)
+        self._task = asyncio.create_task(self._run())
+        logger.info("Notification worker started")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            logger.info("Notification worker stopped")
+
+    def enqueue(self, subscription_id: str, email_id: str) -> bool:
+        """
+        Queue a notified message. Returns False when the queue is full (or the
+        worker is not running) so that Graph delivers the notification again.
+        """
+        if self._queue is None:
+            return False
+        try:
+            self._queue.put_nowait((subscription_id, email_id))
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def mailbox_for(self, subscription_id: str) -> Optional[str]:
+        """
+        Resolve the mailbox a subscription belongs to. Entries are cached until
+        the subscription expires, then looked up again, so renewed, replaced
+        and deleted subscriptions (on any replica) do not pile up.
+        """
+        cached = self._mailboxes.get(subscription_id)
+        if cached is None or cached[1] <= datetime.utcnow():
+            subscription = await self.subscription_repository.get_by_subscription_id_async(subscription_id)
+            if subscription is None:
+                self._mailboxes.pop(subscription_id, None)
+                return None
+            cached = self._mailboxes[subscription_id] = (subscription["_id"], subscription["expiration_datetime"])
+        return cached[0]
+
+    def evict_expired(self):
+        """
+        Drop the cached mailboxes of subscriptions that have expired
+        """
+        now = datetime.utcnow()
+        for subscription_id in [s for s, (_, expiration) in self._mailboxes.items() if expiration <= now]:
+            del self._mailboxes[subscription_id]
+
+    async def next_batch(self) -> List[tuple]:
+        """
+        Wait for a notification, then keep collecting for up to WEBHOOK_BATCH_WAIT
+        seconds so that a burst of new mail is fetched in few Graph calls
+        """
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.WEBHOOK_BATCH_WAIT
+        while len(batch) < settings.WEBHOOK_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def process(self, batch: List[tuple]):
+        """
+        Fetch and store the notified messages, one batched fetch per mailbox
+        """
+        self.evict_expired()
+        by_mailbox: Dict[str, List[str]] = {}
+        for subscription_id, email_id in batch:
+            mailbox = await self.mailbox_for(subscription_id)
+            if mailbox is None:
+                logger.warning(f"Ignoring notification for unknown subscription {subscription_id}")
+                continue
+            by_mailbox.setdefault(mailbox, []).append(email_id)
+
+        for mailbox, email_ids in by_mailbox.items():
+            try:
+                await self.email_service.fetch_emails(mailbox, email_ids)
+            except Exception as e:
+                # The low-frequency polling fallback picks these messages up later
+                logger.error(f"Failed to fetch notified emails of {mailbox}: {str(e)}")
+
+    async def _run(self):
+        while True:
+            batch = await self.next_batch()
+            try:
+                await self.process(batch)
+            except Exception as e:
+                logger.error(f"Notification worker error: {str(e)}")
+
+# Shared worker instance
+notification_worker = NotificationWorker()
+
+def start_notification_worker():
+    """
+    Start the change-notification worker when webhooks are enabled
+    """
+    if not settings.WEBHOOKS_ENABLED:
+        return
+    try:
+        notification_worker.start()
+    except Exception as e:
+        logger.error(f"Failed to start notification worker: {str(e)}")
+
+async def stop_notification_worker():
+    await notification_worker.stop()
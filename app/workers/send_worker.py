@@ -0,0 +1,180 @@
+import asyncio
+import logging
+from typing import List
+
+from app.dependencies import container
+from app.exceptions import GraphAPIError
+from app.metrics import OUTBOUND_QUEUE_DEPTH
+from app.models.email import EmailSendRequest
+from config import settings
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Graph rejecting the email itself (4xx, e.g. an invalid recipient) fails
+    it at once; throttling, timeouts, server and network errors are retried
+    """
+    if isinstance(error, GraphAPIError) and 400 <= error.status_code < 500:
+        return error.status_code in (408, 429)
+    # Invalid queued content (e.g. attachment bytes that are not base64) fails every time
+    if isinstance(error, ValueError):
+        return False
+    return True
+
+def retry_delay(attempts: int, error: Exception) -> float:
+    """
+    Exponential backoff from SEND_RETRY_BASE_DELAY, at least Graph's Retry-After
+    """
+    delay = min(settings.SEND_RETRY_BASE_DELAY * 2 ** (attempts - 1), settings.SEND_RETRY_MAX_DELAY)
+    retry_after = getattr(error, "retry_after", None)
+    return max(delay, retry_after) if retry_after is not None else delay
+
+class SendWorkerPool:
+    """
+    Pool of asyncio workers draining the outbound send queue stored in MongoDB
+    """
+    def __init__(self, worker_count: int = None):
+        self.worker_count = worker_count or settings.SEND_WORKER_COUNT
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+        self.outbound_repository = None
+        self.email_service = None
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self):
+        """
+        Start the send workers on the running event loop
+        """
+        if self.running:
+            return
+        self.outbound_repository = self.outbound_repository or container.outbound_repository
+        self.email_service = self.email_service or container.email_service
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._run(i)) for i in range(self.worker_count)]
+        if settings.METRICS_ENABLED:
+            self._tasks.append(asyncio.create_task(self._report_queue_depth()))
+        logger.info(f"Started {self.worker_count} send workers")
+
+    async def stop(self):
+        """
+        Stop the send workers. Emails being sent when stopped stay in-flight and
+        are picked up again once their lease expires.
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info("Send workers stopped")
+
+    def notify(self):
+        """
+        Wake idle workers up because a new email was queued
+        """
+        self._wakeup.set()
+
+    async def process_next(self) -> bool:
+        """
+        Claim and send one queued email. Returns False when the queue is empty.
+        """
+        queued = await self.outbound_repository.claim_next_async()
+        if queued is None:
+            return False
+
+        queue_id = queued["_id"]
+        attempts = queued.get("attempts", 1)
+        if attempts > settings.SEND_MAX_ATTEMPTS:
+            # Reclaimed after its worker died during the last allowed attempt
+            logger.error(f"Giving up on queued email {queue_id}: its worker stopped during attempt {attempts - 1}")
+            await self.outbound_repository.mark_failed_async(
+                queue_id, f"Send worker stopped during attempt {attempts - 1}", retry=False
+            )
+            return True
+
+        heartbeat = asyncio.create_task(self._renew_lease(queue_id, queued.get("claim_id")))
+        try:
+            await self.email_service.send_email(
+                EmailSendRequest(**queued["request"]),
+                parts_sent=queued.get("parts_sent", 0),
+                on_part_sent=lambda parts_sent: self.outbound_repository.mark_parts_sent_async(queue_id, parts_sent)
+            )
+            await self.outbound_repository.mark_sent_async(queue_id)
+        except Exception as e:
+            retry = attempts < settings.SEND_MAX_ATTEMPTS and is_retryable(e)
+            logger.error(f"Failed to send queued email {queue_id} (attempt {attempts}): {str(e)}")
+            await self.outbound_repository.mark_failed_async(queue_id, str(e), retry=retry,
+                                                             retry_delay=retry_delay(attempts, e))
+        finally:
+            heartbeat.cancel()
+        return True
+
+    async def _renew_lease(self, queue_id, claim_id: str):
+        """
+        Keep the lease of an email being sent alive, so a send running longer
+        than SEND_LEASE_TIMEOUT (e.g. a large upload) is not claimed again
+        """
+        while True:
+            await asyncio.sleep(settings.SEND_LEASE_TIMEOUT / 3)
+            try:
+                if not await self.outbound_repository.renew_lease_async(queue_id, claim_id):
+                    logger.warning(f"Lost the lease of queued email {queue_id}")
+                    return
+            except Exception as e:
+                logger.error(f"Failed to renew the lease of queued email {queue_id}: {str(e)}")
+
+    async def refresh_queue_depth(self):
+        """
+        Count the queued emails into the outbound_queue_depth gauge, so that
+        a Prometheus scrape does not query MongoDB
+        """
+        for status, count in (await self.outbound_repository.queue_depths_async()).items():
+            OUTBOUND_QUEUE_DEPTH.labels(status).set(count)
+
+    async def _report_queue_depth(self):
+        while True:
+            try:
+                await self.refresh_queue_depth()
+            except Exception as e:
+                logger.warning(f"Could not read outbound queue depth: {str(e)}")
+            await asyncio.sleep(settings.METRICS_QUEUE_DEPTH_INTERVAL)
+
+    async def _run(self, worker_id: int):
+        while True:
+            try:
+                if await self.process_next():
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Send worker {worker_id} error: {str(e)}")
+
+            # Queue is empty (or MongoDB is unavailable): wait for a new email or the poll interval
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=settings.SEND_WORKER_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+# Shared worker pool instance
+send_worker_pool = SendWorkerPool()
+
+def start_send_workers():
+    """
+    Start the outbound send workers
+    """
+    try:
+        send_worker_pool.start()
+    except Exception as e:
+        logger.error(f"Failed to start send workers: {str(e)}")
+
+async def stop_send_workers():
+    """
+    Stop the outbound send workers
+    """
+    if send_worker_pool.running:
+        await send_worker_pool.stop()
@@ -0,0 +1,75 @@
+"""
+Compare two benchmark result files, e.g. load test runs of two commits.
+
+    python -m benchmarks.compare benchmarks/results/load_abc1234.json benchmarks/results/load_def5678.json
+
+Prints every numeric metric of both runs with the relative change. Latencies
+(*_ms) getting higher and rates (*_per_second) getting lower by more than
+--threshold percent are flagged as regressions; --fail makes the command exit
+with status 1 when there are any.
+"""
+import argparse
+import json
+import sys
+from typing import Dict, Optional
+
+def flatten(results, prefix: str = "") -> Dict[str, float]:
+    """
+    Numeric leaves of a result document keyed by their dotted path
+    """
+    metrics = {}
+    if isinstance(results, dict):
+        for key, value in results.items():
+            metrics.update(flatten(value, f"{prefix}.{key}" if prefix else key))
+    elif isinstance(results, (int, float)) and not isinstance(results, bool):
+        metrics[prefix] = results
+    return metrics
+
+def change_percent(old: float, new: float) -> Optional[float]:
+    if old == 0:
+        return None
+    return (new - old) / old * 100
+
+def is_regression(metric: str, change: Optional[float], threshold: float) -> bool:
+    if change is None:
+        return False
+    if metric.endswith("_ms"):
+        return change > threshold
+    if metric.endswith("_per_second"):
+        return change < -threshold
+    return False
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=10.0, help="percent change flagged as a regression")
+    parser.add_argument("--fail", action="store_true", help="exit with status 1 on regressions")
+    args = parser.parse_args()
+
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    old_metrics = flatten(old.get("scenarios", old.get("results", old)))
+    new_metrics = flatten(new.get("scenarios", new.get("results", new)))
+
+    print(f"{'metric':<60} {old.get('commit') or 'old':>14} {new.get('commit') or 'new':>14} {'change':>9}")
+    regressions = []
+    for metric in sorted(old_metrics.keys() & new_metrics.keys()):
+        change = change_percent(old_metrics[metric], new_metrics[metric])
+        flag = ""
+        if is_regression(metric, change, args.threshold):
+            regressions.append(metric)
+            flag = "  REGRESSION"
+        shown = f"{change:+.1f}%" if change is not None else "n/a"
+        print(f"{metric:<60} {old_metrics[metric]:>14} {new_metrics[metric]:>14} {shown:>9}{flag}")
+
+    for metric in sorted(old_metrics.keys() ^ new_metrics.keys()):
+        print(f"{metric:<60} only in {'old' if metric in old_metrics else 'new'}")
+    print(f"{len(regressions)} regressions above {args.threshold}%")
+    if regressions and args.fail:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
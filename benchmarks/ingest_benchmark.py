@@ -0,0 +1,115 @@
+"""
+Ingestion microbenchmark.
+
+Measures the per-message CPU cost of turning a Graph message page into the
+documents written to MongoDB:
+
+- decode: JSON page bytes to dicts, with the json module and with orjson
+- convert: Graph message to EmailDB document, through pydantic models
+  (the original path building EmailDB and EmailResponse, and strict mode)
+  and with the lenient extractor
+- documents: the whole EmailRepository document build (conversion, search
+  text and body encoding) in strict and lenient mode
+
+    python -m benchmarks.ingest_benchmark --messages 1000 --rounds 20
+
+Results are printed and written to benchmarks/results/ingest.json.
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+from datetime import datetime
+from unittest.mock import patch
+
+from app.models.email import EmailDB, EmailResponse
+from app.repositories.email_repository import EmailRepository, to_email_document
+from app.services.graph_client import orjson
+from config import settings
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+def graph_message(i: int) -> dict:
+    """
+    A Graph message as returned with the $select of EmailService
+    """
+    return {
+        "@odata.etag": f'W/"CQAAABYAAAB{i}"',
+        "id": f"AAMkAGVmMDEzMTM4LTZmYWUtNDdkNC1hMDZiLTU1OGY5OTZhYmY4OABGAAAAAAAiQ8W967B7TKBjgx9rVEURBwAi{i:08d}=",
+        "subject": f"Quarterly report {i} - please review before Friday",
+        "sender": {"emailAddress": {"name": "Sender", "address": f"sender{i % 50}@example.com"}},
+        "toRecipients": [{"emailAddress": {"name": f"User {r}", "address": f"user{r}@example.com"}} for r in range(3)],
+        "ccRecipients": [{"emailAddress": {"name": "Team", "address": "team@example.com"}}],
+        "bccRecipients": [],
+        "body": {"contentType": "html", "content": "<html><body><p>" + "Lorem ipsum dolor sit amet. " * 40 + "</p></body></html>"},
+        "receivedDateTime": f"2023-06-{1 + i % 28:02d}T{i % 24:02d}:15:30Z",
+        "hasAttachments": i % 5 == 0
+    }
+
+def original_conversion(email: dict) -> dict:
+    """
+    The conversion store_emails did before: an EmailDB and an EmailResponse
+    per message, the latter thrown away by retrieve_emails
+    """
+    document = to_email_document(email, strict=True)
+    EmailResponse(
+        message="Email retrieved and stored",
+        email_id=document["email_id"],
+        subject=document["subject"],
+        sender=document["sender"],
+        received_datetime=email.get("receivedDateTime"),
+        body=document["body"]
+    )
+    return document
+
+def time_per_message(function, messages: int, rounds: int) -> dict:
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - started) / messages * 1e6)
+    return {"median_us": round(statistics.median(timings), 2), "min_us": round(min(timings), 2)}
+
+def run(messages: int, rounds: int) -> dict:
+    page = {"value": [graph_message(i) for i in range(messages)]}
+    payload = json.dumps(page).encode()
+    emails = page["value"]
+    repository = EmailRepository.__new__(EmailRepository)
+
+    def documents(mode):
+        with patch.object(settings, "INGEST_VALIDATION", mode):
+            repository._encoded_documents(repository.email_documents(emails, "me"))
+
+    results = {
+        "decode": {"json": time_per_message(lambda: json.loads(payload), messages, rounds)},
+        "convert": {
+            "original": time_per_message(lambda: [original_conversion(email) for email in emails], messages, rounds),
+            "strict": time_per_message(lambda: [to_email_document(email, strict=True) for email in emails], messages, rounds),
+            "lenient": time_per_message(lambda: [to_email_document(email, strict=False) for email in emails], messages, rounds)
+        },
+        "documents": {
+            "strict": time_per_message(lambda: documents("strict"), messages, rounds),
+            "lenient": time_per_message(lambda: documents("lenient"), messages, rounds)
+        }
+    }
+    if orjson is not None:
+        results["decode"]["orjson"] = time_per_message(lambda: orjson.loads(payload), messages, rounds)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the per-message cost of email ingestion")
+    parser.add_argument("--messages", type=int, default=1000, help="messages per page")
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    results = run(args.messages, args.rounds)
+    print(json.dumps(results, indent=2))
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, "ingest.json")
+    with open(path, "w") as f:
+        json.dump({"generated_at": datetime.utcnow().isoformat(), "messages": args.messages, "results": results}, f, indent=2)
+    print(f"Results written to {path}")
+
+if __name__ == "__main__":
+    main()
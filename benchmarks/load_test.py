@@ -0,0 +1,314 @@
+"""
+Load test of the service against the local mock Graph server.
+
+Scenarios:
+
+- send: POST /email/send on the FastAPI app served by uvicorn (with its send
+  workers), from `--concurrency` concurrent clients. Reports the route
+  latency and requests per second, then the delivery latency and rate of the
+  send workers until the outbound queue is drained.
+- retrieve: the scheduler's retrieval job run concurrently for `--mailboxes`
+  mailboxes, each a full delta sync of `--messages` messages.
+- store: EmailRepository.store_emails_async on generated pages, first
+  inserting then re-storing unchanged messages.
+
+    python -m benchmarks.load_test --mongo memory
+    python -m benchmarks.load_test --requests 5000 --concurrency 100 --latency-ms 30 --throttle-rate 0.02
+
+`--mongo uri` (default) writes to a dedicated "load_benchmark" database on
+MONGODB_URI, dropped afterwards. `--mongo memory` uses mongomock and needs no
+server; its write rates are far below a real MongoDB, so only compare memory
+runs with memory runs. Results are written to
+benchmarks/results/load_<commit>.json; compare two runs with
+`python -m benchmarks.compare old.json new.json`.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+import httpx
+
+from app.db import mongodb
+from benchmarks.mock_graph import MockGraphConfig, MockGraphServer, ServerThread
+from benchmarks.ingest_benchmark import graph_message
+from benchmarks.stats import git_commit, latency_summary
+from config import settings
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+BENCHMARK_DATABASE = "load_benchmark"
+SCENARIOS = ["send", "retrieve", "store"]
+
+class MongoTarget:
+    """
+    The MongoDB the service writes to: MONGODB_URI, or mongomock shared by
+    the sync and async clients
+    """
+    def __init__(self, mode: str):
+        self.mode = mode
+        self._memory_client = None
+        if mode == "memory":
+            import mongomock
+
+            self._memory_client = mongomock.MongoClient()
+
+    def connect(self):
+        """
+        (Re)install the clients; called before every phase because shutting
+        the app down closes them
+        """
+        if self._memory_client is not None:
+            from mongomock_motor import AsyncMongoMockClient
+
+            mongodb._mongo_client = self._memory_client
+            mongodb._async_mongo_client = AsyncMongoMockClient(mock_mongo_client=self._memory_client)
+
+    def write_ops(self):
+        """
+        Inserts, updates and deletes served by the MongoDB server so far
+        (None with mongomock)
+        """
+        if self._memory_client is not None:
+            return None
+        counters = mongodb.get_mongo_client().admin.command("serverStatus")["opcounters"]
+        return counters["insert"] + counters["update"] + counters["delete"]
+
+    def drop(self):
+        if self._memory_client is None:
+            mongodb.get_mongo_client().drop_database(BENCHMARK_DATABASE)
+
+def configure(mock_graph: MockGraphServer):
+    """
+    Point the service at the mock Graph server and the benchmark database
+    """
+    for name, value in mock_graph.settings_overrides().items():
+        setattr(settings, name, value)
+    settings.MONGODB_COLLECTION = BENCHMARK_DATABASE
+    # Keep background jobs out of the measurements
+    settings.EMAIL_RETRIEVAL_INTERVAL = 86400
+    settings.WEBHOOKS_ENABLED = False
+    # The mock server has no attachment endpoints
+    settings.ATTACHMENTS_ENABLED = False
+
+    from app.services.token_service import token_cache
+
+    # The mock server accepts any token: skip the Microsoft identity platform
+    token_cache.access_token = "benchmark-token"
+    token_cache.expiry = datetime.utcnow() + timedelta(days=1)
+
+def rate(count: int, seconds: float) -> float:
+    return round(count / seconds, 2) if seconds > 0 else 0.0
+
+def write_rates(mongo: MongoTarget, write_ops_before, seconds: float, documents: int) -> dict:
+    result = {"documents_written": documents, "documents_written_per_second": rate(documents, seconds)}
+    if write_ops_before is not None:
+        result["mongo_write_ops_per_second"] = rate(mongo.write_ops() - write_ops_before, seconds)
+    return result
+
+async def post_emails(app_url: str, requests: int, concurrency: int) -> dict:
+    payload = {"to_recipients": ["load@example.com"], "subject": "Load test", "body": "Load test body"}
+    latencies = []
+    statuses = {}
+    remaining = iter(range(requests))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=app_url, timeout=60, limits=limits) as client:
+        async def client_loop():
+            for _ in remaining:
+                started = time.perf_counter()
+                response = await client.post("/email/send", json=payload)
+                latencies.append((time.perf_counter() - started) * 1000)
+                statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+        seconds = time.perf_counter() - started
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "seconds": round(seconds, 3),
+        "requests_per_second": rate(requests, seconds),
+        "status_codes": statuses,
+        "latency": latency_summary(latencies)
+    }
+
+def wait_for_drain(timeout: float) -> float:
+    from app.repositories.outbound_repository import QUEUED_FILTER
+
+    collection = mongodb.get_outbound_collection()
+    started = time.perf_counter()
+    while collection.count_documents(QUEUED_FILTER) and time.perf_counter() - started < timeout:
+        time.sleep(0.1)
+    return time.perf_counter() - started
+
+def run_send(args, mongo: MongoTarget, mock_graph: MockGraphServer) -> dict:
+    mongo.connect()
+    from main import app
+
+    server = ServerThread(app).start()
+    try:
+        write_ops_before = mongo.write_ops()
+        sends_before = mock_graph.stats["sendMail"]
+        started = time.perf_counter()
+        route = asyncio.run(post_emails(server.url, args.requests, args.concurrency))
+        drain_seconds = wait_for_drain(args.drain_timeout)
+        seconds = time.perf_counter() - started
+        collection = mongodb.get_outbound_collection()
+        delivered = list(collection.find({"status": "sent"}, {"created_at": 1, "updated_at": 1}))
+        failed = collection.count_documents({"status": "failed"})
+    finally:
+        server.stop()
+
+    return {
+        "route": route,
+        "delivery": {
+            "sent": len(delivered),
+            "failed": failed,
+            "seconds": round(seconds, 3),
+            "drain_seconds_after_last_request": round(drain_seconds, 3),
+            "sends_per_second": rate(len(delivered), seconds),
+            "latency": latency_summary((d["updated_at"] - d["created_at"]).total_seconds() * 1000 for d in delivered),
+            "graph_send_calls": mock_graph.stats["sendMail"] - sends_before
+        },
+        # Queue insert, claim and status update per email
+        "mongo": write_rates(mongo, write_ops_before, seconds, args.requests * 3)
+    }
+
+async def retrieve_mailboxes(args, mongo: MongoTarget) -> dict:
+    from app.repositories.mailbox_repository import MailboxRepository
+    from app.schedulers.scheduler import MailboxScheduler
+    from app.services.email_service import EmailService
+    from app.services.graph_client import close_graph_client
+
+    job = MailboxScheduler()
+    job.email_service = EmailService()
+    job.mailbox_repository = MailboxRepository()
+    job._semaphore = asyncio.Semaphore(settings.MAILBOX_CONCURRENCY)
+    mailboxes = [f"bench{i}@example.com" for i in range(args.mailboxes)]
+    durations = []
+
+    async def run(mailbox):
+        started = time.perf_counter()
+        await job.retrieve_mailbox(mailbox)
+        durations.append((time.perf_counter() - started) * 1000)
+
+    write_ops_before = mongo.write_ops()
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(run(mailbox) for mailbox in mailboxes))
+    finally:
+        await close_graph_client()
+    seconds = time.perf_counter() - started
+    stored = await mongodb.get_async_email_collection().count_documents({"mailbox": {"$in": mailboxes}})
+    return {
+        "mailboxes": len(mailboxes),
+        "messages_stored": stored,
+        "seconds": round(seconds, 3),
+        "messages_per_second": rate(stored, seconds),
+        "job_duration": latency_summary(durations),
+        "mongo": write_rates(mongo, write_ops_before, seconds, stored)
+    }
+
+def run_retrieve(args, mongo: MongoTarget, mock_graph: MockGraphServer) -> dict:
+    mongo.connect()
+    requests_before = sum(mock_graph.stats.values())
+    result = asyncio.run(retrieve_mailboxes(args, mongo))
+    result["graph_requests"] = sum(mock_graph.stats.values()) - requests_before
+    mongodb.close_mongo_connection()
+    return result
+
+async def store_pages(args, mongo: MongoTarget) -> dict:
+    from app.repositories.email_repository import EmailRepository
+
+    repository = EmailRepository()
+    pages = []
+    for start in range(0, args.messages, args.page_size):
+        page = [graph_message(i) for i in range(start, min(start + args.page_size, args.messages))]
+        for email in page:
+            email["id"] = f"store-{email['id']}"
+        pages.append(page)
+
+    results = {}
+    for phase in ("insert", "unchanged"):
+        latencies = []
+        write_ops_before = mongo.write_ops()
+        started = time.perf_counter()
+        for page in pages:
+            page_started = time.perf_counter()
+            await repository.store_emails_async(page, "store-bench")
+            latencies.append((time.perf_counter() - page_started) * 1000)
+        seconds = time.perf_counter() - started
+        results[phase] = {
+            "messages": args.messages,
+            "page_size": args.page_size,
+            "seconds": round(seconds, 3),
+            "messages_per_second": rate(args.messages, seconds),
+            "page_latency": latency_summary(latencies),
+            "mongo": write_rates(mongo, write_ops_before, seconds, args.messages)
+        }
+    return results
+
+def run_store(args, mongo: MongoTarget, mock_graph: MockGraphServer) -> dict:
+    mongo.connect()
+    result = asyncio.run(store_pages(args, mongo))
+    mongodb.close_mongo_connection()
+    return result
+
+RUNNERS = {"send": run_send, "retrieve": run_retrieve, "store": run_store}
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the service against a local mock Graph server")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--mongo", choices=["uri", "memory"], default="uri")
+    parser.add_argument("--requests", type=int, default=1000, help="send: POST /email/send requests")
+    parser.add_argument("--concurrency", type=int, default=50, help="send: concurrent clients")
+    parser.add_argument("--drain-timeout", type=float, default=300)
+    parser.add_argument("--mailboxes", type=int, default=4, help="retrieve: mailboxes synced concurrently")
+    parser.add_argument("--messages", type=int, default=1000, help="retrieve/store: messages per mailbox")
+    parser.add_argument("--page-size", type=int, default=50, help="Graph page size / store batch size")
+    parser.add_argument("--latency-ms", type=float, default=10.0, help="mock Graph latency")
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of mock Graph 429 responses")
+    parser.add_argument("--retry-after", type=float, default=0.05, help="Retry-After of mock 429 responses")
+    parser.add_argument("--output", help="results file (default benchmarks/results/load_<commit>.json)")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    config = MockGraphConfig(args.latency_ms, args.jitter_ms, args.throttle_rate, args.retry_after,
+                             args.page_size, args.messages)
+    mock_graph = MockGraphServer(config).start()
+    configure(mock_graph)
+    settings.EMAIL_PAGE_SIZE = args.page_size
+    mongo = MongoTarget(args.mongo)
+    mongo.connect()
+    mongo.drop()
+
+    scenarios = {}
+    try:
+        for scenario in args.scenarios:
+            print(f"Running {scenario}...")
+            scenarios[scenario] = RUNNERS[scenario](args, mongo, mock_graph)
+            print(json.dumps(scenarios[scenario], indent=2))
+    finally:
+        mongo.connect()
+        mongo.drop()
+        mock_graph.stop()
+
+    commit = git_commit()
+    report = {
+        "generated_at": datetime.utcnow().isoformat(),
+        "commit": commit,
+        "mongo": args.mongo,
+        "mock_graph": dict(config.dict(), throttled=mock_graph.stats["throttled"]),
+        "scenarios": scenarios
+    }
+    path = args.output or os.path.join(RESULTS_DIR, f"load_{commit or 'unknown'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+Local mock Microsoft Graph server for benchmarks and load tests.
+
+Serves the endpoints the service calls (sendMail, $batch, message listing and
+delta queries) over real HTTP with a configurable latency, share of throttled
+(429) responses and page size. Messages are generated on the fly, so any
+mailbox holds `messages` emails.
+
+    python -m benchmarks.mock_graph --port 8900 --latency-ms 20 --throttle-rate 0.05
+
+Point SEND_EMAIL_URL, RETRIEVE_EMAIL_URL, DELTA_EMAIL_URL, GRAPH_BATCH_URL and
+GRAPH_API_BASE_URL at it (see `MockGraphServer.settings_overrides`).
+"""
+import argparse
+import asyncio
+import json
+import random
+import socket
+import threading
+import time
+from collections import Counter
+from urllib.parse import parse_qs, urlencode, urlparse
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+from benchmarks.ingest_benchmark import graph_message
+
+class MockGraphConfig:
+    def __init__(self, latency_ms: float = 10.0, jitter_ms: float = 0.0, throttle_rate: float = 0.0,
+                 retry_after: float = 0.05, page_size: int = 50, messages: int = 1000, seed: int = 42):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        # Share of requests answered with 429 and Retry-After: retry_after
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        # Largest page served; a smaller Prefer: odata.maxpagesize is honoured
+        self.page_size = page_size
+        # Messages in every mailbox
+        self.messages = messages
+        self.seed = seed
+
+    def dict(self) -> dict:
+        return dict(vars(self))
+
+def mock_graph_app(config: MockGraphConfig, stats: Counter) -> Starlette:
+    """
+    Build the mock Graph ASGI app; `stats` counts requests per endpoint and
+    throttled responses
+    """
+    rng = random.Random(config.seed)
+
+    async def delay_or_throttle(endpoint: str):
+        stats[endpoint] += 1
+        latency = config.latency_ms + (rng.uniform(-config.jitter_ms, config.jitter_ms) if config.jitter_ms else 0)
+        if latency > 0:
+            await asyncio.sleep(latency / 1000)
+        if config.throttle_rate and rng.random() < config.throttle_rate:
+            stats["throttled"] += 1
+            return JSONResponse({"error": {"code": "TooManyRequests", "message": "Mock throttling"}}, status_code=429,
+                                headers={"Retry-After": str(config.retry_after)})
+        return None
+
+    def page_size(request: Request) -> int:
+        prefer = request.headers.get("Prefer", "")
+        if "odata.maxpagesize=" in prefer:
+            return min(config.page_size, int(prefer.split("odata.maxpagesize=")[1].split(",")[0]))
+        return config.page_size
+
+    def message(mailbox: str, index: int) -> dict:
+        email = graph_message(index)
+        email["id"] = f"{mailbox}-{index:08d}"
+        return email
+
+    async def send_mail(request: Request):
+        throttled = await delay_or_throttle("sendMail")
+        if throttled:
+            return throttled
+        await request.body()
+        return Response(status_code=202)
+
+    async def batch(request: Request):
+        throttled = await delay_or_throttle("batch")
+        if throttled:
+            return throttled
+        responses = []
+        for sub_request in json.loads(await request.body())["requests"]:
+            if config.throttle_rate and rng.random() < config.throttle_rate:
+                stats["throttled"] += 1
+                responses.append({"id": sub_request["id"], "status": 429, "headers": {"Retry-After": str(config.retry_after)}})
+            elif sub_request["method"] == "GET":
+                mailbox = sub_request["url"].split("/")[2] if sub_request["url"].startswith("/users/") else "me"
+                index = int(sub_request["url"].split("/messages/")[1].split("?")[0].rsplit("-", 1)[1])
+                responses.append({"id": sub_request["id"], "status": 200, "body": message(mailbox, index)})
+            else:
+                responses.append({"id": sub_request["id"], "status": 202})
+        return JSONResponse({"responses": responses})
+
+    async def list_messages(request: Request):
+        throttled = await delay_or_throttle(request.url.path.rsplit("/", 1)[1])
+        if throttled:
+            return throttled
+        mailbox = request.path_params.get("mailbox", "me")
+        query = parse_qs(urlparse(str(request.url)).query)
+        base_url = str(request.url).split("?")[0]
+        if "$deltatoken" in query:
+            # Nothing changed since the last delta round
+            return JSONResponse({"value": [], "@odata.deltaLink": f"{base_url}?$deltatoken=latest"})
+
+        skip = int(query.get("$skiptoken", ["0"])[0])
+        size = page_size(request)
+        end = min(skip + size, config.messages)
+        body = {"value": [message(mailbox, index) for index in range(skip, end)]}
+        if end < config.messages:
+            body["@odata.nextLink"] = f"{base_url}?{urlencode({'$skiptoken': end})}"
+        elif request.url.path.endswith("/delta"):
+            body["@odata.deltaLink"] = f"{base_url}?$deltatoken=latest"
+        return JSONResponse(body)
+
+    return Starlette(routes=[
+        Route("/v1.0/me/sendMail", send_mail, methods=["POST"]),
+        Route("/v1.0/users/{mailbox}/sendMail", send_mail, methods=["POST"]),
+        Route("/v1.0/$batch", batch, methods=["POST"]),
+        Route("/v1.0/me/messages", list_messages),
+        Route("/v1.0/users/{mailbox}/messages", list_messages),
+        Route("/v1.0/me/mailFolders/inbox/messages/delta", list_messages),
+        Route("/v1.0/users/{mailbox}/mailFolders/inbox/messages/delta", list_messages)
+    ])
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+class ServerThread:
+    """
+    Run an ASGI app with uvicorn on its own thread and event loop, so the
+    load generator and the server do not share a loop
+    """
+    def __init__(self, app, port: int = None, lifespan: str = "auto"):
+        self.port = port or free_port()
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning",
+                                                    lifespan=lifespan))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self, timeout: float = 30):
+        self.thread.start()
+        deadline = time.monotonic() + timeout
+        while not self.server.started:
+            if not self.thread.is_alive() or time.monotonic() > deadline:
+                raise RuntimeError(f"Server on port {self.port} did not start")
+            time.sleep(0.05)
+        return self
+
+    def stop(self):
+        self.server.should_exit = True
+        self.thread.join()
+
+class MockGraphServer(ServerThread):
+    def __init__(self, config: MockGraphConfig = None, port: int = None):
+        self.config = config or MockGraphConfig()
+        self.stats = Counter()
+        super().__init__(mock_graph_app(self.config, self.stats), port=port, lifespan="off")
+
+    def settings_overrides(self) -> dict:
+        """
+        Settings pointing the service at this server
+        """
+        base_url = f"{self.url}/v1.0"
+        return {
+            "GRAPH_API_BASE_URL": base_url,
+            "SEND_EMAIL_URL": f"{base_url}/me/sendMail",
+            "RETRIEVE_EMAIL_URL": f"{base_url}/me/messages",
+            "DELTA_EMAIL_URL": f"{base_url}/me/mailFolders/inbox/messages/delta",
+            "GRAPH_BATCH_URL": f"{base_url}/$batch"
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local mock Microsoft Graph server")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency-ms", type=float, default=10.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=0.05)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=1000)
+    args = parser.parse_args()
+
+    config = MockGraphConfig(args.latency_ms, args.jitter_ms, args.throttle_rate, args.retry_after,
+                             args.page_size, args.messages)
+    uvicorn.run(mock_graph_app(config, Counter()), host="127.0.0.1", port=args.port)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Search latency benchmark.
+
+Loads synthetic emails into a search backend and measures the latency of the
+first results page for frequent, mid-frequency, rare and multi-term queries.
+
+    python -m benchmarks.search_benchmark --backend memory --sizes 100000
+    python -m benchmarks.search_benchmark --backend mongo --sizes 100000 1000000
+
+The mongo backend writes into its own database/collection
+("search_benchmark" on MONGODB_URI), which is dropped afterwards unless
+--keep is passed. The in-memory backend needs several GB of RAM at 1M emails.
+Results are printed and written to benchmarks/results/search_<backend>.json.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.stats import latency_summary
+from config import settings
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+BENCHMARK_COLLECTION = "search_benchmark"
+VOCABULARY_SIZE = 20000
+SUBJECT_WORDS = 6
+BODY_WORDS = 80
+
+def vocabulary(size: int):
+    return [f"w{i}" for i in range(size)]
+
+def zipf_cum_weights(size: int):
+    # Word frequencies in natural text roughly follow Zipf's law
+    return list(itertools.accumulate(1 / (rank + 1) for rank in range(size)))
+
+def generate_documents(count: int, seed: int = 42):
+    """
+    Yield EmailDB documents with Zipf-distributed words
+    """
+    rng = random.Random(seed)
+    words = vocabulary(VOCABULARY_SIZE)
+    cum_weights = zipf_cum_weights(VOCABULARY_SIZE)
+    start = datetime(2023, 1, 1)
+    for i in range(count):
+        sampled = rng.choices(words, cum_weights=cum_weights, k=SUBJECT_WORDS + BODY_WORDS)
+        body = " ".join(sampled[SUBJECT_WORDS:])
+        yield {
+            "email_id": f"bench-{i}",
+            "subject": " ".join(sampled[:SUBJECT_WORDS]),
+            "sender": f"sender{i % 500}@example.com",
+            "recipients": [f"user{i % 50}@example.com"],
+            "cc_recipients": [],
+            "bcc_recipients": [],
+            "body": body,
+            "is_html": False,
+            "received_datetime": start + timedelta(seconds=i * 30),
+            "mailbox": f"mailbox{i % 10}@example.com",
+            "created_at": start
+        }
+
+QUERIES = {
+    "frequent": ["w1", "w3", "w7"],
+    "mid": ["w150", "w420", "w900"],
+    "rare": ["w12000", "w15000", "w19000"],
+    "two_terms": ["w20 w300", "w5 w5000", "w100 w101"]
+}
+
+async def measure(backend, iterations: int, limit: int) -> dict:
+    results = {}
+    for kind, queries in QUERIES.items():
+        latencies = []
+        for _ in range(iterations):
+            for query in queries:
+                started = time.perf_counter()
+                await backend.search(query, limit=limit)
+                latencies.append((time.perf_counter() - started) * 1000)
+        summary = latency_summary(latencies)
+        results[kind] = {"queries": summary.pop("count"), **summary}
+    return results
+
+def load_memory(count: int):
+    from app.services.search_backend import InMemorySearchBackend
+
+    backend = InMemorySearchBackend()
+    batch = []
+    for document in generate_documents(count):
+        batch.append(document)
+        if len(batch) == 10000:
+            backend.index_documents(batch)
+            batch = []
+    backend.index_documents(batch)
+    return backend, lambda: None
+
+def load_mongo(count: int, keep: bool):
+    # Point the repositories at a dedicated database and collection
+    settings.MONGODB_COLLECTION = BENCHMARK_COLLECTION
+    from app.db.mongodb import EMAIL_ID_INDEX, EMAIL_INDEXES, get_email_collection
+    from app.repositories.email_repository import EmailRepository
+    from app.services.search_backend import MongoSearchBackend
+
+    collection = get_email_collection()
+    collection.drop()
+    collection.create_indexes([EMAIL_ID_INDEX] + EMAIL_INDEXES)
+    batch = []
+    for document in generate_documents(count):
+        batch.append(document)
+        if len(batch) == 10000:
+            collection.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        collection.insert_many(batch, ordered=False)
+
+    def cleanup():
+        if not keep:
+            collection.database.client.drop_database(BENCHMARK_COLLECTION)
+
+    return MongoSearchBackend(EmailRepository()), cleanup
+
+def run(backend_name: str, sizes, iterations: int, limit: int, keep: bool) -> list:
+    report = []
+    for size in sizes:
+        started = time.perf_counter()
+        if backend_name == "mongo":
+            backend, cleanup = load_mongo(size, keep)
+        else:
+            backend, cleanup = load_memory(size)
+        load_seconds = time.perf_counter() - started
+        try:
+            latencies = asyncio.run(measure(backend, iterations, limit))
+        finally:
+            cleanup()
+        entry = {"backend": backend_name, "emails": size, "load_seconds": round(load_seconds, 2), "latency": latencies}
+        print(json.dumps(entry))
+        report.append(entry)
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark full-text search latency")
+    parser.add_argument("--backend", choices=["memory", "mongo"], default="memory")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=25)
+    parser.add_argument("--keep", action="store_true", help="keep the benchmark collection (mongo backend)")
+    args = parser.parse_args()
+
+    report = run(args.backend, args.sizes, args.iterations, args.limit, args.keep)
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"search_{args.backend}.json")
+    with open(path, "w") as f:
+        json.dump({"generated_at": datetime.utcnow().isoformat(), "results": report}, f, indent=2)
+    print(f"Results written to {path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Startup benchmark.
+
+Measures, each in fresh interpreters:
+
+- import: the time to import `main` (the application and everything it
+  pulls in), and the modules with the largest cumulative import time
+- cold start: the time from spawning `uvicorn main:app` until /healthz
+  answers (liveness) and until /readyz answers 200 (readiness, which needs
+  MongoDB at MONGODB_URI)
+
+    python -m benchmarks.startup_benchmark --runs 5
+    python -m benchmarks.startup_benchmark --ready-timeout 0    # liveness only
+
+Results are written to benchmarks/results/startup_<commit>.json; compare two
+runs with `python -m benchmarks.compare old.json new.json`.
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import List, Optional
+
+import httpx
+
+from benchmarks.mock_graph import free_port
+from benchmarks.stats import git_commit, latency_summary
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+IMPORT_SCRIPT = "import time; started = time.perf_counter(); import main; print(time.perf_counter() - started)"
+
+def import_time_ms() -> float:
+    output = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], cwd=ROOT, capture_output=True, text=True, check=True)
+    return float(output.stdout.strip().splitlines()[-1]) * 1000
+
+def slowest_imports(limit: int = 15) -> List[dict]:
+    """
+    Modules with the largest cumulative import time (python -X importtime)
+    """
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    modules = []
+    for line in output.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        own, cumulative, name = (part.strip() for part in line.split(":", 1)[1].split("|"))
+        modules.append({"module": name, "cumulative_ms": int(cumulative) / 1000, "self_ms": int(own) / 1000})
+    return sorted(modules, key=lambda module: module["cumulative_ms"], reverse=True)[:limit]
+
+def wait_for(client: httpx.Client, url: str, process: subprocess.Popen, started: float,
+              timeout: float) -> Optional[float]:
+    """
+    Milliseconds from `started` until `url` answers 200, None on timeout
+    """
+    deadline = started + timeout
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with status {process.returncode}")
+        try:
+            if client.get(url).status_code == 200:
+                return (time.perf_counter() - started) * 1000
+        except httpx.TransportError:
+            pass
+        time.sleep(0.01)
+    return None
+
+def cold_start(args) -> dict:
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        with httpx.Client(timeout=1) as client:
+            live = wait_for(client, base_url + args.live_path, process, started, args.live_timeout)
+            ready = None
+            if args.ready_timeout > 0:
+                ready = wait_for(client, base_url + args.ready_path, process, started, args.ready_timeout)
+    finally:
+        process.terminate()
+        process.wait()
+    return {"live": live, "ready": ready}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark application import time and cold start")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--live-path", default="/healthz")
+    parser.add_argument("--ready-path", default="/readyz")
+    parser.add_argument("--live-timeout", type=float, default=60)
+    parser.add_argument("--ready-timeout", type=float, default=60, help="0 skips the readiness measurement")
+    parser.add_argument("--output", help="results file (default benchmarks/results/startup_<commit>.json)")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    # Warm up the bytecode cache so every run measures the same thing
+    import_time_ms()
+    imports = [import_time_ms() for _ in range(args.runs)]
+    starts = [cold_start(args) for _ in range(args.runs)]
+    ready = [start["ready"] for start in starts if start["ready"] is not None]
+
+    results = {
+        "import_main": latency_summary(imports),
+        "time_to_live": latency_summary(start["live"] for start in starts if start["live"] is not None),
+        "time_to_ready": latency_summary(ready),
+        "slowest_imports": slowest_imports()
+    }
+    print(json.dumps(results, indent=2))
+    if args.ready_timeout > 0 and len(ready) < len(starts):
+        print(f"{len(starts) - len(ready)} runs did not become ready within {args.ready_timeout}s (is MongoDB reachable?)")
+
+    commit = git_commit()
+    report = {"generated_at": datetime.utcnow().isoformat(), "commit": commit, "runs": args.runs, "results": results}
+    path = args.output or os.path.join(RESULTS_DIR, f"startup_{commit or 'unknown'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {path}")
+
+if __name__ == "__main__":
+    main()
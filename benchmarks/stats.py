@@ -0,0 +1,37 @@
+"""
+Helpers shared by the benchmarks
+"""
+import math
+import subprocess
+from typing import Iterable, Optional
+
+def latency_summary(latencies_ms: Iterable[float]) -> dict:
+    """
+    p50/p95/p99/max (nearest rank) and mean of latencies in milliseconds
+    """
+    ordered = sorted(latencies_ms)
+    if not ordered:
+        return {"count": 0}
+
+    def percentile(p: float) -> float:
+        return round(ordered[max(0, math.ceil(p * len(ordered)) - 1)], 3)
+
+    return {
+        "count": len(ordered),
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+        "max_ms": round(ordered[-1], 3),
+        "mean_ms": round(sum(ordered) / len(ordered), 3)
+    }
+
+def git_commit() -> Optional[str]:
+    """
+    Current commit, suffixed with "-dirty" when the tree has local changes
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f"{commit}-dirty" if dirty else commit
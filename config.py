@@ -10,12 +10,34 @@ from typing import List
 
 class Settings(BaseSettings):
     # Server settings
-    HOST: str = os.getenv("HOST")
-    PORT: int = int(os.getenv("PORT"))
+    HOST: str = os.getenv("HOST", "0.0.0.0")
+    PORT: int = int(os.getenv("PORT", "8000"))
 
     # MongoDB settings
     MONGODB_URI: str = os.getenv("MONGODB_URI")
     MONGODB_COLLECTION: str = os.getenv("MONGODB_COLLECTION")
+    MONGODB_SYNC_STATE_COLLECTION: str = os.getenv("MONGODB_SYNC_STATE_COLLECTION", "sync_state")
+    MONGODB_OUTBOUND_COLLECTION: str = os.getenv("MONGODB_OUTBOUND_COLLECTION", "outbound_emails")
+    MONGODB_TOKEN_COLLECTION: str = os.getenv("MONGODB_TOKEN_COLLECTION", "tokens")
+    MONGODB_MAILBOX_COLLECTION: str = os.getenv("MONGODB_MAILBOX_COLLECTION", "mailboxes")
+    MONGODB_SUBSCRIPTION_COLLECTION: str = os.getenv("MONGODB_SUBSCRIPTION_COLLECTION", "subscriptions")
+    MONGODB_REPLICA_COLLECTION: str = os.getenv("MONGODB_REPLICA_COLLECTION", "scheduler_replicas")
+    MONGODB_RESPONSE_CACHE_COLLECTION: str = os.getenv("MONGODB_RESPONSE_CACHE_COLLECTION", "response_cache")
+    MONGODB_BODY_BUCKET: str = os.getenv("MONGODB_BODY_BUCKET", "email_bodies")
+    MONGODB_ATTACHMENT_COLLECTION: str = os.getenv("MONGODB_ATTACHMENT_COLLECTION", "attachments")
+    MONGODB_ATTACHMENT_BUCKET: str = os.getenv("MONGODB_ATTACHMENT_BUCKET", "attachments")
+    # Connection pool and write concern, shared by the sync and async (Motor) clients
+    MONGODB_MAX_POOL_SIZE: int = int(os.getenv("MONGODB_MAX_POOL_SIZE", "100"))
+    MONGODB_MIN_POOL_SIZE: int = int(os.getenv("MONGODB_MIN_POOL_SIZE", "0"))
+    MONGODB_MAX_IDLE_TIME_MS: int = int(os.getenv("MONGODB_MAX_IDLE_TIME_MS", "60000"))
+    MONGODB_CONNECT_TIMEOUT_MS: int = int(os.getenv("MONGODB_CONNECT_TIMEOUT_MS", "5000"))
+    MONGODB_SERVER_SELECTION_TIMEOUT_MS: int = int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+    MONGODB_SOCKET_TIMEOUT_MS: int = int(os.getenv("MONGODB_SOCKET_TIMEOUT_MS", "30000"))
+    MONGODB_WAIT_QUEUE_TIMEOUT_MS: int = int(os.getenv("MONGODB_WAIT_QUEUE_TIMEOUT_MS", "5000"))
+    MONGODB_WRITE_CONCERN: str = os.getenv("MONGODB_WRITE_CONCERN", "1")
+    MONGODB_WRITE_CONCERN_JOURNAL: bool = os.getenv("MONGODB_WRITE_CONCERN_JOURNAL", "false").lower() == "true"
+    # Seconds between MongoDB pings while the application starts
+    MONGODB_STARTUP_RETRY_INTERVAL: float = float(os.getenv("MONGODB_STARTUP_RETRY_INTERVAL", "2"))
 
     # Microsoft Graph API settings
     MS_CLIENT_ID: str = os.getenv("MS_CLIENT_ID")
@@ -25,15 +47,149 @@ class Settings(BaseSettings):
     MS_SCOPE: str = os.getenv("MS_SCOPE")
     MAIL_SCOPE: str = os.getenv("MAIL_SCOPE")
     REDIRECT_URI: str = os.getenv("REDIRECT_URI")
+    # Seconds before expiry at which the access token is renewed in the background
+    TOKEN_REFRESH_SKEW: int = int(os.getenv("TOKEN_REFRESH_SKEW", "300"))
+    TOKEN_REFRESH_CHECK_INTERVAL: float = float(os.getenv("TOKEN_REFRESH_CHECK_INTERVAL", "60"))
+    # "memory" keeps tokens per process, "mongo" shares them between workers and replicas
+    TOKEN_STORE_BACKEND: str = os.getenv("TOKEN_STORE_BACKEND", "memory")
+    TOKEN_STORE_KEY: str = os.getenv("TOKEN_STORE_KEY", "default")
+    # Seconds a worker may hold the refresh lease, and how often waiting workers re-check the store
+    TOKEN_REFRESH_LEASE: float = float(os.getenv("TOKEN_REFRESH_LEASE", "30"))
+    TOKEN_STORE_POLL_INTERVAL: float = float(os.getenv("TOKEN_STORE_POLL_INTERVAL", "0.2"))
+
+    # Graph API HTTP client settings (shared connection pool)
+    GRAPH_HTTP2: bool = os.getenv("GRAPH_HTTP2", "true").lower() == "true"
+    GRAPH_MAX_CONNECTIONS: int = int(os.getenv("GRAPH_MAX_CONNECTIONS", "100"))
+    GRAPH_MAX_KEEPALIVE_CONNECTIONS: int = int(os.getenv("GRAPH_MAX_KEEPALIVE_CONNECTIONS", "20"))
+    GRAPH_KEEPALIVE_EXPIRY: float = float(os.getenv("GRAPH_KEEPALIVE_EXPIRY", "30"))
+    GRAPH_TIMEOUT: float = float(os.getenv("GRAPH_TIMEOUT", "30"))
+    GRAPH_CONNECT_TIMEOUT: float = float(os.getenv("GRAPH_CONNECT_TIMEOUT", "5"))
+
+    # Graph API retry/backoff and per-mailbox rate limiting
+    GRAPH_MAX_RETRIES: int = int(os.getenv("GRAPH_MAX_RETRIES", "5"))
+    GRAPH_BACKOFF_BASE: float = float(os.getenv("GRAPH_BACKOFF_BASE", "1"))
+    GRAPH_BACKOFF_MAX: float = float(os.getenv("GRAPH_BACKOFF_MAX", "60"))
+    GRAPH_RATE_LIMIT_PER_SECOND: float = float(os.getenv("GRAPH_RATE_LIMIT_PER_SECOND", "16"))
+    GRAPH_RATE_LIMIT_BURST: float = float(os.getenv("GRAPH_RATE_LIMIT_BURST", "16"))
 
     # Email retrieval settings
-    EMAIL_RETRIEVAL_INTERVAL: int = int(os.getenv("EMAIL_RETRIEVAL_INTERVAL"))
+    EMAIL_RETRIEVAL_INTERVAL: int = int(os.getenv("EMAIL_RETRIEVAL_INTERVAL", "300"))
+    GRAPH_API_BASE_URL: str = os.getenv("GRAPH_API_BASE_URL", "https://graph.microsoft.com/v1.0")
+    # Mailboxes retrieved at the same time, and how often the mailbox registry is re-read (seconds)
+    MAILBOX_CONCURRENCY: int = int(os.getenv("MAILBOX_CONCURRENCY", "10"))
+    MAILBOX_REGISTRY_REFRESH_INTERVAL: int = int(os.getenv("MAILBOX_REGISTRY_REFRESH_INTERVAL", "60"))
+    # Mailboxes are sharded across the replicas registered in SCHEDULER_COORDINATION
+    # ("memory": this process polls every mailbox, "mongo": replicas share the work).
+    # Replicas renew their lease every SCHEDULER_HEARTBEAT_INTERVAL seconds and
+    # are dropped when it is not renewed for SCHEDULER_LEASE_TTL seconds.
+    SCHEDULER_COORDINATION: str = os.getenv("SCHEDULER_COORDINATION", "memory")
+    SCHEDULER_HEARTBEAT_INTERVAL: float = float(os.getenv("SCHEDULER_HEARTBEAT_INTERVAL", "10"))
+    SCHEDULER_LEASE_TTL: float = float(os.getenv("SCHEDULER_LEASE_TTL", "30"))
     SEND_EMAIL_URL: str = os.getenv("SEND_EMAIL_URL")
     RETRIEVE_EMAIL_URL: str = os.getenv("RETRIEVE_EMAIL_URL")
+    GRAPH_BATCH_URL: str = os.getenv("GRAPH_BATCH_URL", "https://graph.microsoft.com/v1.0/$batch")
+    GRAPH_BATCH_SEND_PATH: str = os.getenv("GRAPH_BATCH_SEND_PATH", "/me/sendMail")
+    # Number of $batch requests (20 emails each) in flight at once
+    EMAIL_BATCH_CONCURRENCY: int = int(os.getenv("EMAIL_BATCH_CONCURRENCY", "4"))
+    DELTA_EMAIL_URL: str = os.getenv("DELTA_EMAIL_URL", "https://graph.microsoft.com/v1.0/me/mailFolders/inbox/messages/delta")
+    # "delta" fetches only new/changed inbox messages via /messages/delta and deletes the
+    # ones moved out of the inbox, "window" re-scans the past 24 hours of every folder
+    EMAIL_SYNC_MODE: str = os.getenv("EMAIL_SYNC_MODE", "delta")
+    # Messages per Graph page and the maximum number of pages read per run (0 = no limit)
+    EMAIL_PAGE_SIZE: int = int(os.getenv("EMAIL_PAGE_SIZE", "50"))
+    EMAIL_MAX_PAGES: int = int(os.getenv("EMAIL_MAX_PAGES", "100"))
+
+    # Email body storage: bodies of BODY_COMPRESSION_THRESHOLD bytes or more are
+    # compressed ("zlib" or "zstd", which needs the zstandard package); bodies still
+    # over BODY_GRIDFS_THRESHOLD bytes once compressed are offloaded to GridFS
+    BODY_COMPRESSION: str = os.getenv("BODY_COMPRESSION", "zlib")
+    BODY_COMPRESSION_LEVEL: int = int(os.getenv("BODY_COMPRESSION_LEVEL", "6"))
+    BODY_COMPRESSION_THRESHOLD: int = int(os.getenv("BODY_COMPRESSION_THRESHOLD", "4096"))
+    BODY_GRIDFS_THRESHOLD: int = int(os.getenv("BODY_GRIDFS_THRESHOLD", "1048576"))
+    # Characters of plain text kept uncompressed for full-text search of
+    # compressed or offloaded bodies (inline bodies are indexed in full)
+    BODY_SEARCH_TEXT_LENGTH: int = int(os.getenv("BODY_SEARCH_TEXT_LENGTH", "2048"))
+    # "lenient" converts Graph messages with a fast extractor, "strict" validates each through EmailDB
+    INGEST_VALIDATION: str = os.getenv("INGEST_VALIDATION", "lenient")
+
+    # Attachment ingestion: contents are streamed in ATTACHMENT_CHUNK_SIZE chunks
+    # to GridFS ("gridfs") or ATTACHMENT_DIR ("disk"), stored once per SHA-256
+    ATTACHMENTS_ENABLED: bool = os.getenv("ATTACHMENTS_ENABLED", "true").lower() == "true"
+    ATTACHMENT_STORAGE: str = os.getenv("ATTACHMENT_STORAGE", "gridfs")
+    ATTACHMENT_DIR: str = os.getenv("ATTACHMENT_DIR", "data/attachments")
+    ATTACHMENT_CHUNK_SIZE: int = int(os.getenv("ATTACHMENT_CHUNK_SIZE", "1048576"))
+    ATTACHMENT_CONCURRENCY: int = int(os.getenv("ATTACHMENT_CONCURRENCY", "4"))
+
+    # Documents fetched per MongoDB round-trip by GET /emails/export
+    EXPORT_BATCH_SIZE: int = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+    # Full-text search backend: "mongo" (text index) or "memory" (in-process inverted index)
+    SEARCH_BACKEND: str = os.getenv("SEARCH_BACKEND", "mongo")
+
+    # Cache of read responses: "memory" (per process, LRU), "mongo" (shared by
+    # every worker and replica) or "none". Stored-email reads are invalidated
+    # when emails of their mailbox are written; GET /email/retrieve is only
+    # kept for RESPONSE_CACHE_RETRIEVE_TTL seconds (0 disables it).
+    RESPONSE_CACHE_BACKEND: str = os.getenv("RESPONSE_CACHE_BACKEND", "memory")
+    RESPONSE_CACHE_TTL: float = float(os.getenv("RESPONSE_CACHE_TTL", "60"))
+    RESPONSE_CACHE_RETRIEVE_TTL: float = float(os.getenv("RESPONSE_CACHE_RETRIEVE_TTL", "30"))
+    RESPONSE_CACHE_MAX_ENTRIES: int = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+    RESPONSE_CACHE_MAX_BYTES: int = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", "67108864"))
+
+    # Graph change notifications (webhooks). When enabled, polling only runs
+    # every WEBHOOK_FALLBACK_INTERVAL seconds to catch missed notifications.
+    # WEBHOOK_CLIENT_STATE authenticates the notifications and is required.
+    WEBHOOKS_ENABLED: bool = os.getenv("WEBHOOKS_ENABLED", "false").lower() == "true"
+    WEBHOOK_NOTIFICATION_URL: str = os.getenv("WEBHOOK_NOTIFICATION_URL", "")
+    WEBHOOK_CLIENT_STATE: str = os.getenv("WEBHOOK_CLIENT_STATE", "")
+    WEBHOOK_SUBSCRIPTION_MINUTES: int = int(os.getenv("WEBHOOK_SUBSCRIPTION_MINUTES", "4230"))
+    WEBHOOK_RENEWAL_INTERVAL: int = int(os.getenv("WEBHOOK_RENEWAL_INTERVAL", "3600"))
+    WEBHOOK_FALLBACK_INTERVAL: int = int(os.getenv("WEBHOOK_FALLBACK_INTERVAL", "3600"))
+    WEBHOOK_QUEUE_MAX_SIZE: int = int(os.getenv("WEBHOOK_QUEUE_MAX_SIZE", "10000"))
+    WEBHOOK_BATCH_SIZE: int = int(os.getenv("WEBHOOK_BATCH_SIZE", "100"))
+    WEBHOOK_BATCH_WAIT: float = float(os.getenv("WEBHOOK_BATCH_WAIT", "0.5"))
+
+    # Outbound send queue settings
+    SEND_WORKER_COUNT: int = int(os.getenv("SEND_WORKER_COUNT", "4"))
+    # Soft limit: concurrent requests may each pass the check before inserting
+    SEND_QUEUE_MAX_DEPTH: int = int(os.getenv("SEND_QUEUE_MAX_DEPTH", "10000"))
+    SEND_MAX_ATTEMPTS: int = int(os.getenv("SEND_MAX_ATTEMPTS", "3"))
+    # A failed send is retried after SEND_RETRY_BASE_DELAY seconds, doubling
+    # on every attempt up to SEND_RETRY_MAX_DELAY (or Graph's Retry-After)
+    SEND_RETRY_BASE_DELAY: float = float(os.getenv("SEND_RETRY_BASE_DELAY", "5"))
+    SEND_RETRY_MAX_DELAY: float = float(os.getenv("SEND_RETRY_MAX_DELAY", "300"))
+    # Seconds an idle worker waits before polling the queue again
+    SEND_WORKER_POLL_INTERVAL: float = float(os.getenv("SEND_WORKER_POLL_INTERVAL", "1"))
+    # Seconds after which an in-flight message of a crashed worker is picked up
+    # again; a live worker renews the lease every third of this while sending
+    SEND_LEASE_TIMEOUT: int = int(os.getenv("SEND_LEASE_TIMEOUT", "300"))
+    # Emails with more recipients are split into several emails
+    SEND_MAX_RECIPIENTS: int = int(os.getenv("SEND_MAX_RECIPIENTS", "500"))
+
+    # Outbound attachment settings
+    # Attachments up to this many bytes in total are sent inline with sendMail (Graph limit: 3 MB)
+    SEND_INLINE_ATTACHMENT_LIMIT: int = int(os.getenv("SEND_INLINE_ATTACHMENT_LIMIT", "3145728"))
+    # Bytes per upload session request, a multiple of 320 KiB
+    SEND_UPLOAD_CHUNK_SIZE: int = int(os.getenv("SEND_UPLOAD_CHUNK_SIZE", "3276800"))
+    # Times an interrupted upload is resumed before the send fails
+    SEND_UPLOAD_MAX_RESUMES: int = int(os.getenv("SEND_UPLOAD_MAX_RESUMES", "5"))
+    # Files uploaded through POST /email/attachments, kept for OUTBOUND_ATTACHMENT_TTL seconds
+    OUTBOUND_ATTACHMENT_DIR: str = os.getenv("OUTBOUND_ATTACHMENT_DIR", "data/outbound")
+    OUTBOUND_ATTACHMENT_TTL: int = int(os.getenv("OUTBOUND_ATTACHMENT_TTL", "604800"))
+
+    # Prometheus metrics, exposed on GET /metrics
+    METRICS_ENABLED: bool = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    # Seconds between two counts of the outbound queue by the send workers
+    METRICS_QUEUE_DEPTH_INTERVAL: float = float(os.getenv("METRICS_QUEUE_DEPTH_INTERVAL", "15"))
 
     class Config:
         env_file = ".env"
 
+    @property
+    def webhooks_active(self) -> bool:
+        # Without a clientState secret anyone could post notifications
+        return self.WEBHOOKS_ENABLED and bool(self.WEBHOOK_CLIENT_STATE)
+
     @property
     def ms_scope_list(self) -> List[str]:
         return [scope.strip() for scope in self.MS_SCOPE.split(",") if scope.strip()]
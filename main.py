@@ -1,14 +1,21 @@
 from contextlib import asynccontextmanager
 
-import uvicorn
 from fastapi import FastAPI
 from fastapi.exceptions import RequestValidationError
 from starlette.exceptions import HTTPException
 
-from app import init_mongo_connection, close_mongo_connection
 from app.api.routes import router
-from app.exceptions import generic_exception_handler, http_exception_handler, validation_exception_handler
-from app.schedulers.scheduler import start_scheduler
+from app.db.mongodb import close_mongo_connection
+from app.dependencies import container
+from app.exceptions import (
+    GraphAPIError, generic_exception_handler, graph_exception_handler, http_exception_handler, validation_exception_handler
+)
+from app.metrics import MetricsMiddleware, register_runtime_collector
+from app.schedulers.scheduler import stop_scheduler
+from app.services.token_service import token_cache
+from app.startup import start_background_startup, stop_background_startup
+from app.workers.notification_worker import stop_notification_worker
+from app.workers.send_worker import stop_send_workers
 from config import settings
 
 
@@ -16,12 +23,20 @@ from config import settings
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # --- Startup ---
-    init_mongo_connection()
-    start_scheduler()
+    # MongoDB is reached and the workers started in the background, so the
+    # application answers /healthz right away and /readyz once it is ready
+    register_runtime_collector()
+    start_background_startup()
 
     yield
 
     # --- Shutdown (optional) ---
+    await stop_background_startup()
+    await stop_notification_worker()
+    await stop_send_workers()
+    stop_scheduler()
+    token_cache.stop_background_refresh()
+    await container.close()
     close_mongo_connection()
 
 
@@ -30,11 +45,17 @@ app = FastAPI(title="Microsoft Graph API Integration", lifespan=lifespan, debug=
 # Include API routes
 app.include_router(router)
 
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
 # Register error handlers
 app.add_exception_handler(HTTPException, http_exception_handler)
 app.add_exception_handler(RequestValidationError, validation_exception_handler)
+app.add_exception_handler(GraphAPIError, graph_exception_handler)
 app.add_exception_handler(Exception, generic_exception_handler)
 
 
 if __name__ == "__main__":
+    import uvicorn
+
     uvicorn.run("main:app", host=settings.HOST, port=settings.PORT, reload=True)
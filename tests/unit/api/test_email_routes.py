@@ -0,0 +1,193 @@
+import asyncio
+import json
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from mongomock_motor import AsyncMongoMockClient
+from unittest.mock import AsyncMock, Mock, patch
+
+from app.api.routes import router
+from app.dependencies import (
+    get_email_repository, get_mailbox_repository, get_mailbox_scheduler, get_outbound_attachments,
+    get_outbound_repository, get_response_cache, get_search_backend, get_send_worker_pool
+)
+from app.repositories.email_repository import InvalidCursorError, to_email_document
+from app.repositories.mailbox_repository import MailboxRepository
+from app.services.outbound_attachments import OutboundAttachmentStore
+from app.services.response_cache import InMemoryCacheBackend, ResponseCache
+from app.services.search_backend import InMemorySearchBackend
+
+@pytest.fixture
+def app():
+    app = FastAPI()
+    app.include_router(router)
+    # A cache per test so responses do not leak between tests
+    response_cache = ResponseCache(InMemoryCacheBackend())
+    app.dependency_overrides[get_response_cache] = lambda: response_cache
+    return app
+
+@pytest.fixture
+def client(app):
+    return TestClient(app)
+
+@pytest.fixture
+def mock_repository(app):
+    repository = Mock()
+    repository.find_emails_async = AsyncMock()
+    app.dependency_overrides[get_email_repository] = lambda: repository
+    return repository
+
+def test_list_emails_returns_page_and_cursor(client, mock_repository):
+    email_oid = ObjectId()
+    mock_repository.find_emails_async.return_value = ([{
+        "_id": email_oid,
+        "email_id": "id-1",
+        "subject": "Subject",
+        "sender": "sender@test.com",
+        "recipients": ["recipient@test.com"],
+        "is_html": False,
+        "received_datetime": datetime(2023, 1, 1),
+        "mailbox": "me"
+    }], "next")
+
+    response = client.get("/emails", params={"sender": "sender@test.com", "limit": 1, "received_after": "2022-12-31T00:00:00"})
+
+    assert response.status_code == 200
+    page = response.json()
+    assert page["next_cursor"] == "next"
+    assert page["items"][0]["id"] == str(email_oid)
+    assert "body" not in page["items"][0]
+    kwargs = mock_repository.find_emails_async.call_args.kwargs
+    assert kwargs["sender"] == "sender@test.com" and kwargs["limit"] == 1
+    assert kwargs["received_after"] == datetime(2022, 12, 31) and kwargs["include_body"] is False
+
+def test_list_emails_with_invalid_cursor(client, mock_repository):
+    mock_repository.find_emails_async.side_effect = InvalidCursorError("Invalid cursor: x")
+
+    response = client.get("/emails", params={"cursor": "x"})
+
+    assert response.status_code == 400
+
+def test_list_emails_limit_is_bounded(client, mock_repository):
+    assert client.get("/emails", params={"limit": 1000}).status_code == 422
+
+def test_search_emails_returns_ranked_page(app, client):
+    backend = InMemorySearchBackend()
+    backend.index_documents([to_email_document({
+        "id": f"id-{i}", "subject": "Invoice" if i == 0 else "Other", "body": {"content": "invoice due"},
+        "receivedDateTime": "2023-01-01T00:00:00Z"
+    }, "me") for i in range(3)])
+
+    app.dependency_overrides[get_search_backend] = lambda: backend
+    response = client.get("/emails/search", params={"q": "invoice", "limit": 2})
+
+    assert response.status_code == 200
+    page = response.json()
+    assert page["items"][0]["email_id"] == "id-0"
+    assert page["items"][0]["score"] > page["items"][1]["score"]
+    assert page["next_offset"] == 2
+
+def test_search_emails_requires_query(client):
+    assert client.get("/emails/search").status_code == 422
+
+def test_export_emails_streams_ndjson_or_sse(client, mock_repository):
+    def export_emails_async(fields, **filters):
+        async def documents():
+            for i in range(3):
+                yield {"_id": ObjectId(), "email_id": f"id-{i}", "received_datetime": datetime(2023, 1, 1)}
+        return documents()
+
+    mock_repository.export_emails_async = Mock(side_effect=export_emails_async)
+
+    ndjson = client.get("/emails/export", params={"fields": "email_id,received_datetime", "mailbox": "me"})
+    sse = client.get("/emails/export", headers={"Accept": "text/event-stream"})
+
+    assert ndjson.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in ndjson.text.splitlines()]
+    assert [row["email_id"] for row in rows] == ["id-0", "id-1", "id-2"]
+    assert rows[0]["received_datetime"] == "2023-01-01T00:00:00"
+    fields, filters = mock_repository.export_emails_async.call_args_list[0]
+    assert fields == (["email_id", "received_datetime"],) and filters["mailbox"] == "me"
+    assert sse.headers["content-type"].startswith("text/event-stream")
+    assert sse.text.count("event: email\n") == 3
+    assert sse.text.endswith('event: end\ndata: {"count":3}\n\n')
+
+def test_export_emails_rejects_unknown_fields(client, mock_repository):
+    assert client.get("/emails/export", params={"fields": "email_id,password"}).status_code == 400
+
+def test_get_email_loads_body(client, mock_repository):
+    mock_repository.get_email_async = AsyncMock(return_value={
+        "_id": ObjectId(), "email_id": "id-1", "subject": "Subject", "sender": "sender@test.com",
+        "body": "<p>Body</p>", "body_size": 11, "is_html": True, "received_datetime": datetime(2023, 1, 1)
+    })
+
+    response = client.get("/emails/id-1")
+
+    assert response.status_code == 200
+    assert response.json()["body"] == "<p>Body</p>"
+    mock_repository.get_email_async.assert_awaited_once_with("id-1")
+
+def test_get_unknown_email(client, mock_repository):
+    mock_repository.get_email_async = AsyncMock(return_value=None)
+
+    assert client.get("/emails/missing").status_code == 404
+
+def test_uploaded_attachment_can_be_referenced_by_a_send(app, client, tmp_path):
+    outbound_repository = Mock()
+    outbound_repository.count_queued_async = AsyncMock(return_value=0)
+    outbound_repository.enqueue_async = AsyncMock(return_value=str(ObjectId()))
+    app.dependency_overrides[get_outbound_repository] = lambda: outbound_repository
+    app.dependency_overrides[get_outbound_attachments] = lambda: OutboundAttachmentStore(str(tmp_path))
+    send_worker_pool = Mock()
+    app.dependency_overrides[get_send_worker_pool] = lambda: send_worker_pool
+
+    upload = client.post("/email/attachments", content=b"x" * 100000)
+    email = {"to_recipients": ["to@example.com"], "subject": "Subject", "body": "Body"}
+    queued = client.post("/email/send", json=dict(email, attachments=[{"name": "x.bin", "file_id": upload.json()["file_id"]}]))
+    unknown = client.post("/email/send", json=dict(email, attachments=[{"name": "x.bin", "file_id": "0" * 32}]))
+    invalid = client.post("/email/send", json=dict(email, attachments=[{"name": "x.bin", "content_bytes": "not base64!"}]))
+
+    assert upload.status_code == 201 and upload.json()["size"] == 100000
+    assert queued.status_code == 202
+    assert unknown.status_code == 400
+    assert invalid.status_code == 422
+    assert outbound_repository.enqueue_async.await_count == 1
+    send_worker_pool.notify.assert_called_once()
+
+def test_list_emails_is_cached_until_the_mailbox_changes(app, client, mock_repository):
+    mock_repository.find_emails_async.return_value = ([], None)
+    response_cache = app.dependency_overrides[get_response_cache]()
+
+    first = client.get("/emails", params={"mailbox": "a@test.com"})
+    second = client.get("/emails", params={"mailbox": "a@test.com"})
+    not_modified = client.get("/emails", params={"mailbox": "a@test.com"}, headers={"If-None-Match": first.headers["etag"]})
+    asyncio.run(response_cache.invalidate_mailbox("a@test.com"))
+    third = client.get("/emails", params={"mailbox": "a@test.com"})
+
+    assert (first.headers["x-cache"], second.headers["x-cache"], third.headers["x-cache"]) == ("MISS", "HIT", "MISS")
+    assert second.json() == first.json() == {"items": []}
+    assert not_modified.status_code == 304 and not_modified.content == b""
+    assert mock_repository.find_emails_async.await_count == 2
+
+def test_mailbox_routes_use_the_async_repository(app, client):
+    with patch("app.repositories.mailbox_repository.get_mailbox_collection", return_value=Mock()), \
+            patch("app.repositories.mailbox_repository.get_async_mailbox_collection",
+                  return_value=AsyncMongoMockClient()["test"]["mailboxes"]):
+        repository = MailboxRepository()
+    app.dependency_overrides[get_mailbox_repository] = lambda: repository
+    scheduler = Mock()
+    app.dependency_overrides[get_mailbox_scheduler] = lambda: scheduler
+
+    added = client.post("/mailboxes", json={"address": "Jane@Test.com"})
+    removed = client.delete("/mailboxes/jane@test.com")
+    missing = client.delete("/mailboxes/nobody@test.com")
+    listed = client.get("/mailboxes")
+
+    assert added.status_code == 201 and added.json()["address"] == "jane@test.com"
+    assert removed.status_code == 204 and missing.status_code == 404
+    assert [(mailbox["address"], mailbox["enabled"]) for mailbox in listed.json()] == [("jane@test.com", False)]
+    assert scheduler.request_sync.call_count == 2
+    repository.collection.update_one.assert_not_called()
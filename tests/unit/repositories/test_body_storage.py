@@ -0,0 +1,103 @@
+import asyncio
+import zlib
+
+import pytest
+from pymongo.errors import DuplicateKeyError
+from unittest.mock import AsyncMock, Mock, patch
+
+from app.repositories import body_storage
+from app.repositories.body_storage import (
+    BODY_COMPRESSED, BODY_GRIDFS, BODY_INLINE, BodyBlobStore, decode_body, encode_body, search_text
+)
+from config import settings
+
+@pytest.fixture(autouse=True)
+def thresholds():
+    with patch.object(settings, "BODY_COMPRESSION", "zlib"), \
+            patch.object(settings, "BODY_COMPRESSION_THRESHOLD", 100), \
+            patch.object(settings, "BODY_GRIDFS_THRESHOLD", 1000), \
+            patch.object(settings, "BODY_SEARCH_TEXT_LENGTH", 200):
+        yield
+
+def test_small_body_stays_inline():
+    encoded = encode_body("short")
+
+    assert encoded.fields["body_storage"] == BODY_INLINE
+    assert encoded.fields["body"] == "short"
+    assert encoded.fields["body_text"] is None
+    assert encoded.blob is None
+    assert decode_body(encoded.fields) == "short"
+
+def test_large_body_is_compressed_in_document():
+    body = "<p>hello world</p>" * 50
+
+    encoded = encode_body(body)
+
+    assert encoded.fields["body_storage"] == BODY_COMPRESSED
+    assert encoded.fields["body"] is None
+    assert encoded.fields["body_encoding"] == "zlib"
+    assert encoded.fields["body_text"] == search_text(body, is_html=False)
+    assert encoded.fields["body_stored_size"] == len(encoded.fields["body_compressed"]) + len(encoded.fields["body_text"])
+    assert encoded.fields["body_stored_size"] < encoded.fields["body_size"] == len(body)
+    assert encoded.blob is None
+    assert decode_body(encoded.fields) == body
+
+def test_huge_body_is_set_aside_for_gridfs():
+    body = "".join(f"line {i} of a very long newsletter\n" for i in range(5000))
+
+    encoded = encode_body(body)
+
+    assert encoded.fields["body_storage"] == BODY_GRIDFS
+    assert encoded.fields["body_compressed"] is None
+    assert len(encoded.fields["body_hash"]) == 64
+    assert decode_body(encoded.fields, encoded.blob) == body
+    # Same body, same hash: uploaded once
+    assert encode_body(body).fields["body_hash"] == encoded.fields["body_hash"]
+
+def test_incompressible_body_stays_inline():
+    body = zlib.compress(bytes(range(256)) * 4).hex()[:150]
+
+    with patch.object(settings, "BODY_COMPRESSION_LEVEL", 0):
+        assert encode_body(body).fields["body_storage"] == BODY_INLINE
+
+def test_body_stays_inline_when_search_text_outweighs_compression():
+    body = "<p>hello world</p>" * 50
+
+    with patch.object(settings, "BODY_SEARCH_TEXT_LENGTH", 10000):
+        assert encode_body(body).fields["body_storage"] == BODY_INLINE
+
+def test_zstd_falls_back_to_zlib_when_not_installed():
+    with patch.object(settings, "BODY_COMPRESSION", "zstd"), patch.object(body_storage, "zstandard", None):
+        assert encode_body("x" * 2000).fields["body_encoding"] == "zlib"
+
+def test_search_text_strips_html_and_truncates():
+    with patch.object(settings, "BODY_SEARCH_TEXT_LENGTH", 11):
+        assert search_text("<p>Hello</p>\n<b>world</b> and more", is_html=True) == "Hello world"
+
+def test_put_keeps_the_body_stored_by_a_concurrent_writer():
+    stored = []
+
+    async def files():
+        for file_id in stored:
+            yield Mock(_id=file_id)
+
+    def find(query):
+        cursor = Mock()
+        cursor.limit.return_value = files()
+        return cursor
+
+    upload = Mock(_id="mine", write=AsyncMock(), abort=AsyncMock())
+
+    async def close():
+        # The other writer's file landed between the lookup and this upload
+        stored.append("theirs")
+        raise DuplicateKeyError("filename_unique")
+
+    upload.close = close
+    bucket = Mock(find=find)
+    bucket.open_upload_stream.return_value = upload
+
+    file_id = asyncio.run(BodyBlobStore(bucket).put_async("hash", b"body"))
+
+    assert file_id == "theirs"
+    upload.abort.assert_awaited_once()
@@ -1,20 +1,88 @@
+import asyncio
+import hashlib
+from datetime import datetime, timezone
+
+import mongomock
 import pytest
-from unittest.mock import Mock, patch
+from mongomock_motor import AsyncMongoMockClient
+from pymongo import IndexModel
+from unittest.mock import AsyncMock, Mock, patch
+
+from app.db import mongodb
+from app.repositories.email_repository import (
+    EmailRepository, InvalidCursorError, parse_graph_datetime, to_email_document
+)
+from app.repositories.body_storage import encode_body, search_text
+from app.models.email import EmailDB, EmailStoreResult
+from config import settings
 
-from app.repositories.email_repository import EmailRepository
-from app.models.email import EmailDB
+def _bulk_result(upserted=0, matched=0, modified=0):
+    result = Mock()
+    result.upserted_count = upserted
+    result.matched_count = matched
+    result.modified_count = modified
+    return result
 
 @pytest.fixture
 def mock_collection():
-    return Mock()
+    collection = Mock()
+    collection.bulk_write = AsyncMock(return_value=_bulk_result(upserted=1))
+    collection.distinct = AsyncMock(return_value=[])
+    return collection
 
 @pytest.fixture
-def email_repository(mock_collection):
-    with patch('app.repositories.email_repository.get_email_collection', return_value=mock_collection):
+def async_collection():
+    return AsyncMongoMockClient()["test"]["emails"]
+
+class FakeBodyStore:
+    """In-memory stand-in for the GridFS body bucket"""
+    def __init__(self):
+        self.files = {}
+        self.reads = 0
+
+    async def put_async(self, body_hash, data):
+        self.files.setdefault(body_hash, data)
+        return body_hash
+
+    async def get_async(self, file_id):
+        self.reads += 1
+        return self.files[file_id]
+
+    async def delete_async(self, file_ids):
+        for file_id in file_ids:
+            del self.files[file_id]
+
+@pytest.fixture
+def email_repository(async_collection):
+    with patch('app.repositories.email_repository.get_async_email_collection', return_value=async_collection):
         repo = EmailRepository()
+        repo.body_store = FakeBodyStore()
         return repo
 
-def test_store_emails(email_repository, mock_collection):
+@pytest.fixture
+def mock_repository(email_repository, mock_collection):
+    email_repository.async_collection = mock_collection
+    return email_repository
+
+@pytest.fixture
+def body_thresholds():
+    with patch.object(settings, "BODY_COMPRESSION", "zlib"), \
+            patch.object(settings, "BODY_COMPRESSION_THRESHOLD", 100), \
+            patch.object(settings, "BODY_GRIDFS_THRESHOLD", 1000), \
+            patch.object(settings, "BODY_SEARCH_TEXT_LENGTH", 200):
+        yield
+
+def _graph_email(email_id, subject="Test Subject"):
+    return {
+        "id": email_id,
+        "subject": subject,
+        "sender": {"emailAddress": {"address": "sender@test.com"}},
+        "toRecipients": [{"emailAddress": {"address": "recipient@test.com"}}],
+        "body": {"content": "Test Body", "contentType": "text"},
+        "receivedDateTime": "2023-01-01T00:00:00Z"
+    }
+
+def test_store_emails(mock_repository, mock_collection):
     test_emails = [{
         "id": "test_id",
         "subject": "Test Subject",
@@ -26,12 +94,17 @@ def test_store_emails(email_repository, mock_collection):
         "receivedDateTime": "2023-01-01T00:00:00Z"
     }]
     # Test
-    result = email_repository.store_emails(test_emails)
+    result = asyncio.run(mock_repository.store_emails_async(test_emails))
     # Assertions
-    assert len(result) == 1
-    mock_collection.insert_many.assert_called_once()
+    assert result == EmailStoreResult(inserted=1)
+    mock_collection.bulk_write.assert_called_once()
+    operations = mock_collection.bulk_write.call_args.args[0]
+    assert len(operations) == 1
+    assert operations[0]._filter == {"email_id": "test_id"}
+    assert operations[0]._upsert is True
+    assert mock_collection.bulk_write.call_args.kwargs["ordered"] is False
 
-def test_store_emails_with_multiple_emails(email_repository, mock_collection):
+def test_store_emails_with_multiple_emails(mock_repository, mock_collection):
     test_emails = [
         {
             "id": "test_id_1",
@@ -50,14 +123,16 @@ def test_store_emails_with_multiple_emails(email_repository, mock_collection):
             "receivedDateTime": "2023-01-01T00:00:00Z"
         }
     ]
+    mock_collection.bulk_write.return_value = _bulk_result(upserted=1, matched=1, modified=0)
     # Test
-    result = email_repository.store_emails(test_emails)
+    result = asyncio.run(mock_repository.store_emails_async(test_emails))
     # Assertions
-    assert len(result) == 2
-    mock_collection.insert_many.assert_called_once()
+    assert result == EmailStoreResult(inserted=1, updated=0, unchanged=1)
+    mock_collection.bulk_write.assert_called_once()
+    assert len(mock_collection.bulk_write.call_args.args[0]) == 2
 
-def test_store_emails_failure(email_repository, mock_collection):
-    mock_collection.insert_many.side_effect = Exception("Database error")
+def test_store_emails_failure(mock_repository, mock_collection):
+    mock_collection.bulk_write.side_effect = Exception("Database error")
     test_emails = [{
         "id": "test_id",
         "subject": "Test Subject",
@@ -68,5 +143,286 @@ def test_store_emails_failure(email_repository, mock_collection):
     }]
     # Test and assert exception
     with pytest.raises(Exception) as exc_info:
-        email_repository.store_emails(test_emails)
-    assert "Database error" in str(exc_info.value)
\ No newline at end of file
+        asyncio.run(mock_repository.store_emails_async(test_emails))
+    assert "Database error" in str(exc_info.value)
+
+def test_store_emails_only_sets_created_at_on_insert(mock_repository, mock_collection):
+    asyncio.run(mock_repository.store_emails_async([{
+        "id": "test_id",
+        "subject": "Test Subject",
+        "sender": {"emailAddress": {"address": "sender@test.com"}},
+        "body": {"content": "Test Body", "contentType": "text"},
+        "receivedDateTime": "2023-01-01T00:00:00Z"
+    }]))
+    update = mock_collection.bulk_write.call_args.args[0][0]._doc
+    assert "created_at" not in update["$set"]
+    assert "created_at" in update["$setOnInsert"]
+
+def test_store_emails_with_no_emails(mock_repository, mock_collection):
+    assert asyncio.run(mock_repository.store_emails_async([])) == EmailStoreResult()
+    mock_collection.bulk_write.assert_not_called()
+
+def test_store_emails_async_upserts(email_repository, async_collection):
+    async def scenario():
+        first = await email_repository.store_emails_async([_graph_email("a"), _graph_email("b")], "me")
+        second = await email_repository.store_emails_async([_graph_email("a", "Changed"), _graph_email("b")], "me")
+        stored = await async_collection.find_one({"email_id": "a"})
+        return first, second, stored, await async_collection.count_documents({})
+
+    first, second, stored, count = asyncio.run(scenario())
+
+    assert first == EmailStoreResult(inserted=2)
+    assert second == EmailStoreResult(updated=1, unchanged=1)
+    assert count == 2
+    assert stored["subject"] == "Changed" and stored["mailbox"] == "me"
+
+def test_writes_invalidate_cached_reads_of_the_mailbox(email_repository):
+    email_repository.response_cache = Mock()
+    email_repository.response_cache.invalidate_mailbox = AsyncMock()
+
+    async def scenario():
+        await email_repository.store_emails_async([_graph_email("a")], "a@test.com")
+        await email_repository.store_emails_async([_graph_email("a")], "a@test.com")
+        await email_repository.delete_emails_async(["a"])
+
+    asyncio.run(scenario())
+
+    # The unchanged re-store does not invalidate
+    invalidated = [c.args[0] for c in email_repository.response_cache.invalidate_mailbox.await_args_list]
+    assert invalidated == ["a@test.com", "a@test.com"]
+
+def test_delete_emails_async(email_repository, async_collection):
+    async def scenario():
+        await email_repository.store_emails_async([_graph_email("a"), _graph_email("b")])
+        deleted = await email_repository.delete_emails_async(["a", "missing"])
+        return deleted, await async_collection.count_documents({})
+
+    assert asyncio.run(scenario()) == (1, 1)
+    assert asyncio.run(email_repository.delete_emails_async([])) == 0
+
+def test_concurrent_async_stores_do_not_block_each_other(email_repository, async_collection):
+    async def scenario():
+        results = await asyncio.gather(*[
+            email_repository.store_emails_async([_graph_email(f"id-{i}")]) for i in range(20)
+        ])
+        return results, await async_collection.count_documents({})
+
+    results, count = asyncio.run(scenario())
+
+    assert sum(result.inserted for result in results) == 20
+    assert count == 20
+
+def _stored_emails(email_repository, count, mailbox="me"):
+    emails = []
+    for i in range(count):
+        email = _graph_email(f"id-{i}", subject=f"Subject {i}")
+        # Pairs of emails share a received time so the _id tie-breaker is exercised
+        email["receivedDateTime"] = f"2023-01-01T00:{i // 2:02d}:00Z"
+        email["sender"]["emailAddress"]["address"] = "boss@test.com" if i % 3 == 0 else "sender@test.com"
+        emails.append(email)
+    asyncio.run(email_repository.store_emails_async(emails, mailbox))
+
+def test_find_emails_pages_newest_first_without_gaps(email_repository):
+    _stored_emails(email_repository, 11)
+
+    seen, cursor, pages = [], None, 0
+    while True:
+        documents, cursor = asyncio.run(email_repository.find_emails_async(cursor=cursor, limit=4))
+        seen.extend(documents)
+        pages += 1
+        if cursor is None:
+            break
+
+    assert pages == 3
+    assert sorted(document["email_id"] for document in seen) == sorted(f"id-{i}" for i in range(11))
+    received = [document["received_datetime"] for document in seen]
+    assert received == sorted(received, reverse=True)
+    assert all("body" not in document for document in seen)
+
+def test_find_emails_filters_and_body_projection(email_repository):
+    _stored_emails(email_repository, 9)
+
+    documents, cursor = asyncio.run(email_repository.find_emails_async(
+        sender="boss@test.com",
+        received_after=datetime(2023, 1, 1, 0, 1),
+        received_before=datetime(2023, 1, 1, 0, 4),
+        include_body=True
+    ))
+
+    assert [document["email_id"] for document in documents] == ["id-6", "id-3"]
+    assert cursor is None
+    assert documents[0]["body"] == "Test Body"
+
+def test_find_emails_by_recipient(email_repository):
+    _stored_emails(email_repository, 3)
+
+    documents, _ = asyncio.run(email_repository.find_emails_async(recipient="recipient@test.com", mailbox="me"))
+    assert len(documents) == 3
+    documents, _ = asyncio.run(email_repository.find_emails_async(recipient="nobody@test.com"))
+    assert documents == []
+
+def test_export_emails_streams_projected_fields_with_bodies(email_repository, body_thresholds):
+    async def scenario():
+        await email_repository.store_emails_async([_graph_email("small"), _email_with_body("huge", HUGE_BODY)])
+        return [document async for document in email_repository.export_emails_async(
+            ["email_id", "body"], batch_size=1
+        )]
+
+    documents = asyncio.run(scenario())
+
+    assert {document["email_id"]: document["body"] for document in documents} == {"small": "Test Body", "huge": HUGE_BODY}
+    assert all(set(document) == {"_id", "email_id", "body"} for document in documents)
+
+def test_export_emails_filters_by_date_range(email_repository):
+    _stored_emails(email_repository, 9)
+
+    async def scenario():
+        return [document["email_id"] async for document in email_repository.export_emails_async(
+            ["email_id"], received_after=datetime(2023, 1, 1, 0, 1), received_before=datetime(2023, 1, 1, 0, 3)
+        )]
+
+    assert sorted(asyncio.run(scenario())) == ["id-2", "id-3", "id-4", "id-5"]
+
+def test_find_emails_rejects_foreign_cursor(email_repository):
+    with pytest.raises(InvalidCursorError):
+        asyncio.run(email_repository.find_emails_async(cursor="not-a-cursor"))
+
+def _email_with_body(email_id, body):
+    email = _graph_email(email_id)
+    email["body"] = {"content": body, "contentType": "html"}
+    return email
+
+LARGE_BODY = "<p>quarterly numbers</p>" * 40
+HUGE_BODY = "".join(f"<p>row {i}: total {i * 7}</p>" for i in range(6000))
+
+def test_bodies_are_compressed_or_offloaded_and_loaded_lazily(email_repository, async_collection, body_thresholds):
+    async def scenario():
+        await email_repository.store_emails_async([
+            _graph_email("small"), _email_with_body("large", LARGE_BODY), _email_with_body("huge", HUGE_BODY)
+        ])
+        raw = {doc["email_id"]: doc for doc in await async_collection.find().to_list(None)}
+        listed, _ = await email_repository.find_emails_async()
+        loaded = {email_id: await email_repository.get_email_async(email_id) for email_id in raw}
+        return raw, listed, loaded
+
+    raw, listed, loaded = asyncio.run(scenario())
+
+    assert raw["small"]["body_storage"] == "inline" and raw["small"]["body"] == "Test Body"
+    assert raw["large"]["body_storage"] == "compressed" and raw["large"]["body"] is None
+    assert raw["huge"]["body_storage"] == "gridfs" and raw["huge"]["body_compressed"] is None
+    assert raw["huge"]["body_text"].startswith("row 0: total 0 row 1")
+    # Inline bodies are indexed as they are, without a second copy
+    assert raw["small"]["body_text"] is None
+    # Listing never touches body bytes or GridFS
+    assert all("body" not in doc and "body_compressed" not in doc for doc in listed)
+    assert loaded["large"]["body"] == LARGE_BODY
+    assert loaded["huge"]["body"] == HUGE_BODY
+    assert email_repository.body_store.reads == 1
+
+def test_gridfs_bodies_are_shared_and_cleaned_up(email_repository, body_thresholds):
+    async def scenario():
+        await email_repository.store_emails_async([_email_with_body("a", HUGE_BODY), _email_with_body("b", HUGE_BODY)])
+        files_after_store = len(email_repository.body_store.files)
+        await email_repository.delete_emails_async(["a"])
+        files_after_first_delete = len(email_repository.body_store.files)
+        await email_repository.delete_emails_async(["b"])
+        return files_after_store, files_after_first_delete, len(email_repository.body_store.files)
+
+    assert asyncio.run(scenario()) == (1, 1, 0)
+
+def test_replaced_gridfs_bodies_are_deleted_once_unused(email_repository, body_thresholds):
+    edited = HUGE_BODY + "<p>edited</p>"
+
+    async def scenario():
+        await email_repository.store_emails_async([_email_with_body("a", HUGE_BODY), _email_with_body("b", HUGE_BODY)])
+        await email_repository.store_emails_async([_email_with_body("a", edited)])
+        files_while_shared = len(email_repository.body_store.files)
+        await email_repository.store_emails_async([_graph_email("b")])
+        return files_while_shared, list(email_repository.body_store.files)
+
+    files_while_shared, remaining = asyncio.run(scenario())
+
+    assert files_while_shared == 2
+    assert remaining == [hashlib.sha256(encode_body(edited, is_html=True).blob).hexdigest()]
+
+def test_restoring_a_compressed_email_is_unchanged(email_repository, body_thresholds):
+    async def scenario():
+        await email_repository.store_emails_async([_email_with_body("large", LARGE_BODY)])
+        return await email_repository.store_emails_async([_email_with_body("large", LARGE_BODY)])
+
+    assert asyncio.run(scenario()) == EmailStoreResult(unchanged=1)
+
+def test_body_storage_report(email_repository, body_thresholds):
+    async def scenario():
+        await email_repository.store_emails_async([
+            _graph_email("small"), _email_with_body("large", LARGE_BODY), _email_with_body("huge", HUGE_BODY)
+        ])
+        return await email_repository.body_storage_report_async()
+
+    report = asyncio.run(scenario())
+
+    assert report.emails == 3
+    assert report.original_bytes == len("Test Body") + len(LARGE_BODY) + len(HUGE_BODY)
+    assert 0 < report.stored_bytes < report.original_bytes
+    # The plain-text prefix kept for search is part of what is stored
+    text_bytes = sum(len(search_text(body, is_html=True)) for body in (LARGE_BODY, HUGE_BODY))
+    assert report.stored_bytes > len("Test Body") + text_bytes
+    assert report.saved_bytes == report.original_bytes - report.stored_bytes
+    assert report.by_storage == {"inline": 1, "compressed": 1, "gridfs": 1}
+
+def test_lenient_extraction_matches_validated_document():
+    created_at = datetime(2023, 1, 2)
+    email = dict(_graph_email("id-1"), ccRecipients=[{"emailAddress": {"address": "cc@test.com"}}],
+                 body={"content": "<p>Hi</p>", "contentType": "html"}, hasAttachments=True,
+                 receivedDateTime="2023-01-01T10:20:30.123Z")
+
+    lenient = to_email_document(email, "me", created_at=created_at, strict=False)
+    strict = to_email_document(email, "me", created_at=created_at, strict=True)
+
+    assert lenient == strict
+    assert list(lenient) == list(strict)
+    assert lenient["received_datetime"] == datetime(2023, 1, 1, 10, 20, 30, 123000, tzinfo=timezone.utc)
+
+def test_lenient_extraction_fills_null_fields():
+    email = {"id": "id-1", "subject": None, "sender": None, "toRecipients": None, "body": None,
+             "receivedDateTime": "2023-01-01T00:00:00Z"}
+
+    document = to_email_document(email, strict=False)
+
+    assert (document["subject"], document["sender"], document["recipients"], document["body"]) == ("", "", [], "")
+
+def test_malformed_messages_are_skipped_when_lenient_and_rejected_when_strict(mock_repository, mock_collection):
+    emails = [_graph_email("id-1"), {"subject": "no id"}, dict(_graph_email("id-3"), receivedDateTime="yesterday")]
+
+    with patch.object(settings, "INGEST_VALIDATION", "lenient"):
+        asyncio.run(mock_repository.store_emails_async(emails))
+    operations = mock_collection.bulk_write.call_args[0][0]
+    assert [op._filter["email_id"] for op in operations] == ["id-1"]
+
+    with patch.object(settings, "INGEST_VALIDATION", "strict"), pytest.raises(ValueError):
+        asyncio.run(mock_repository.store_emails_async(emails))
+
+def test_parse_graph_datetime_falls_back_for_other_iso_forms():
+    assert parse_graph_datetime("2023-01-01T00:00:00Z") == datetime(2023, 1, 1, tzinfo=timezone.utc)
+    assert parse_graph_datetime("2023-01-01T00:00:00.1234567Z") == datetime(2023, 1, 1, 0, 0, 0, 123456, tzinfo=timezone.utc)
+
+def test_ensure_indexes_removes_duplicates_and_builds_each_index():
+    database = mongomock.MongoClient().db
+    collection = database.emails
+    collection.insert_many([{"email_id": "a", "subject": "old"}, {"email_id": "b"}, {"email_id": "a", "subject": "new"}])
+    create_indexes = collection.create_indexes
+
+    def failing_create_indexes(indexes):
+        if indexes[0].document["name"] == "broken":
+            raise Exception("build failed")
+        return create_indexes(indexes)
+
+    with patch.object(mongodb, "get_database", return_value=database), \
+            patch.object(mongodb, "get_email_collection", return_value=collection), \
+            patch.object(mongodb, "EMAIL_INDEXES", [IndexModel("subject", name="broken"), mongodb.EMAIL_INDEXES[0]]), \
+            patch.object(collection, "create_indexes", side_effect=failing_create_indexes):
+        with pytest.raises(RuntimeError, match="broken"):
+            mongodb.ensure_indexes()
+
+    assert [document["subject"] for document in collection.find({"email_id": "a"})] == ["new"]
+    assert {"email_id_unique", "received"} <= set(collection.index_information())
@@ -0,0 +1,144 @@
+import asyncio
+
+import pytest
+from bson import ObjectId
+from mongomock_motor import AsyncMongoMockClient
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock, Mock, patch
+
+from app.repositories.outbound_repository import OutboundEmailRepository
+from app.models.email import EmailSendRequest
+from config import settings
+
+@pytest.fixture
+def mock_collection():
+    return AsyncMock()
+
+@pytest.fixture
+def async_collection():
+    return AsyncMongoMockClient()["test"]["outbound_emails"]
+
+@pytest.fixture
+def outbound_repository(async_collection):
+    with patch('app.repositories.outbound_repository.get_async_outbound_collection', return_value=async_collection):
+        return OutboundEmailRepository()
+
+@pytest.fixture
+def mock_repository(outbound_repository, mock_collection):
+    outbound_repository.async_collection = mock_collection
+    return outbound_repository
+
+def test_enqueue_stores_pending_email(mock_repository, mock_collection):
+    inserted_id = ObjectId()
+    mock_collection.insert_one.return_value = Mock(inserted_id=inserted_id)
+    email_request = EmailSendRequest(to_recipients=["test@example.com"], subject="Subject", body="Body")
+
+    queue_id = asyncio.run(mock_repository.enqueue_async(email_request))
+
+    assert queue_id == str(inserted_id)
+    doc = mock_collection.insert_one.call_args.args[0]
+    assert doc["status"] == "pending"
+    assert doc["attempts"] == 0
+    assert doc["request"]["to_recipients"] == ["test@example.com"]
+
+def test_claim_next_takes_oldest_pending_or_expired_email(mock_repository, mock_collection):
+    asyncio.run(mock_repository.claim_next_async())
+
+    query, update = mock_collection.find_one_and_update.call_args.args
+    assert {"status": "pending", "$or": [{"not_before": None}, {"not_before": {"$lte": update["$set"]["claimed_at"]}}]} \
+        in query["$or"]
+    assert update["$set"]["status"] == "in_flight"
+    assert update["$inc"] == {"attempts": 1}
+    assert mock_collection.find_one_and_update.call_args.kwargs["sort"] == [("created_at", 1)]
+
+def test_mark_failed_requeues_when_retrying(mock_repository, mock_collection):
+    queue_id = ObjectId()
+
+    async def scenario():
+        await mock_repository.mark_failed_async(queue_id, "boom", retry=True)
+        await mock_repository.mark_failed_async(queue_id, "boom", retry=False)
+
+    asyncio.run(scenario())
+
+    statuses = [c.args[1]["$set"]["status"] for c in mock_collection.update_one.call_args_list]
+    assert statuses == ["pending", "failed"]
+
+def test_claim_skips_email_waiting_out_its_retry_delay(outbound_repository):
+    email_request = EmailSendRequest(to_recipients=["test@example.com"], subject="Subject", body="Body")
+
+    async def scenario():
+        queue_id = await outbound_repository.enqueue_async(email_request)
+        claimed = await outbound_repository.claim_next_async()
+        await outbound_repository.mark_failed_async(claimed["_id"], "throttled", retry=True, retry_delay=60)
+        waiting = await outbound_repository.claim_next_async()
+        await outbound_repository.mark_failed_async(queue_id, "throttled", retry=True, retry_delay=0)
+        return waiting, await outbound_repository.claim_next_async()
+
+    waiting, due = asyncio.run(scenario())
+
+    assert waiting is None
+    assert due["status"] == "in_flight" and due["attempts"] == 2
+
+def test_async_queue_lifecycle(outbound_repository):
+    email_request = EmailSendRequest(to_recipients=["test@example.com"], subject="Subject", body="Body")
+
+    async def scenario():
+        first = await outbound_repository.enqueue_async(email_request)
+        await outbound_repository.enqueue_async(email_request)
+        queued = await outbound_repository.count_queued_async()
+        claimed = await outbound_repository.claim_next_async()
+        await outbound_repository.mark_sent_async(claimed["_id"])
+        return first, queued, claimed, await outbound_repository.get_async(first), \
+            await outbound_repository.count_queued_async()
+
+    first, queued, claimed, sent, remaining = asyncio.run(scenario())
+
+    assert queued == 2
+    assert str(claimed["_id"]) == first and claimed["status"] == "in_flight" and claimed["attempts"] == 1
+    assert sent["status"] == "sent"
+    assert remaining == 1
+
+def test_renewed_lease_is_not_claimed_again(outbound_repository, async_collection):
+    email_request = EmailSendRequest(to_recipients=["test@example.com"], subject="Subject", body="Body")
+
+    async def expire_lease(queue_id):
+        stale = datetime.utcnow() - timedelta(seconds=settings.SEND_LEASE_TIMEOUT + 1)
+        await async_collection.update_one({"_id": queue_id}, {"$set": {"claimed_at": stale}})
+
+    async def scenario():
+        await outbound_repository.enqueue_async(email_request)
+        first = await outbound_repository.claim_next_async()
+        await expire_lease(first["_id"])
+        renewed = await outbound_repository.renew_lease_async(first["_id"], first["claim_id"])
+        while_renewed = await outbound_repository.claim_next_async()
+        await expire_lease(first["_id"])
+        second = await outbound_repository.claim_next_async()
+        return renewed, while_renewed, second, \
+            await outbound_repository.renew_lease_async(first["_id"], first["claim_id"])
+
+    renewed, while_renewed, second, renewed_after_reclaim = asyncio.run(scenario())
+
+    assert renewed is True and while_renewed is None
+    assert second["attempts"] == 2
+    assert renewed_after_reclaim is False
+
+def test_queue_depths_count_pending_and_in_flight_emails(outbound_repository):
+    email_request = EmailSendRequest(to_recipients=["test@example.com"], subject="Subject", body="Body")
+
+    async def scenario():
+        empty = await outbound_repository.queue_depths_async()
+        for _ in range(3):
+            await outbound_repository.enqueue_async(email_request)
+        claimed = await outbound_repository.claim_next_async()
+        await outbound_repository.claim_next_async()
+        await outbound_repository.mark_sent_async(claimed["_id"])
+        return empty, await outbound_repository.queue_depths_async()
+
+    empty, depths = asyncio.run(scenario())
+
+    assert empty == {"pending": 0, "in_flight": 0}
+    assert depths == {"pending": 1, "in_flight": 1}
+
+def test_get_async_with_invalid_id_returns_none(mock_repository, mock_collection):
+    assert asyncio.run(mock_repository.get_async("not-an-object-id")) is None
+    mock_collection.find_one.assert_not_called()
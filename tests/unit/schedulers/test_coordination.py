@@ -0,0 +1,107 @@
+import asyncio
+import time
+from unittest.mock import AsyncMock, Mock, patch
+
+import mongomock
+import pytest
+
+from app.schedulers.coordination import HashRing, MongoReplicaRegistry, SchedulerCoordinator
+from app.schedulers.scheduler import MAILBOX_JOB_PREFIX, MailboxScheduler
+from config import settings
+
+MAILBOXES = [f"user{i}@test.com" for i in range(60)]
+
+@pytest.fixture
+def registry():
+    return MongoReplicaRegistry(mongomock.MongoClient().db.scheduler_replicas)
+
+def _replica(registry, replica_id):
+    mailbox_scheduler = MailboxScheduler()
+    mailbox_scheduler.email_service = Mock()
+    mailbox_scheduler.email_service.retrieve_emails = AsyncMock(return_value={"emails": 0})
+    mailbox_scheduler.mailbox_repository = Mock()
+    mailbox_scheduler.mailbox_repository.list_mailboxes.return_value = [{"_id": mailbox} for mailbox in MAILBOXES]
+    mailbox_scheduler.coordinator = SchedulerCoordinator(registry, replica_id)
+    return mailbox_scheduler
+
+def _heartbeat_all(replicas):
+    # Every replica learns about the ones that joined after it
+    for _ in range(2):
+        for replica in replicas:
+            replica.coordinator.heartbeat()
+
+def test_hash_ring_moves_only_the_keys_of_a_new_replica():
+    before = HashRing(["a", "b", "c"])
+    after = HashRing(["a", "b", "c", "d"])
+
+    owners = {mailbox: before.owner(mailbox) for mailbox in MAILBOXES}
+    moved = [mailbox for mailbox in MAILBOXES if after.owner(mailbox) != owners[mailbox]]
+
+    assert set(owners.values()) == {"a", "b", "c"}
+    assert moved and all(after.owner(mailbox) == "d" for mailbox in moved)
+    assert HashRing([]).owner("a@test.com") is None
+
+def test_replicas_poll_disjoint_shares_of_the_mailboxes(registry):
+    replicas = [_replica(registry, f"replica-{i}") for i in range(3)]
+    _heartbeat_all(replicas)
+
+    shares = [set(replica.owned_mailboxes()) for replica in replicas]
+
+    assert all(shares)
+    assert sum(len(share) for share in shares) == len(MAILBOXES)
+    assert set().union(*shares) == set(MAILBOXES)
+
+def test_mailboxes_are_rebalanced_when_a_replica_leaves(registry):
+    replicas = [_replica(registry, f"replica-{i}") for i in range(3)]
+    _heartbeat_all(replicas)
+    leaving = set(replicas[2].owned_mailboxes())
+
+    replicas[2].coordinator.leave()
+    changed = [replica.coordinator.heartbeat() for replica in replicas[:2]]
+
+    shares = [set(replica.owned_mailboxes()) for replica in replicas[:2]]
+    assert changed == [True, True]
+    assert replicas[2].owned_mailboxes() == []
+    assert shares[0] | shares[1] == set(MAILBOXES)
+    assert not shares[0] & shares[1]
+    assert leaving <= shares[0] | shares[1]
+
+def test_expired_leases_are_not_live(registry):
+    registry.heartbeat("crashed", ttl=-1)
+    replica = _replica(registry, "replica-0")
+    replica.coordinator.heartbeat()
+
+    assert registry.live_replicas() == ["replica-0"]
+    assert replica.owned_mailboxes() == MAILBOXES
+
+def test_replica_owns_nothing_once_its_lease_could_not_be_renewed(registry):
+    replica = _replica(registry, "replica-0")
+    replica.coordinator.heartbeat()
+    expired = time.monotonic() + settings.SCHEDULER_LEASE_TTL + 1
+
+    with patch("app.schedulers.coordination.time.monotonic", return_value=expired):
+        assert replica.owned_mailboxes() == []
+
+def test_heartbeat_syncs_jobs_when_replicas_change(registry):
+    first, second = _replica(registry, "replica-0"), _replica(registry, "replica-1")
+
+    async def run():
+        first.start()
+        first.scheduler.pause()
+        try:
+            first.sync_mailbox_jobs()
+            alone = {job.id for job in first.scheduler.get_jobs() if job.id.startswith(MAILBOX_JOB_PREFIX)}
+            second.coordinator.heartbeat()
+            with patch.object(first, "request_sync", side_effect=first.sync_mailbox_jobs):
+                first.heartbeat()
+            shared = {job.id for job in first.scheduler.get_jobs() if job.id.startswith(MAILBOX_JOB_PREFIX)}
+            return alone, shared, first.owned_mailboxes()
+        finally:
+            first.stop()
+
+    alone, shared, owned = asyncio.run(run())
+
+    assert len(alone) == len(MAILBOXES)
+    assert shared == {f"{MAILBOX_JOB_PREFIX}{mailbox}" for mailbox in owned}
+    assert 0 < len(shared) < len(MAILBOXES)
+    assert registry.live_replicas() == ["replica-1"]
@@ -0,0 +1,142 @@
+import asyncio
+
+import pytest
+from unittest.mock import AsyncMock, Mock, patch
+
+from app.schedulers.scheduler import MAILBOX_JOB_PREFIX, MailboxScheduler
+from config import settings
+
+@pytest.fixture
+def mailbox_scheduler():
+    mailbox_scheduler = MailboxScheduler()
+    mailbox_scheduler.email_service = Mock()
+    mailbox_scheduler.email_service.retrieve_emails = AsyncMock(return_value={"emails": 0})
+    mailbox_scheduler.mailbox_repository = Mock()
+    mailbox_scheduler.mailbox_repository.mark_running_async = AsyncMock()
+    mailbox_scheduler.mailbox_repository.record_run_async = AsyncMock()
+    return mailbox_scheduler
+
+def _run_started(mailbox_scheduler, action):
+    async def run():
+        mailbox_scheduler.start()
+        # Jobs are inspected, not run, by these tests
+        mailbox_scheduler.scheduler.pause()
+        try:
+            return await action()
+        finally:
+            mailbox_scheduler.stop()
+    return asyncio.run(run())
+
+def _mailbox_jobs(mailbox_scheduler):
+    return {job.id: job for job in mailbox_scheduler.scheduler.get_jobs() if job.id.startswith(MAILBOX_JOB_PREFIX)}
+
+def test_sync_mailbox_jobs_schedules_one_job_per_mailbox(mailbox_scheduler):
+    mailbox_scheduler.mailbox_repository.list_mailboxes.return_value = [{"_id": "a@test.com"}, {"_id": "b@test.com"}]
+
+    async def action():
+        mailbox_scheduler.sync_mailbox_jobs()
+        return _mailbox_jobs(mailbox_scheduler)
+
+    jobs = _run_started(mailbox_scheduler, action)
+
+    assert set(jobs) == {"retrieve_emails:a@test.com", "retrieve_emails:b@test.com"}
+    job = jobs["retrieve_emails:a@test.com"]
+    assert job.max_instances == 1
+    assert job.coalesce is True
+    assert job.args == ("a@test.com",)
+
+def test_sync_mailbox_jobs_removes_disabled_mailboxes(mailbox_scheduler):
+    mailbox_scheduler.mailbox_repository.list_mailboxes.side_effect = [
+        [{"_id": "a@test.com"}, {"_id": "b@test.com"}],
+        [{"_id": "b@test.com"}],
+    ]
+
+    async def action():
+        mailbox_scheduler.sync_mailbox_jobs()
+        mailbox_scheduler.sync_mailbox_jobs()
+        return _mailbox_jobs(mailbox_scheduler)
+
+    assert set(_run_started(mailbox_scheduler, action)) == {"retrieve_emails:b@test.com"}
+
+def test_sync_mailbox_jobs_falls_back_to_signed_in_mailbox(mailbox_scheduler):
+    mailbox_scheduler.mailbox_repository.list_mailboxes.return_value = []
+
+    async def action():
+        mailbox_scheduler.sync_mailbox_jobs()
+        return _mailbox_jobs(mailbox_scheduler)
+
+    assert set(_run_started(mailbox_scheduler, action)) == {"retrieve_emails:me"}
+
+def test_start_offsets_spread_mailboxes_across_the_interval(mailbox_scheduler):
+    offsets = [mailbox_scheduler.start_offset(f"user{i}@test.com") for i in range(200)]
+
+    assert all(0 <= offset < settings.EMAIL_RETRIEVAL_INTERVAL for offset in offsets)
+    # Every quarter of the interval gets some mailboxes
+    quarters = {int(offset * 4 // settings.EMAIL_RETRIEVAL_INTERVAL) for offset in offsets}
+    assert quarters == {0, 1, 2, 3}
+    assert mailbox_scheduler.start_offset("a@test.com") == mailbox_scheduler.start_offset("a@test.com")
+
+def test_retrieve_mailbox_records_success_and_errors(mailbox_scheduler):
+    mailbox_scheduler.email_service.retrieve_emails.side_effect = [{"emails": 1}, Exception("Graph down")]
+
+    async def action():
+        await mailbox_scheduler.retrieve_mailbox("a@test.com")
+        await mailbox_scheduler.retrieve_mailbox("a@test.com")
+
+    _run_started(mailbox_scheduler, action)
+
+    errors = [c.args[2] for c in mailbox_scheduler.mailbox_repository.record_run_async.await_args_list]
+    assert errors == [None, "Graph down"]
+
+@patch.object(settings, "MAILBOX_CONCURRENCY", 2)
+def test_retrieve_mailbox_respects_concurrency_cap(mailbox_scheduler):
+    running = {"now": 0, "max": 0}
+
+    async def retrieve(mailbox):
+        running["now"] += 1
+        running["max"] = max(running["max"], running["now"])
+        await asyncio.sleep(0.02)
+        running["now"] -= 1
+
+    mailbox_scheduler.email_service.retrieve_emails.side_effect = retrieve
+
+    async def action():
+        await asyncio.gather(*[mailbox_scheduler.retrieve_mailbox(f"user{i}@test.com") for i in range(6)])
+
+    _run_started(mailbox_scheduler, action)
+
+    assert running["max"] == 2
+
+def test_retrieve_mailbox_skips_mailboxes_of_other_replicas(mailbox_scheduler):
+    mailbox_scheduler.coordinator = Mock()
+    mailbox_scheduler.coordinator.owns.return_value = False
+
+    asyncio.run(mailbox_scheduler.retrieve_mailbox("a@test.com"))
+
+    mailbox_scheduler.email_service.retrieve_emails.assert_not_awaited()
+    mailbox_scheduler.mailbox_repository.mark_running_async.assert_not_awaited()
+
+def test_renew_subscriptions_removes_those_of_disabled_mailboxes(mailbox_scheduler):
+    mailbox_scheduler.mailbox_repository.list_mailboxes_async = AsyncMock(return_value=[{"_id": "a@test.com"}])
+    mailbox_scheduler.subscription_service = Mock()
+    mailbox_scheduler.subscription_service.ensure_subscriptions = AsyncMock()
+    mailbox_scheduler.subscription_service.remove_subscriptions = AsyncMock()
+    mailbox_scheduler.subscription_service.subscription_repository.list_subscribed_mailboxes_async = AsyncMock(
+        return_value=["a@test.com", "b@test.com", "me"]
+    )
+
+    asyncio.run(mailbox_scheduler.renew_subscriptions())
+
+    mailbox_scheduler.subscription_service.ensure_subscriptions.assert_awaited_once_with(["a@test.com"])
+    mailbox_scheduler.subscription_service.remove_subscriptions.assert_awaited_once_with(["b@test.com", "me"])
+
+@patch.object(settings, "WEBHOOKS_ENABLED", True)
+@patch.object(settings, "WEBHOOK_CLIENT_STATE", "")
+def test_webhooks_stay_off_without_a_client_state_secret(mailbox_scheduler):
+    mailbox_scheduler.mailbox_repository.list_mailboxes.return_value = []
+
+    async def action():
+        return mailbox_scheduler.scheduler.get_job("renew_subscriptions")
+
+    assert _run_started(mailbox_scheduler, action) is None
+    assert mailbox_scheduler.retrieval_interval == settings.EMAIL_RETRIEVAL_INTERVAL
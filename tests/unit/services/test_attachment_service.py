@@ -0,0 +1,129 @@
+import asyncio
+import hashlib
+import os
+import tracemalloc
+
+import httpx
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+from unittest.mock import AsyncMock, Mock, patch
+
+from app.services.attachment_service import AttachmentService
+from app.services.attachment_store import LocalDiskAttachmentStore
+from app.services.graph_client import GraphClient
+from config import settings
+
+MB = 1024 * 1024
+
+class MockGraph:
+    """Mock Graph attachment endpoints; contents are generated chunk by chunk"""
+    def __init__(self):
+        self.attachments = {}
+        self.contents = {}
+        self.downloads = []
+
+    def add(self, email_id, attachment_id, size, seed=b"a", odata_type="#microsoft.graph.fileAttachment"):
+        self.attachments.setdefault(email_id, []).append({
+            "@odata.type": odata_type, "id": attachment_id, "name": f"{attachment_id}.bin",
+            "contentType": "application/octet-stream", "size": size, "isInline": False
+        })
+        self.contents[attachment_id] = (seed, size)
+
+    def handler(self, request):
+        parts = request.url.path.split("/")
+        if parts[-1] == "$value":
+            attachment_id = parts[-2]
+            self.downloads.append(attachment_id)
+            seed, size = self.contents[attachment_id]
+            return httpx.Response(200, content=self.stream(seed, size))
+        return httpx.Response(200, json={"value": self.attachments.get(parts[-2], [])})
+
+    @staticmethod
+    async def stream(seed, size):
+        chunk = seed * (64 * 1024)
+        sent = 0
+        while sent < size:
+            part = chunk[:size - sent]
+            sent += len(part)
+            yield part
+
+def _sha256(seed, size):
+    return hashlib.sha256(seed * size).hexdigest()
+
+@pytest.fixture
+def mock_graph():
+    return MockGraph()
+
+@pytest.fixture
+def attachment_service(mock_graph, tmp_path):
+    collection = AsyncMongoMockClient()["test"]["attachments"]
+    with patch("app.repositories.attachment_repository.get_async_attachment_collection", return_value=collection), \
+            patch.object(settings, "GRAPH_API_BASE_URL", "https://graph.test/v1.0"):
+        service = AttachmentService(
+            graph_client=GraphClient(transport=httpx.MockTransport(mock_graph.handler)),
+            attachment_store=LocalDiskAttachmentStore(str(tmp_path))
+        )
+        service.token_service = Mock()
+        service.token_service.get_access_token_async = AsyncMock(return_value="mock_token")
+        yield service
+
+def test_ingest_stores_each_content_once(attachment_service, mock_graph, tmp_path):
+    mock_graph.add("m1", "a1", 1000, seed=b"x")
+    mock_graph.add("m1", "a2", 2000, seed=b"y")
+    mock_graph.add("m2", "a3", 1000, seed=b"x")  # same file attached to another email
+    mock_graph.add("m2", "item", 10, odata_type="#microsoft.graph.itemAttachment")
+
+    summary = asyncio.run(attachment_service.ingest_emails("me", ["m1", "m2"]))
+
+    assert summary == {"emails": 2, "attachments": 3, "bytes": 4000, "skipped": 1, "failed": 0}
+    stored_files = [name for _, _, names in os.walk(tmp_path) for name in names]
+    assert sorted(stored_files) == sorted([_sha256(b"x", 1000), _sha256(b"y", 2000)])
+    listed = asyncio.run(attachment_service.attachment_repository.list_attachments_async("m2"))
+    assert [(a["attachment_id"], a["sha256"], a["storage"]) for a in listed] == [("a3", _sha256(b"x", 1000), "disk")]
+
+def test_ingest_skips_attachments_already_stored(attachment_service, mock_graph):
+    mock_graph.add("m1", "a1", 100)
+
+    asyncio.run(attachment_service.ingest_emails("me", ["m1"]))
+    summary = asyncio.run(attachment_service.ingest_emails("me", ["m1"]))
+
+    assert mock_graph.downloads == ["a1"]
+    assert summary["attachments"] == 0 and summary["skipped"] == 1
+
+def test_failed_email_does_not_stop_the_others(attachment_service, mock_graph):
+    mock_graph.add("m1", "a1", 100)
+    mock_graph.attachments["broken"] = [{"@odata.type": "#microsoft.graph.fileAttachment", "id": "missing"}]
+
+    summary = asyncio.run(attachment_service.ingest_emails("me", ["broken", "m1"]))
+
+    assert summary["failed"] == 1 and summary["attachments"] == 1
+
+def test_memory_stays_flat_for_100mb_attachment(attachment_service, mock_graph, tmp_path):
+    mock_graph.add("m1", "big", 100 * MB, seed=b"z")
+
+    tracemalloc.start()
+    try:
+        summary = asyncio.run(attachment_service.ingest_emails("me", ["m1"]))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert summary["bytes"] == 100 * MB
+    assert os.path.getsize(attachment_service.attachment_store.path(_sha256(b"z", 100 * MB))) == 100 * MB
+    assert peak < 16 * MB
+
+def test_local_disk_store_reads_back_in_chunks(tmp_path):
+    store = LocalDiskAttachmentStore(str(tmp_path))
+
+    async def chunks():
+        for part in (b"hello ", b"world"):
+            yield part
+
+    async def roundtrip():
+        sha256, size = await store.save(chunks())
+        return sha256, size, b"".join([chunk async for chunk in store.open(sha256)])
+
+    sha256, size, content = asyncio.run(roundtrip())
+
+    assert sha256 == hashlib.sha256(b"hello world").hexdigest()
+    assert size == 11 and content == b"hello world"
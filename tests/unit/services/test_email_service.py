@@ -1,18 +1,64 @@
+import asyncio
+import base64
+import json
+import time
+import tracemalloc
+
+import httpx
 import pytest
-from unittest.mock import Mock, patch
+from mongomock_motor import AsyncMongoMockClient
+from unittest.mock import AsyncMock, Mock, patch
+from app.repositories.email_repository import EmailRepository
 from app.services.email_service import EmailService
-from app.models.email import EmailSendRequest
+from app.services.graph_client import GraphClient
+from app.services.outbound_attachments import OutboundAttachmentStore
+from app.services.search_backend import InMemorySearchBackend
+from app.models.email import EmailAttachment, EmailSendRequest, EmailStoreResult
 from config import settings
 
+class MockGraph:
+    """Local mock Graph server: answers with queued responses and records requests"""
+    def __init__(self):
+        self.responses = []
+        self.requests = []
+
+    def handler(self, request):
+        self.requests.append(request)
+        return self.responses.pop(0)
+
+@pytest.fixture(autouse=True)
+def graph_urls():
+    with patch.object(settings, "SEND_EMAIL_URL", "https://graph.test/me/sendMail"), \
+            patch.object(settings, "RETRIEVE_EMAIL_URL", "https://graph.test/me/messages"), \
+            patch.object(settings, "DELTA_EMAIL_URL", "https://graph.test/me/mailFolders/inbox/messages/delta"):
+        yield
+
 @pytest.fixture
-def email_service():
-    with patch("app.services.email_service.EmailRepository") as MockRepo:
-        mock_repo_instance = MockRepo.return_value
-        mock_repo_instance.store_emails.return_value = []
-        email_service = EmailService()
-        email_service.token_service = Mock()
-        email_service.token_service.get_access_token.return_value = "mock_token"
-        return email_service
+def mock_graph():
+    return MockGraph()
+
+@pytest.fixture
+def email_service(mock_graph):
+    mock_repository = Mock()
+    mock_repository.email_documents.side_effect = \
+        lambda emails_data, mailbox=None: [{"email_id": email["id"], "mailbox": mailbox} for email in emails_data]
+    mock_repository.store_documents_async = AsyncMock(return_value=EmailStoreResult())
+    mock_repository.delete_emails_async = AsyncMock(return_value=0)
+    mock_sync_state = Mock()
+    mock_sync_state.get_delta_link_async = AsyncMock(return_value=None)
+    mock_sync_state.save_delta_link_async = AsyncMock()
+    mock_sync_state.clear_delta_link_async = AsyncMock()
+    email_service = EmailService(
+        graph_client=GraphClient(transport=httpx.MockTransport(mock_graph.handler)),
+        email_repository=mock_repository,
+        sync_state_repository=mock_sync_state,
+        search_backend=Mock(),
+        attachment_service=Mock(),
+        outbound_attachments=Mock()
+    )
+    email_service.token_service = Mock()
+    email_service.token_service.get_access_token_async = AsyncMock(return_value="mock_token")
+    return email_service
 
 @pytest.fixture
 def mock_email_request():
@@ -25,64 +71,438 @@ def mock_email_request():
         bcc_recipients=[]
     )
 
-@patch('app.services.email_service.requests')
-@patch('app.services.email_service.token_cache')
-def test_send_email_success(mock_token_cache, mock_requests, email_service, mock_email_request):
-    # Setup token and requests mock
-    mock_token_cache.get_access_token.return_value = "mock_token"
-    mock_response = Mock()
-    mock_response.status_code = 202
-    mock_requests.post.return_value = mock_response
+@patch('app.services.email_service.token_cache', get_access_token_async=AsyncMock(return_value="mock_token"))
+def test_send_email_success(mock_token_cache, email_service, mock_graph, mock_email_request):
+    # Setup token and Graph response
+    mock_graph.responses.append(httpx.Response(202))
 
     # Act
-    result = email_service.send_email(mock_email_request)
+    result = asyncio.run(email_service.send_email(mock_email_request))
 
     # Assert
     assert result == "email_sent_successfully"
+    assert mock_graph.requests[0].headers["Authorization"] == "Bearer mock_token"
 
-@patch('app.services.email_service.requests')
-@patch('app.services.email_service.token_cache')
-def test_send_email_failure(mock_token_cache, mock_requests, email_service, mock_email_request):
+@patch('app.services.email_service.token_cache', get_access_token_async=AsyncMock(return_value="mock_token"))
+def test_send_email_failure(mock_token_cache, email_service, mock_graph, mock_email_request):
     # Setup mocks
-    mock_token_cache.get_access_token.return_value = "mock_token"
-    mock_response = Mock()
-    mock_response.status_code = 500
-    mock_response.text = "Internal Server Error"
-    mock_requests.post.return_value = mock_response
+    mock_graph.responses.append(httpx.Response(500, text="Internal Server Error"))
 
     # Act & Assert
     with pytest.raises(Exception) as exc_info:
-        email_service.send_email(mock_email_request)
+        asyncio.run(email_service.send_email(mock_email_request))
     assert "Failed to send email" in str(exc_info.value)
 
-@patch('app.services.email_service.requests')
-@patch('app.services.email_service.token_cache')
-def test_retrieve_emails_success(mock_token_cache, mock_requests, email_service):
+@patch.object(settings, "EMAIL_SYNC_MODE", "window")
+def test_retrieve_emails_success(email_service, mock_graph):
     # Setup mocks
-    mock_token_cache.get_access_token.return_value = "mock_token"
-    mock_response = Mock()
-    mock_response.status_code = 200
-    mock_response.json.return_value = {"value": []}
-    mock_requests.get.return_value = mock_response
+    mock_graph.responses.append(httpx.Response(200, json={"value": []}))
 
     # Act
-    result = email_service.retrieve_emails()
+    result = asyncio.run(email_service.retrieve_emails())
 
     # Assert
-    assert result == []
-    mock_requests.get.assert_called_once()
+    assert result["pages"] == 1
+    assert result["emails"] == 0
+    assert len(mock_graph.requests) == 1
 
-@patch('app.services.email_service.requests')
-@patch('app.services.email_service.token_cache')
-def test_retrieve_emails_failure(mock_token_cache, mock_requests, email_service):
+@patch.object(settings, "EMAIL_SYNC_MODE", "window")
+def test_retrieve_emails_failure(email_service, mock_graph):
     # Setup mocks
-    mock_token_cache.get_access_token.return_value = "mock_token"
-    mock_response = Mock()
-    mock_response.status_code = 500
-    mock_response.text = "Internal Server Error"
-    mock_requests.get.return_value = mock_response
+    mock_graph.responses.append(httpx.Response(500, text="Internal Server Error"))
 
     # Act & Assert
     with pytest.raises(Exception) as exc_info:
-        email_service.retrieve_emails()
+        asyncio.run(email_service.retrieve_emails())
     assert "Failed to retrieve emails" in str(exc_info.value)
+
+def _graph_page(value, next_link=None, delta_link=None):
+    page = {"value": value}
+    if next_link:
+        page["@odata.nextLink"] = next_link
+    if delta_link:
+        page["@odata.deltaLink"] = delta_link
+    return httpx.Response(200, json=page)
+
+@patch.object(settings, "EMAIL_SYNC_MODE", "delta")
+def test_delta_sync_follows_pages_and_saves_delta_link(email_service, mock_graph):
+    mock_graph.responses.extend([
+        _graph_page([{"id": "1"}], next_link="https://graph.test/next"),
+        _graph_page([{"id": "2"}, {"id": "3", "@removed": {"reason": "deleted"}}], delta_link="https://graph.test/delta?token=abc"),
+    ])
+
+    result = asyncio.run(email_service.retrieve_emails())
+
+    assert result["pages"] == 2
+    assert result["emails"] == 2
+    assert str(mock_graph.requests[1].url) == "https://graph.test/next"
+    email_service.email_repository.delete_emails_async.assert_awaited_once_with(["3"])
+    email_service.sync_state_repository.save_delta_link_async.assert_awaited_once_with("me", "https://graph.test/delta?token=abc")
+
+def test_delta_sync_resumes_from_stored_delta_link(email_service, mock_graph):
+    email_service.sync_state_repository.get_delta_link_async.return_value = "https://graph.test/delta?token=abc"
+    mock_graph.responses.append(_graph_page([], delta_link="https://graph.test/delta?token=def"))
+
+    result = asyncio.run(email_service.sync_emails_delta())
+
+    assert result["emails"] == 0
+    assert len(mock_graph.requests) == 1
+    assert str(mock_graph.requests[0].url) == "https://graph.test/delta?token=abc"
+    email_service.email_repository.store_documents_async.assert_not_called()
+    email_service.sync_state_repository.save_delta_link_async.assert_awaited_once_with("me", "https://graph.test/delta?token=def")
+
+def test_delta_sync_restarts_when_delta_link_expired(email_service, mock_graph):
+    email_service.sync_state_repository.get_delta_link_async.side_effect = ["https://graph.test/delta?token=old", None]
+    mock_graph.responses.extend([
+        httpx.Response(410, text="Gone"),
+        _graph_page([{"id": "1"}], delta_link="https://graph.test/delta?token=new"),
+    ])
+
+    result = asyncio.run(email_service.sync_emails_delta())
+
+    assert result["emails"] == 1
+    email_service.sync_state_repository.clear_delta_link_async.assert_awaited_once_with("me")
+    email_service.sync_state_repository.save_delta_link_async.assert_awaited_once_with("me", "https://graph.test/delta?token=new")
+
+@patch.object(settings, "EMAIL_SYNC_MODE", "window")
+def test_retrieve_emails_stores_each_page_as_it_arrives(email_service, mock_graph):
+    mock_graph.responses.extend([
+        _graph_page([{"id": "1"}, {"id": "2"}], next_link="https://graph.test/page2"),
+        _graph_page([{"id": "3"}]),
+    ])
+
+    result = asyncio.run(email_service.retrieve_emails())
+
+    assert result["pages"] == 2
+    assert result["emails"] == 3
+    stored_pages = [c.args[0] for c in email_service.email_repository.email_documents.call_args_list]
+    assert [[email["id"] for email in page] for page in stored_pages] == [["1", "2"], ["3"]]
+
+@patch.object(settings, "EMAIL_MAX_PAGES", 1)
+def test_delta_sync_stops_at_max_pages_and_resumes_from_next_link(email_service, mock_graph):
+    mock_graph.responses.extend([
+        _graph_page([{"id": "1"}], next_link="https://graph.test/next"),
+        _graph_page([{"id": "2"}], delta_link="https://graph.test/delta"),
+    ])
+
+    result = asyncio.run(email_service.sync_emails_delta())
+
+    assert result["pages"] == 1
+    assert len(mock_graph.requests) == 1
+    email_service.sync_state_repository.save_delta_link_async.assert_awaited_once_with("me", "https://graph.test/next")
+
+@patch('app.services.email_service.token_cache', get_access_token_async=AsyncMock(return_value="mock_token"))
+def test_concurrent_sends_do_not_serialize(mock_token_cache, email_service, mock_email_request):
+
+    async def slow_graph(request):
+        await asyncio.sleep(0.2)
+        return httpx.Response(202)
+
+    email_service.graph_client = GraphClient(transport=httpx.MockTransport(slow_graph))
+
+    async def send_many():
+        return await asyncio.gather(*[email_service.send_email(mock_email_request) for _ in range(10)])
+
+    started = time.monotonic()
+    results = asyncio.run(send_many())
+
+    assert results == ["email_sent_successfully"] * 10
+    assert time.monotonic() - started < 1.0
+
+def _batch_handler(failed_ids=(), failed_batches=0):
+    """Mock Graph $batch endpoint answering 202 for every sub-request but the failed ones"""
+    seen = {"batches": 0, "sizes": []}
+
+    def handler(request):
+        seen["batches"] += 1
+        sub_requests = json.loads(request.content)["requests"]
+        seen["sizes"].append(len(sub_requests))
+        if seen["batches"] <= failed_batches:
+            return httpx.Response(400, text="Bad Request")
+        return httpx.Response(200, json={"responses": [
+            {"id": r["id"], "status": 400, "body": {"error": {"message": "Invalid recipient"}}}
+            if r["id"] in failed_ids else {"id": r["id"], "status": 202}
+            for r in sub_requests
+        ]})
+
+    return handler, seen
+
+@patch('app.services.email_service.token_cache', get_access_token_async=AsyncMock(return_value="mock_token"))
+def test_send_batch_packs_twenty_messages_per_graph_batch(mock_token_cache, email_service, mock_email_request):
+    handler, seen = _batch_handler(failed_ids={"21"})
+    email_service.graph_client = GraphClient(transport=httpx.MockTransport(handler))
+
+    with patch.object(settings, "GRAPH_BATCH_URL", "https://graph.test/$batch"):
+        results = asyncio.run(email_service.send_batch([mock_email_request] * 45))
+
+    assert sorted(seen["sizes"]) == [5, 20, 20]
+    assert [result.index for result in results] == list(range(45))
+    assert [result.index for result in results if not result.success] == [21]
+    assert results[21].error == "Invalid recipient"
+
+@patch('app.services.email_service.token_cache', get_access_token_async=AsyncMock(return_value="mock_token"))
+def test_send_batch_marks_every_message_of_a_failed_batch(mock_token_cache, email_service, mock_email_request):
+    handler, seen = _batch_handler(failed_batches=1)
+    email_service.graph_client = GraphClient(transport=httpx.MockTransport(handler))
+
+    with patch.object(settings, "GRAPH_BATCH_URL", "https://graph.test/$batch"), \
+            patch.object(settings, "EMAIL_BATCH_CONCURRENCY", 1):
+        results = asyncio.run(email_service.send_batch([mock_email_request] * 25))
+
+    assert [result.success for result in results] == [False] * 20 + [True] * 5
+    assert all(result.status_code == 400 for result in results[:20])
+
+@patch('app.services.email_service.token_cache', get_access_token_async=AsyncMock(return_value="mock_token"))
+def test_send_batch_retries_throttled_sub_requests(mock_token_cache, email_service, mock_email_request):
+    sent_ids = []
+
+    def handler(request):
+        sub_requests = json.loads(request.content)["requests"]
+        sent_ids.append([r["id"] for r in sub_requests])
+        if len(sent_ids) == 1:
+            return httpx.Response(200, json={"responses": [
+                {"id": "0", "status": 202},
+                {"id": "1", "status": 429, "headers": {"Retry-After": "0"}},
+            ]})
+        return httpx.Response(200, json={"responses": [{"id": r["id"], "status": 202} for r in sub_requests]})
+
+    email_service.graph_client = GraphClient(transport=httpx.MockTransport(handler))
+
+    with patch.object(settings, "GRAPH_BATCH_URL", "https://graph.test/$batch"):
+        results = asyncio.run(email_service.send_batch([mock_email_request] * 2))
+
+    assert sent_ids == [["0", "1"], ["1"]]
+    assert all(result.success for result in results)
+    assert email_service.graph_client.stats.retries == 1
+
+def test_fetch_emails_batches_notified_messages(email_service):
+    requests_seen = []
+
+    def handler(request):
+        sub_requests = json.loads(request.content)["requests"]
+        requests_seen.append(sub_requests)
+        return httpx.Response(200, json={"responses": [
+            {"id": sub["id"], "status": 404 if sub["url"].startswith("/users/a@x.com/messages/gone") else 200,
+             "body": {"id": sub["url"].split("/")[4].split("?")[0]}}
+            for sub in sub_requests
+        ]})
+
+    email_service.graph_client = GraphClient(transport=httpx.MockTransport(handler))
+    email_service.email_repository.store_documents_async.return_value = EmailStoreResult(inserted=2)
+    with patch.object(settings, "GRAPH_BATCH_URL", "https://graph.test/$batch"):
+        summary = asyncio.run(email_service.fetch_emails("a@x.com", ["m1", "m2", "m1", "gone"]))
+
+    assert len(requests_seen) == 1
+    assert [sub["url"].split("?")[0] for sub in requests_seen[0]] == [
+        "/users/a@x.com/messages/m1", "/users/a@x.com/messages/m2", "/users/a@x.com/messages/gone"
+    ]
+    stored, mailbox = email_service.email_repository.email_documents.call_args[0]
+    assert [email["id"] for email in stored] == ["m1", "m2"] and mailbox == "a@x.com"
+    assert summary["requested"] == 3 and summary["emails"] == 2 and summary["missing"] == 1
+    assert summary["inserted"] == 2
+
+def test_store_emails_ingests_attachments_of_emails_that_have_them(email_service):
+    email_service.attachment_service = Mock()
+    email_service.attachment_service.ingest_emails = AsyncMock()
+    emails = [{"id": "1", "hasAttachments": True}, {"id": "2", "hasAttachments": False}, {"id": "3"}]
+
+    asyncio.run(email_service.store_emails(emails, "me"))
+
+    email_service.attachment_service.ingest_emails.assert_awaited_once_with("me", ["1"])
+
+def test_store_emails_indexes_the_documents_stored_and_skips_malformed_ones(email_service):
+    with patch("app.repositories.email_repository.get_async_email_collection",
+               return_value=AsyncMongoMockClient()["test"]["emails"]):
+        email_service.email_repository = EmailRepository()
+    email_service.search_backend = InMemorySearchBackend()
+    email_service.attachment_service = Mock()
+    email_service.attachment_service.ingest_emails = AsyncMock()
+    emails = [
+        {"id": "1", "subject": "Invoice", "hasAttachments": True, "receivedDateTime": "2023-01-01T00:00:00Z"},
+        {"subject": "no id", "hasAttachments": True}
+    ]
+
+    with patch.object(settings, "INGEST_VALIDATION", "lenient"):
+        result = asyncio.run(email_service.store_emails(emails, "me"))
+
+    assert result == EmailStoreResult(inserted=1)
+    assert len(email_service.search_backend) == 1
+    email_service.attachment_service.ingest_emails.assert_awaited_once_with("me", ["1"])
+
+@patch('app.services.email_service.token_cache', get_access_token_async=AsyncMock(return_value="mock_token"))
+def test_send_email_splits_large_recipient_lists(mock_token_cache, email_service, mock_graph, mock_email_request):
+    mock_graph.responses = [httpx.Response(202)] * 3
+    email_request = mock_email_request.copy(update={
+        "to_recipients": [f"to{i}@example.com" for i in range(4)],
+        "cc_recipients": [f"cc{i}@example.com" for i in range(3)],
+        "bcc_recipients": [f"bcc{i}@example.com" for i in range(3)]
+    })
+    progress = []
+
+    async def on_part_sent(parts_sent):
+        progress.append(parts_sent)
+
+    with patch.object(settings, "SEND_MAX_RECIPIENTS", 4):
+        asyncio.run(email_service.send_email(email_request, parts_sent=0, on_part_sent=on_part_sent))
+
+    messages = [json.loads(request.content)["message"] for request in mock_graph.requests]
+    counts = [[len(message[field]) for field in ("toRecipients", "ccRecipients", "bccRecipients")] for message in messages]
+    assert counts == [[4, 0, 0], [0, 3, 1], [0, 0, 2]]
+    assert progress == [1, 2, 3]
+
+@patch('app.services.email_service.token_cache', get_access_token_async=AsyncMock(return_value="mock_token"))
+def test_send_email_skips_parts_already_sent(mock_token_cache, email_service, mock_graph, mock_email_request):
+    mock_graph.responses = [httpx.Response(202)]
+    email_request = mock_email_request.copy(update={"to_recipients": [f"to{i}@example.com" for i in range(3)]})
+
+    with patch.object(settings, "SEND_MAX_RECIPIENTS", 2):
+        asyncio.run(email_service.send_email(email_request, parts_sent=1))
+
+    message = json.loads(mock_graph.requests[0].content)["message"]
+    assert [r["emailAddress"]["address"] for r in message["toRecipients"]] == ["to2@example.com"]
+
+@patch('app.services.email_service.token_cache', get_access_token_async=AsyncMock(return_value="mock_token"))
+def test_send_email_inlines_small_attachments(mock_token_cache, email_service, mock_graph, mock_email_request, tmp_path):
+    mock_graph.responses = [httpx.Response(202)]
+    email_service.outbound_attachments = OutboundAttachmentStore(str(tmp_path))
+    file_id, _ = asyncio.run(email_service.outbound_attachments.save(_chunks(b"staged", 1)))
+    email_request = mock_email_request.copy(update={"attachments": [
+        EmailAttachment(name="a.txt", content_type="text/plain", content_bytes=base64.b64encode(b"hello").decode()),
+        EmailAttachment(name="b.bin", file_id=file_id)
+    ]})
+
+    asyncio.run(email_service.send_email(email_request))
+
+    assert mock_graph.requests[0].url.path == "/me/sendMail"
+    attachments = json.loads(mock_graph.requests[0].content)["message"]["attachments"]
+    assert [(a["name"], base64.b64decode(a["contentBytes"])) for a in attachments] == [("a.txt", b"hello"), ("b.bin", b"staged")]
+    assert attachments[0]["@odata.type"] == "#microsoft.graph.fileAttachment"
+
+async def _chunks(data, count):
+    for _ in range(count):
+        yield data
+
+class MockUploadGraph(httpx.AsyncBaseTransport):
+    """Mock Graph draft + upload session endpoints, counting uploaded bytes without keeping them"""
+    def __init__(self, fail_puts=()):
+        self.requests = []
+        self.received = 0
+        self.fail_puts = set(fail_puts)
+        self.puts = 0
+
+    async def handle_async_request(self, request):
+        if request.url.host == "upload.test" and request.method == "PUT":
+            # Consume the upload like a server would, piece by piece
+            request.uploaded = 0
+            async for piece in request.stream:
+                request.uploaded += len(piece)
+        else:
+            await request.aread()
+        return self.handler(request)
+
+    def handler(self, request):
+        self.requests.append((request.method, request.url.path))
+        path = request.url.path
+        if request.method == "POST" and path == "/v1.0/me/messages":
+            return httpx.Response(201, json={"id": "draft1"})
+        if path.endswith("/createUploadSession"):
+            size = json.loads(request.content)["AttachmentItem"]["size"]
+            self.size = size
+            return httpx.Response(201, json={"uploadUrl": "https://upload.test/session1"})
+        if request.url.host == "upload.test" and request.method == "GET":
+            return httpx.Response(200, json={"nextExpectedRanges": [f"{self.received}-"]})
+        if request.url.host == "upload.test":
+            assert "Authorization" not in request.headers
+            self.puts += 1
+            if self.puts in self.fail_puts:
+                return httpx.Response(500, text="Upload interrupted")
+            start = int(request.headers["Content-Range"].split(" ")[1].split("-")[0])
+            assert start == self.received
+            assert request.uploaded == int(request.headers["Content-Length"])
+            self.received += request.uploaded
+            if self.received == self.size:
+                return httpx.Response(201)
+            return httpx.Response(200, json={"nextExpectedRanges": [f"{self.received}-"]})
+        if path.endswith("/attachments"):
+            return httpx.Response(201, json={})
+        if path.endswith("/send"):
+            return httpx.Response(202)
+        if request.method == "DELETE":
+            return httpx.Response(204)
+        return httpx.Response(404)
+
+@pytest.fixture
+def upload_service(email_service, tmp_path):
+    email_service.outbound_attachments = OutboundAttachmentStore(str(tmp_path))
+    with patch.object(settings, "GRAPH_API_BASE_URL", "https://graph.test/v1.0"), \
+            patch('app.services.email_service.token_cache',
+                  get_access_token_async=AsyncMock(return_value="mock_token")):
+        yield email_service
+
+def test_large_attachment_goes_through_resumable_upload_session(upload_service, mock_email_request):
+    mock_upload = MockUploadGraph(fail_puts={2})
+    upload_service.graph_client = GraphClient(transport=mock_upload)
+    size = 40 * 1024 * 1024
+    file_id, _ = asyncio.run(upload_service.outbound_attachments.save(_chunks(b"x" * 1024 * 1024, 40)))
+    email_request = mock_email_request.copy(update={"attachments": [
+        EmailAttachment(name="big.bin", file_id=file_id),
+        EmailAttachment(name="small.txt", content_bytes=base64.b64encode(b"small").decode())
+    ]})
+
+    tracemalloc.start()
+    try:
+        asyncio.run(upload_service.send_email(email_request))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert mock_upload.received == size
+    # Memory does not grow with the attachment: well under one upload chunk
+    assert peak < settings.SEND_UPLOAD_CHUNK_SIZE
+    assert ("GET", "/session1") in mock_upload.requests
+    assert ("POST", "/v1.0/me/messages/draft1/attachments") in mock_upload.requests
+    assert mock_upload.requests[-1] == ("POST", "/v1.0/me/messages/draft1/send")
+
+@patch.object(settings, "SEND_UPLOAD_MAX_RESUMES", 1)
+def test_failed_upload_deletes_the_draft(upload_service, mock_email_request):
+    mock_upload = MockUploadGraph(fail_puts={1, 2})
+    upload_service.graph_client = GraphClient(transport=mock_upload)
+    file_id, _ = asyncio.run(upload_service.outbound_attachments.save(_chunks(b"x" * 1024 * 1024, 4)))
+    email_request = mock_email_request.copy(update={"attachments": [EmailAttachment(name="big.bin", file_id=file_id)]})
+
+    with pytest.raises(Exception, match="Failed to upload attachment big.bin"):
+        asyncio.run(upload_service.send_email(email_request))
+
+    assert mock_upload.requests[-1] == ("DELETE", "/v1.0/me/messages/draft1")
+    assert ("POST", "/v1.0/me/messages/draft1/send") not in mock_upload.requests
+
+def test_send_batch_sends_messages_with_attachments_on_their_own(upload_service, mock_email_request):
+    sendmail_requests = []
+
+    def handler(request):
+        if request.url.path == "/me/sendMail":
+            sendmail_requests.append(json.loads(request.content))
+            return httpx.Response(202)
+        sub_requests = json.loads(request.content)["requests"]
+        return httpx.Response(200, json={"responses": [{"id": r["id"], "status": 202} for r in sub_requests]})
+
+    upload_service.graph_client = GraphClient(transport=httpx.MockTransport(handler))
+    with_attachment = mock_email_request.copy(update={"attachments": [
+        EmailAttachment(name="a.txt", content_bytes=base64.b64encode(b"hello").decode())
+    ]})
+
+    with patch.object(settings, "GRAPH_BATCH_URL", "https://graph.test/$batch"):
+        results = asyncio.run(upload_service.send_batch([mock_email_request, with_attachment, mock_email_request]))
+
+    assert [(result.index, result.success) for result in results] == [(0, True), (1, True), (2, True)]
+    assert len(sendmail_requests) == 1 and sendmail_requests[0]["message"]["attachments"][0]["name"] == "a.txt"
+
+def test_attachment_needs_exactly_one_content_source():
+    with pytest.raises(ValueError):
+        EmailAttachment(name="a.txt")
+    with pytest.raises(ValueError):
+        EmailAttachment(name="a.txt", content_bytes="aGVsbG8=", file_id="0" * 32)
+    with pytest.raises(ValueError):
+        EmailAttachment(name="a.txt", file_id="../../etc/passwd")
+    with pytest.raises(ValueError):
+        EmailAttachment(name="a.txt", content_bytes="not base64!")
@@ -0,0 +1,148 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+from prometheus_client import REGISTRY
+from unittest.mock import patch
+
+from app.services.graph_client import GraphClient
+from app.services.graph_retry import TokenBucket, mailbox_from_url, parse_retry_after
+from config import settings
+
+@pytest.fixture(autouse=True)
+def fast_backoff():
+    with patch.object(settings, "GRAPH_BACKOFF_BASE", 0.001), \
+            patch.object(settings, "GRAPH_MAX_RETRIES", 3):
+        yield
+
+def _client(responses, requests=None):
+    def handler(request):
+        if requests is not None:
+            requests.append(request)
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+    return GraphClient(transport=httpx.MockTransport(handler))
+
+def test_retries_throttled_request_honoring_retry_after():
+    client = _client([httpx.Response(429, headers={"Retry-After": "0.05"}), httpx.Response(200, json={"value": []})])
+
+    started = time.monotonic()
+    response = asyncio.run(client.get("https://graph.test/me/messages"))
+
+    assert response.status_code == 200
+    assert time.monotonic() - started >= 0.05
+    assert client.stats.retries == 1
+    assert client.stats.throttled == 1
+    assert client.stats.retry_wait_seconds == pytest.approx(0.05)
+
+def test_returns_last_response_when_retries_are_exhausted():
+    client = _client([httpx.Response(503) for _ in range(4)])
+
+    response = asyncio.run(client.get("https://graph.test/me/messages"))
+
+    assert response.status_code == 503
+    assert client.stats.requests == 4
+    assert client.stats.retries == 3
+
+def test_does_not_retry_other_errors():
+    client = _client([httpx.Response(400, text="Bad Request")])
+
+    response = asyncio.run(client.get("https://graph.test/me/messages"))
+
+    assert response.status_code == 400
+    assert client.stats.retries == 0
+
+def test_post_is_not_retried_after_it_may_have_reached_graph():
+    requests = []
+    client = _client([httpx.ReadTimeout("timed out")], requests)
+
+    with pytest.raises(httpx.ReadTimeout):
+        asyncio.run(client.post("https://graph.test/me/sendMail", json={}))
+    assert len(requests) == 1
+
+def test_get_is_retried_on_transport_errors():
+    client = _client([httpx.ReadTimeout("timed out"), httpx.Response(200)])
+
+    response = asyncio.run(client.get("https://graph.test/me/messages"))
+
+    assert response.status_code == 200
+    assert client.stats.retries == 1
+
+def test_token_bucket_spaces_out_requests():
+    bucket = TokenBucket(rate=20, capacity=2)
+
+    async def acquire_many():
+        return [await bucket.acquire() for _ in range(4)]
+
+    started = time.monotonic()
+    waits = asyncio.run(acquire_many())
+
+    assert waits[:2] == [0.0, 0.0]
+    assert time.monotonic() - started >= 0.09
+
+def test_mailbox_from_url():
+    assert mailbox_from_url("https://graph.microsoft.com/v1.0/me/messages") == "me"
+    assert mailbox_from_url("https://graph.microsoft.com/v1.0/users/Jane@Contoso.com/messages") == "jane@contoso.com"
+
+def test_parse_retry_after():
+    assert parse_retry_after("7") == 7.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+
+def test_stream_retries_throttling_before_handing_over_the_body():
+    client = _client([httpx.Response(503, headers={"Retry-After": "0"}), httpx.Response(200, content=b"x" * 10)])
+
+    async def download():
+        async with client.stream("GET", "https://graph.test/me/messages/1/attachments/2/$value") as response:
+            return response.status_code, b"".join([chunk async for chunk in response.aiter_bytes(4)])
+
+    assert asyncio.run(download()) == (200, b"x" * 10)
+    assert client.stats.retries == 1
+
+def test_stream_hands_over_the_last_response_when_retries_are_exhausted():
+    in_flight = []
+
+    def handler(request):
+        in_flight.append(REGISTRY.get_sample_value("graph_requests_in_flight"))
+        return httpx.Response(503)
+
+    client = GraphClient(transport=httpx.MockTransport(handler))
+    before = REGISTRY.get_sample_value("graph_requests_in_flight")
+
+    async def download():
+        async with client.stream("GET", "https://graph.test/me/messages/1/attachments/2/$value") as response:
+            return response.status_code
+
+    assert asyncio.run(download()) == 503
+    assert client.stats.requests == 4 and client.stats.retries == 3 and client.stats.throttled == 4
+    assert in_flight == [before + 1] * 4
+    assert REGISTRY.get_sample_value("graph_requests_in_flight") == before
+
+def test_stream_retries_transport_errors_of_get_only():
+    client = _client([httpx.ReadTimeout("timed out"), httpx.Response(200, content=b"x")])
+
+    async def download(method):
+        async with client.stream(method, "https://graph.test/me/messages/1/attachments/2/$value") as response:
+            return response.status_code
+
+    assert asyncio.run(download("GET")) == 200
+    assert client.stats.retries == 1
+    client = _client([httpx.ReadTimeout("timed out"), httpx.Response(200)])
+    with pytest.raises(httpx.ReadTimeout):
+        asyncio.run(download("POST"))
+
+def test_batch_is_rate_limited_and_paused_with_its_mailbox():
+    client = _client([
+        httpx.Response(200, json={"responses": [{"id": "1", "status": 429, "headers": {"Retry-After": "0.05"}}]}),
+        httpx.Response(200, json={"responses": [{"id": "1", "status": 200, "body": {}}]})
+    ])
+    sub_requests = [{"id": "1", "method": "GET", "url": "/users/jane@contoso.com/messages/1"}]
+
+    with patch.object(settings, "GRAPH_BATCH_URL", "https://graph.test/$batch"):
+        responses = asyncio.run(client.batch(sub_requests, {}, mailbox="Jane@Contoso.com"))
+
+    assert responses["1"]["status"] == 200
+    assert set(client._buckets) == {"jane@contoso.com"}
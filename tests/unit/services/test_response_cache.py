@@ -0,0 +1,140 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+from mongomock_motor import AsyncMongoMockClient
+from starlette.requests import Request
+
+from app.services.response_cache import (
+    ALL_MAILBOXES, CachedResponse, InMemoryCacheBackend, MongoCacheBackend, ResponseCache, etag_matches
+)
+
+def _request(query: str = "", headers: dict = None) -> Request:
+    return Request({
+        "type": "http",
+        "method": "GET",
+        "path": "/emails",
+        "query_string": query.encode(),
+        "headers": [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()]
+    })
+
+def _entry(body: bytes) -> CachedResponse:
+    return CachedResponse(body, '"etag"', None, 0)
+
+def test_memory_backend_evicts_least_recently_used_and_expired_entries():
+    backend = InMemoryCacheBackend(max_entries=2, max_bytes=10)
+
+    async def run():
+        await backend.set("a", _entry(b"aaaa"), ttl=60)
+        await backend.set("b", _entry(b"bbbb"), ttl=60)
+        await backend.get("a")
+        await backend.set("c", _entry(b"cc"), ttl=60)
+        by_count = [key for key in "abc" if await backend.get(key)]
+        await backend.set("d", _entry(b"dddddd"), ttl=60)
+        by_size = [key for key in "abcd" if await backend.get(key)]
+        await backend.set("e", _entry(b"e" * 11), ttl=60)
+        await backend.set("f", _entry(b"f"), ttl=0)
+        return by_count, by_size, await backend.get("e"), await backend.get("f")
+
+    by_count, by_size, too_large, expired = asyncio.run(run())
+
+    assert by_count == ["a", "c"]
+    assert by_size == ["c", "d"]
+    assert too_large is None and expired is None
+
+def test_respond_caches_until_the_mailbox_is_invalidated():
+    response_cache = ResponseCache(InMemoryCacheBackend())
+    compute = AsyncMock(return_value={"items": [1]})
+
+    async def run():
+        statuses = []
+        for invalidated in [None, None, "b@test.com", "a@test.com", None]:
+            if invalidated:
+                await response_cache.invalidate_mailbox(invalidated)
+            response = await response_cache.respond(_request("mailbox=a@test.com"), compute, scope="a@test.com")
+            statuses.append(response.headers["x-cache"])
+        return statuses
+
+    assert asyncio.run(run()) == ["MISS", "HIT", "HIT", "MISS", "HIT"]
+    assert compute.await_count == 2
+
+def test_writes_to_any_mailbox_invalidate_unfiltered_reads():
+    response_cache = ResponseCache(InMemoryCacheBackend())
+    compute = AsyncMock(return_value={"items": []})
+
+    async def run():
+        await response_cache.respond(_request(), compute, scope=ALL_MAILBOXES)
+        await response_cache.invalidate_mailbox("b@test.com")
+        return await response_cache.respond(_request(), compute, scope=ALL_MAILBOXES)
+
+    assert asyncio.run(run()).headers["x-cache"] == "MISS"
+    assert compute.await_count == 2
+
+def test_if_none_match_returns_not_modified():
+    response_cache = ResponseCache(None)
+    compute = AsyncMock(return_value={"emails": 3})
+
+    async def run():
+        first = await response_cache.respond(_request(), compute)
+        return first, await response_cache.respond(_request(headers={"If-None-Match": first.headers["etag"]}), compute)
+
+    first, second = asyncio.run(run())
+
+    assert first.status_code == 200 and first.body == b'{"emails":3}'
+    assert second.status_code == 304 and second.body == b""
+    assert etag_matches(f'W/{first.headers["etag"]}, "other"', first.headers["etag"])
+    assert not etag_matches('"other"', first.headers["etag"])
+
+def test_concurrent_misses_compute_once():
+    response_cache = ResponseCache(InMemoryCacheBackend())
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return {"emails": 1}
+
+    async def run():
+        return await asyncio.gather(*[response_cache.respond(_request(), compute, scope=None) for _ in range(5)])
+
+    responses = asyncio.run(run())
+
+    assert len(calls) == 1
+    assert sorted(response.headers["x-cache"] for response in responses) == ["HIT"] * 4 + ["MISS"]
+
+def test_waiter_computes_when_the_first_computation_fails():
+    response_cache = ResponseCache(InMemoryCacheBackend())
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        if len(calls) == 1:
+            raise RuntimeError("mongo down")
+        return {"emails": 1}
+
+    async def run():
+        return await asyncio.gather(*[response_cache.respond(_request(), compute, scope=None) for _ in range(3)],
+                                    return_exceptions=True)
+
+    first, *others = asyncio.run(run())
+
+    assert isinstance(first, RuntimeError)
+    assert len(calls) == 2
+    assert sorted(response.headers["x-cache"] for response in others) == ["HIT", "MISS"]
+    assert response_cache._locks == {} and response_cache._lock_users == {}
+
+def test_mongo_backend_is_shared_between_processes():
+    collection = AsyncMongoMockClient()["db"]["response_cache"]
+    first, second = ResponseCache(MongoCacheBackend(async_collection=collection)), \
+        ResponseCache(MongoCacheBackend(async_collection=collection))
+    compute = AsyncMock(return_value={"items": []})
+
+    async def run():
+        statuses = [(await first.respond(_request("mailbox=a@test.com"), compute, scope="a@test.com")).headers["x-cache"]]
+        statuses.append((await second.respond(_request("mailbox=a@test.com"), compute, scope="a@test.com")).headers["x-cache"])
+        await first.invalidate_mailbox("a@test.com")
+        statuses.append((await second.respond(_request("mailbox=a@test.com"), compute, scope="a@test.com")).headers["x-cache"])
+        return statuses
+
+    assert asyncio.run(run()) == ["MISS", "HIT", "MISS"]
+    assert compute.await_count == 2
@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+from unittest.mock import AsyncMock, Mock, patch
+
+from app.repositories.email_repository import EmailRepository, to_email_document
+from app.services.search_backend import InMemorySearchBackend, MongoSearchBackend
+
+def _graph_email(email_id, subject, body, received="2023-01-01T00:00:00Z", content_type="text"):
+    return {
+        "id": email_id,
+        "subject": subject,
+        "sender": {"emailAddress": {"address": "sender@test.com"}},
+        "toRecipients": [{"emailAddress": {"address": "recipient@test.com"}}],
+        "body": {"content": body, "contentType": content_type},
+        "receivedDateTime": received
+    }
+
+def _index(backend, emails, mailbox):
+    backend.index_documents([to_email_document(email, mailbox) for email in emails])
+
+@pytest.fixture
+def backend():
+    backend = InMemorySearchBackend()
+    _index(backend, [
+        _graph_email("1", "Quarterly invoice", "Please find the invoice attached"),
+        _graph_email("2", "Lunch", "Did you pay the invoice?"),
+        _graph_email("3", "Team offsite", "<p>Agenda for the <b>offsite</b></p>", content_type="html"),
+        _graph_email("4", "Invoice reminder", "Reminder", received="2023-02-01T00:00:00Z")
+    ], "me")
+    return backend
+
+def test_subject_matches_rank_above_body_matches(backend):
+    documents, has_more = asyncio.run(backend.search("invoice"))
+
+    assert [document["email_id"] for document in documents][-1] == "2"
+    assert {document["email_id"] for document in documents} == {"1", "2", "4"}
+    assert has_more is False
+    assert all("body" not in document and document["score"] > 0 for document in documents)
+
+def test_search_pages_with_offset(backend):
+    first, has_more = asyncio.run(backend.search("invoice", limit=2))
+    second, last = asyncio.run(backend.search("invoice", offset=2, limit=2))
+
+    assert has_more is True and last is False
+    assert len(first) == 2 and len(second) == 1
+    assert {d["email_id"] for d in first}.isdisjoint(d["email_id"] for d in second)
+
+def test_html_tags_are_not_indexed(backend):
+    assert asyncio.run(backend.search("offsite"))[0][0]["email_id"] == "3"
+    assert asyncio.run(backend.search("b"))[0] == []
+
+def test_reindexing_and_removing_emails(backend):
+    _index(backend, [_graph_email("2", "Lunch", "Pizza today")], "me")
+    backend.remove_emails(["4"])
+
+    documents, _ = asyncio.run(backend.search("invoice"))
+
+    assert [document["email_id"] for document in documents] == ["1"]
+    assert len(backend) == 3
+
+def test_search_filters_by_mailbox(backend):
+    _index(backend, [_graph_email("5", "Invoice", "")], "other@test.com")
+
+    documents, _ = asyncio.run(backend.search("invoice", mailbox="other@test.com"))
+
+    assert [document["email_id"] for document in documents] == ["5"]
+
+def test_mongo_backend_uses_text_index():
+    cursor = Mock()
+    cursor.sort.return_value = cursor
+    cursor.skip.return_value = cursor
+    cursor.limit.return_value = cursor
+    cursor.to_list = AsyncMock(return_value=[{"_id": i, "score": 1.0} for i in range(3)])
+    async_collection = Mock()
+    async_collection.find.return_value = cursor
+    with patch("app.repositories.email_repository.get_async_email_collection", return_value=async_collection):
+        backend = MongoSearchBackend(EmailRepository())
+
+    documents, has_more = asyncio.run(backend.search("invoice", mailbox="me", offset=4, limit=2))
+
+    query, projection = async_collection.find.call_args.args
+    assert query == {"$text": {"$search": "invoice"}, "mailbox": "me"}
+    assert projection["score"] == {"$meta": "textScore"} and projection["body"] == 0
+    assert cursor.sort.call_args.args[0][0] == ("score", {"$meta": "textScore"})
+    cursor.skip.assert_called_once_with(4)
+    cursor.limit.assert_called_once_with(3)
+    assert len(documents) == 2 and has_more is True
@@ -0,0 +1,108 @@
+import asyncio
+import json
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+from unittest.mock import AsyncMock, Mock, patch
+
+from app.services.graph_client import GraphClient
+from app.services.subscription_service import SubscriptionService
+from config import settings
+
+class MockGraph:
+    """Local mock Graph server: answers with queued responses and records requests"""
+    def __init__(self):
+        self.responses = []
+        self.requests = []
+
+    def handler(self, request):
+        self.requests.append(request)
+        return self.responses.pop(0)
+
+@pytest.fixture
+def mock_graph():
+    return MockGraph()
+
+@pytest.fixture
+def subscription_service(mock_graph):
+    with patch("app.services.subscription_service.SubscriptionRepository") as MockRepository, \
+            patch.object(settings, "GRAPH_API_BASE_URL", "https://graph.test/v1.0"), \
+            patch.object(settings, "WEBHOOK_NOTIFICATION_URL", "https://app.test/notifications"), \
+            patch.object(settings, "WEBHOOK_CLIENT_STATE", "secret"):
+        service = SubscriptionService(graph_client=GraphClient(transport=httpx.MockTransport(mock_graph.handler)))
+        repository = MockRepository.return_value
+        for method in ("get_subscription_async", "save_subscription_async", "delete_subscription_async"):
+            setattr(repository, method, AsyncMock())
+        service.token_service = Mock()
+        service.token_service.get_access_token_async = AsyncMock(return_value="mock_token")
+        yield service
+
+def test_creates_subscription_for_new_mailbox(subscription_service, mock_graph):
+    subscription_service.subscription_repository.get_subscription_async.return_value = None
+    mock_graph.responses.append(httpx.Response(201, json={"id": "sub-1"}))
+
+    asyncio.run(subscription_service.ensure_subscription("a@x.com"))
+
+    request = mock_graph.requests[0]
+    body = json.loads(request.content)
+    assert request.method == "POST" and str(request.url) == "https://graph.test/v1.0/subscriptions"
+    assert body["resource"] == "users/a@x.com/mailFolders('inbox')/messages"
+    assert body["changeType"] == "created" and body["clientState"] == "secret"
+    assert body["notificationUrl"] == "https://app.test/notifications"
+    mailbox, subscription_id, _ = subscription_service.subscription_repository.save_subscription_async.call_args[0]
+    assert (mailbox, subscription_id) == ("a@x.com", "sub-1")
+
+def test_keeps_subscription_far_from_expiry(subscription_service, mock_graph):
+    subscription_service.subscription_repository.get_subscription_async.return_value = {
+        "_id": "me", "subscription_id": "sub-1", "expiration_datetime": datetime.utcnow() + timedelta(days=2)
+    }
+
+    asyncio.run(subscription_service.ensure_subscription("me"))
+
+    assert mock_graph.requests == []
+
+def test_renews_expiring_subscription(subscription_service, mock_graph):
+    subscription_service.subscription_repository.get_subscription_async.return_value = {
+        "_id": "me", "subscription_id": "sub-1", "expiration_datetime": datetime.utcnow() + timedelta(minutes=5)
+    }
+    mock_graph.responses.append(httpx.Response(200, json={"id": "sub-1"}))
+
+    asyncio.run(subscription_service.ensure_subscription("me"))
+
+    request = mock_graph.requests[0]
+    assert request.method == "PATCH" and str(request.url) == "https://graph.test/v1.0/subscriptions/sub-1"
+    subscription_service.subscription_repository.save_subscription_async.assert_called_once()
+
+def test_recreates_subscription_removed_by_graph(subscription_service, mock_graph):
+    subscription_service.subscription_repository.get_subscription_async.return_value = {
+        "_id": "me", "subscription_id": "sub-1", "expiration_datetime": datetime.utcnow()
+    }
+    mock_graph.responses.extend([httpx.Response(404), httpx.Response(201, json={"id": "sub-2"})])
+
+    asyncio.run(subscription_service.ensure_subscription("me"))
+
+    assert [request.method for request in mock_graph.requests] == ["PATCH", "POST"]
+    assert json.loads(mock_graph.requests[1].content)["resource"] == "me/mailFolders('inbox')/messages"
+    assert subscription_service.subscription_repository.save_subscription_async.call_args[0][1] == "sub-2"
+
+def test_refuses_to_subscribe_without_a_client_state_secret(subscription_service, mock_graph):
+    subscription_service.subscription_repository.get_subscription_async.return_value = None
+
+    with patch.object(settings, "WEBHOOK_CLIENT_STATE", ""), pytest.raises(ValueError):
+        asyncio.run(subscription_service.ensure_subscription("me"))
+
+    assert mock_graph.requests == []
+
+def test_removes_subscription_of_disabled_mailbox(subscription_service, mock_graph):
+    subscription_service.subscription_repository.get_subscription_async.side_effect = \
+        lambda mailbox: {"_id": mailbox, "subscription_id": f"sub-{mailbox}"} if mailbox != "c@x.com" else None
+    mock_graph.responses.extend([httpx.Response(204), httpx.Response(404)])
+
+    asyncio.run(subscription_service.remove_subscriptions(["a@x.com", "b@x.com", "c@x.com"]))
+
+    assert [(request.method, request.url.path) for request in mock_graph.requests] == [
+        ("DELETE", "/v1.0/subscriptions/sub-a@x.com"), ("DELETE", "/v1.0/subscriptions/sub-b@x.com")
+    ]
+    deleted = [c.args[0] for c in subscription_service.subscription_repository.delete_subscription_async.call_args_list]
+    assert deleted == ["a@x.com", "b@x.com"]
@@ -0,0 +1,145 @@
+import asyncio
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from unittest.mock import Mock, patch
+
+from app.services.token_service import TokenCache
+from app.services.token_store import InMemoryTokenStore
+from config import settings
+
+def _token_response(access_token="new_access", refresh_token="new_refresh", expires_in=3600, delay=0.0):
+    def post(*args, **kwargs):
+        time.sleep(delay)
+        response = Mock()
+        response.status_code = 200
+        response.json.return_value = {"access_token": access_token, "refresh_token": refresh_token, "expires_in": expires_in}
+        return response
+    return post
+
+@pytest.fixture
+def expired_cache():
+    cache = TokenCache(store=InMemoryTokenStore())
+    cache.set_tokens("old_access", -1, "old_refresh")
+    return cache
+
+@patch('app.services.token_service.httpx.post')
+def test_get_access_token_returns_refreshed_token(mock_post, expired_cache):
+    mock_post.side_effect = _token_response()
+
+    assert expired_cache.get_access_token() == "new_access"
+    assert expired_cache.refresh_token == "new_refresh"
+
+@patch('app.services.token_service.httpx.post')
+def test_concurrent_callers_share_one_refresh(mock_post, expired_cache):
+    mock_post.side_effect = _token_response(delay=0.1)
+    tokens = []
+
+    threads = [threading.Thread(target=lambda: tokens.append(expired_cache.get_access_token())) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert tokens == ["new_access"] * 10
+    assert mock_post.call_count == 1
+
+@patch('app.services.token_service.httpx.AsyncClient.post')
+def test_async_callers_share_one_refresh_without_blocking_the_loop(mock_post, expired_cache):
+    post = _token_response()
+
+    async def slow_post(*args, **kwargs):
+        await asyncio.sleep(0.1)
+        return post()
+    mock_post.side_effect = slow_post
+    ticks = []
+
+    async def ticker():
+        for _ in range(20):
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.01)
+
+    async def run():
+        results = await asyncio.gather(*[expired_cache.get_access_token_async() for _ in range(10)])
+        return results, time.monotonic()
+
+    async def run_with_ticker():
+        tick_task = asyncio.create_task(ticker())
+        results = await run()
+        await tick_task
+        return results
+
+    tokens, refreshed_at = asyncio.run(run_with_ticker())
+
+    assert tokens == ["new_access"] * 10
+    assert mock_post.call_count == 1
+    # The loop kept running while the token endpoint was answering
+    assert len([tick for tick in ticks if tick < refreshed_at]) >= 5
+
+@patch('app.services.token_service.httpx.AsyncClient.post')
+def test_async_caller_waits_for_the_refresh_of_another_worker(mock_post, expired_cache):
+    record = expired_cache.store.load()
+    expired_cache.store.try_acquire_refresh(record["version"], "other-worker", 30)
+    expiry = datetime.utcnow() + timedelta(hours=1)
+
+    async def other_worker():
+        await asyncio.sleep(0.05)
+        expired_cache.store.complete_refresh(record["version"], "other-worker", "their_access", "their_refresh", expiry)
+
+    async def run():
+        token, _ = await asyncio.gather(expired_cache.get_access_token_async(), other_worker())
+        return token
+
+    with patch.object(settings, "TOKEN_STORE_POLL_INTERVAL", 0.01):
+        assert asyncio.run(run()) == "their_access"
+    mock_post.assert_not_called()
+
+@patch('app.services.token_service.httpx.post')
+def test_waiters_share_a_failed_refresh(mock_post, expired_cache):
+    def failing_post(*args, **kwargs):
+        time.sleep(0.1)
+        return Mock(status_code=400)
+    mock_post.side_effect = failing_post
+    errors = []
+
+    def get_token():
+        try:
+            expired_cache.get_access_token()
+        except Exception as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=get_token) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == ["Failed to refresh token. Re-authentication needed."] * 5
+    assert mock_post.call_count == 1
+
+@patch('app.services.token_service.httpx.post')
+def test_refresh_if_expiring_renews_within_skew(mock_post):
+    mock_post.side_effect = _token_response()
+    cache = TokenCache(store=InMemoryTokenStore())
+    cache.set_tokens("old_access", settings.TOKEN_REFRESH_SKEW - 10, "old_refresh")
+
+    cache.refresh_if_expiring()
+
+    assert cache.access_token == "new_access"
+
+@patch('app.services.token_service.httpx.post')
+def test_refresh_if_expiring_keeps_fresh_token(mock_post):
+    cache = TokenCache(store=InMemoryTokenStore())
+    cache.set_tokens("access", settings.TOKEN_REFRESH_SKEW + 600, "refresh")
+
+    cache.refresh_if_expiring()
+
+    mock_post.assert_not_called()
+    assert cache.get_access_token() == "access"
+
+def test_get_access_token_without_refresh_token():
+    with pytest.raises(Exception) as exc_info:
+        TokenCache(store=InMemoryTokenStore()).get_access_token()
+    assert "No refresh token available" in str(exc_info.value)
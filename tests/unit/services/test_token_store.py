@@ -0,0 +1,98 @@
+import asyncio
+import threading
+import time
+from datetime import datetime, timedelta
+
+import mongomock
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+from unittest.mock import Mock, patch
+
+from app.services.token_service import TokenCache
+from app.services.token_store import InMemoryTokenStore, MongoTokenStore
+
+@pytest.fixture
+def token_collection():
+    return mongomock.MongoClient().db.tokens
+
+@pytest.fixture(params=["memory", "mongo"])
+def token_store(request, token_collection):
+    if request.param == "memory":
+        return InMemoryTokenStore()
+    return MongoTokenStore(collection=token_collection, key="default")
+
+def test_refresh_lease_is_taken_once_per_version(token_store):
+    record = token_store.save("access", "refresh", datetime.utcnow())
+
+    assert token_store.try_acquire_refresh(record["version"], "worker-1", 30) is True
+    assert token_store.try_acquire_refresh(record["version"], "worker-2", 30) is False
+
+def test_complete_refresh_bumps_version_for_lease_owner_only(token_store):
+    record = token_store.save("access", "refresh", datetime.utcnow())
+    token_store.try_acquire_refresh(record["version"], "worker-1", 30)
+    expiry = datetime.utcnow() + timedelta(hours=1)
+
+    assert token_store.complete_refresh(record["version"], "worker-2", "stolen", "refresh", expiry) is None
+    refreshed = token_store.complete_refresh(record["version"], "worker-1", "new_access", "new_refresh", expiry)
+
+    assert refreshed["access_token"] == "new_access"
+    assert refreshed["version"] == record["version"] + 1
+    assert refreshed["refresh_owner"] is None
+
+def test_expired_lease_can_be_taken_over(token_store):
+    record = token_store.save("access", "refresh", datetime.utcnow())
+    token_store.try_acquire_refresh(record["version"], "crashed-worker", -1)
+
+    assert token_store.try_acquire_refresh(record["version"], "worker-2", 30) is True
+
+def test_released_lease_can_be_taken_again(token_store):
+    record = token_store.save("access", "refresh", datetime.utcnow())
+    token_store.try_acquire_refresh(record["version"], "worker-1", 30)
+    token_store.release_refresh("worker-1")
+
+    assert token_store.try_acquire_refresh(record["version"], "worker-2", 30) is True
+
+def test_async_refresh_operations():
+    store = MongoTokenStore(collection=mongomock.MongoClient().db.tokens, key="default",
+                            async_collection=AsyncMongoMockClient()["db"]["tokens"])
+    expiry = datetime.utcnow() + timedelta(hours=1)
+
+    async def run():
+        await store.async_collection.insert_one(
+            {"_id": "default", "access_token": "access", "refresh_token": "refresh", "version": 1,
+             "refresh_owner": None, "refresh_lease_until": None}
+        )
+        taken = [await store.try_acquire_refresh_async(1, owner, 30) for owner in ("worker-1", "worker-2")]
+        await store.release_refresh_async("worker-1")
+        retaken = await store.try_acquire_refresh_async(1, "worker-2", 30)
+        stolen = await store.complete_refresh_async(1, "worker-1", "stolen", "refresh", expiry)
+        return taken, retaken, stolen, await store.complete_refresh_async(1, "worker-2", "new_access", "new_refresh", expiry)
+
+    taken, retaken, stolen, refreshed = asyncio.run(run())
+
+    assert taken == [True, False] and retaken is True
+    assert stolen is None
+    assert refreshed["access_token"] == "new_access" and refreshed["version"] == 2
+
+@patch('app.services.token_service.httpx.post')
+def test_workers_sharing_a_store_refresh_once(mock_post, token_collection):
+    def post(*args, **kwargs):
+        time.sleep(0.1)
+        return Mock(status_code=200, json=Mock(return_value={
+            "access_token": "new_access", "refresh_token": "new_refresh", "expires_in": 3600
+        }))
+    mock_post.side_effect = post
+
+    # One worker logs in, the others only share the store
+    workers = [TokenCache(store=MongoTokenStore(collection=token_collection, key="default")) for _ in range(4)]
+    workers[0].set_tokens("old_access", -1, "old_refresh")
+    tokens = []
+
+    threads = [threading.Thread(target=lambda w=w: tokens.append(w.get_access_token())) for w in workers for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert tokens == ["new_access"] * 12
+    assert mock_post.call_count == 1
@@ -0,0 +1,65 @@
+import logging
+
+import pytest
+from unittest.mock import patch
+
+from app.backends import create_backend, lazy_attribute
+from app.schedulers.coordination import (
+    InMemoryReplicaRegistry, MongoReplicaRegistry, ReplicaRegistry, create_replica_registry
+)
+from app.services.attachment_store import (
+    AttachmentBlobStore, GridFSAttachmentStore, LocalDiskAttachmentStore, create_attachment_store
+)
+from app.services.response_cache import CacheBackend, InMemoryCacheBackend, create_response_cache
+from app.services.search_backend import InMemorySearchBackend, MongoSearchBackend, SearchBackend
+from app.services.token_store import InMemoryTokenStore, TokenStore
+from config import settings
+
+def test_create_backend_falls_back_to_the_default_with_a_warning(caplog):
+    factories = {"memory": InMemoryTokenStore, "mongo": lambda: "mongo"}
+
+    with caplog.at_level(logging.WARNING, logger="app.backends"):
+        selected = create_backend("TOKEN_STORE_BACKEND", "mongo", factories, default="memory")
+        fallback = create_backend("TOKEN_STORE_BACKEND", "redis", factories, default="memory")
+
+    assert selected == "mongo"
+    assert isinstance(fallback, InMemoryTokenStore)
+    assert caplog.messages == ["Unknown TOKEN_STORE_BACKEND 'redis', using 'memory'"]
+
+def test_lazy_attribute_is_created_once_unless_given():
+    created = []
+
+    class Backend:
+        collection = lazy_attribute(lambda: created.append(1) or object())
+
+        def __init__(self, collection=None):
+            self._collection = collection
+
+    given = object()
+    backend = Backend()
+
+    assert backend.collection is backend.collection
+    assert len(created) == 1
+    assert Backend(given).collection is given and len(created) == 1
+
+def test_backend_interfaces_are_abstract():
+    for interface in (SearchBackend, TokenStore, AttachmentBlobStore, ReplicaRegistry, CacheBackend):
+        with pytest.raises(TypeError):
+            interface()
+    assert isinstance(MongoSearchBackend(), SearchBackend) and isinstance(InMemorySearchBackend(), SearchBackend)
+
+def test_attachment_store_is_selected_by_name():
+    assert isinstance(create_attachment_store("disk"), LocalDiskAttachmentStore)
+    assert isinstance(create_attachment_store("s3"), GridFSAttachmentStore)
+
+def test_replica_registry_is_selected_by_scheduler_coordination():
+    with patch.object(settings, "SCHEDULER_COORDINATION", "mongo"):
+        assert isinstance(create_replica_registry(), MongoReplicaRegistry)
+    with patch.object(settings, "SCHEDULER_COORDINATION", "zookeeper"):
+        assert isinstance(create_replica_registry(), InMemoryReplicaRegistry)
+
+def test_response_cache_backend_can_be_disabled():
+    with patch.object(settings, "RESPONSE_CACHE_BACKEND", "none"):
+        assert create_response_cache().backend is None
+    with patch.object(settings, "RESPONSE_CACHE_BACKEND", "redis"):
+        assert isinstance(create_response_cache().backend, InMemoryCacheBackend)
@@ -0,0 +1,54 @@
+import asyncio
+
+from unittest.mock import patch
+
+from app.dependencies import Container
+
+@patch("app.dependencies.shared_search_backend")
+@patch("app.dependencies.OutboundAttachmentStore")
+@patch("app.dependencies.AttachmentService")
+@patch("app.dependencies.AttachmentRepository")
+@patch("app.dependencies.SyncStateRepository")
+@patch("app.dependencies.EmailService")
+@patch("app.dependencies.EmailRepository")
+def test_container_builds_each_instance_once(MockRepository, MockService, MockSyncState, MockAttachmentRepository,
+                                             MockAttachmentService, MockOutboundAttachments, mock_search_backend):
+    container = Container()
+
+    assert container.email_service is container.email_service
+    assert container.email_repository is container.email_repository
+    MockRepository.assert_called_once_with()
+    # The service reuses the shared repositories, stores and Graph client
+    MockService.assert_called_once_with(
+        container.graph_client, MockRepository.return_value,
+        sync_state_repository=MockSyncState.return_value,
+        search_backend=mock_search_backend.return_value,
+        attachment_service=MockAttachmentService.return_value,
+        outbound_attachments=MockOutboundAttachments.return_value
+    )
+    MockAttachmentService.assert_called_once_with(
+        container.graph_client, attachment_repository=MockAttachmentRepository.return_value
+    )
+
+def test_container_hands_out_the_shared_workers():
+    from app.schedulers.scheduler import mailbox_scheduler
+    from app.workers.notification_worker import notification_worker
+    from app.workers.send_worker import send_worker_pool
+
+    container = Container()
+
+    assert container.send_worker_pool is send_worker_pool
+    assert container.notification_worker is notification_worker
+    assert container.mailbox_scheduler is mailbox_scheduler
+
+@patch("app.dependencies.close_graph_client")
+@patch("app.dependencies.MailboxRepository")
+def test_close_releases_instances(MockRepository, mock_close_graph_client):
+    container = Container()
+    first = container.mailbox_repository
+
+    asyncio.run(container.close())
+    MockRepository.return_value = object()
+
+    mock_close_graph_client.assert_awaited_once()
+    assert container.mailbox_repository is not first
@@ -0,0 +1,135 @@
+import asyncio
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock, Mock, patch
+
+import httpx
+import pytest
+from apscheduler.events import EVENT_JOB_EXECUTED, EVENT_JOB_MAX_INSTANCES, EVENT_JOB_SUBMITTED
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY, CollectorRegistry
+
+from app.api.routes import router
+from app.metrics import MetricsMiddleware, MongoWriteTimer, RuntimeCollector, graph_endpoint
+from app.schedulers.scheduler import MailboxScheduler, job_kind
+from app.services.graph_client import GraphClient
+from app.workers.send_worker import SendWorkerPool
+from config import settings
+
+def _sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+def test_graph_endpoint_replaces_ids():
+    assert graph_endpoint("https://graph.microsoft.com/v1.0/me/messages?$top=50") == "/me/messages"
+    assert graph_endpoint("https://graph.microsoft.com/v1.0/users/a@test.com/messages/AAMk=/attachments/AAMk1=/$value") \
+        == "/users/{id}/messages/{id}/attachments/{id}/$value"
+    assert graph_endpoint("https://graph.microsoft.com/v1.0/users/a@test.com/mailFolders/inbox/messages/delta") \
+        == "/users/{id}/mailFolders/inbox/messages/delta"
+    assert graph_endpoint("https://graph.microsoft.com/v1.0/me/messages/AAMk=/attachments/createUploadSession") \
+        == "/me/messages/{id}/attachments/createUploadSession"
+
+def test_graph_endpoint_of_upload_session_urls():
+    assert graph_endpoint("https://outlook.office.com/api/v2.0/Users('x')/Messages('y')/AttachmentSessions('z')?authtoken=t") \
+        == "upload_session"
+    assert graph_endpoint("https://upload.test/session1") == "upload_session"
+
+def test_graph_requests_are_timed_per_attempt():
+    responses = [httpx.Response(429, headers={"Retry-After": "0"}), httpx.Response(200, json={"value": []})]
+    client = GraphClient(transport=httpx.MockTransport(lambda request: responses.pop(0)))
+    labels = {"method": "GET", "endpoint": "/users/{id}/messages"}
+    throttled = _sample("graph_request_duration_seconds_count", status="429", **labels)
+    succeeded = _sample("graph_request_duration_seconds_count", status="200", **labels)
+
+    with patch.object(settings, "GRAPH_BACKOFF_BASE", 0.001):
+        asyncio.run(client.get("https://graph.test/users/a@test.com/messages"))
+
+    assert _sample("graph_request_duration_seconds_count", status="429", **labels) == throttled + 1
+    assert _sample("graph_request_duration_seconds_count", status="200", **labels) == succeeded + 1
+    assert _sample("graph_requests_in_flight") == 0
+
+def test_mongo_write_timer_records_batch_size():
+    count = _sample("mongo_write_batch_size_count", operation="test_write")
+
+    with MongoWriteTimer("test_write", 42):
+        pass
+
+    assert _sample("mongo_write_batch_size_count", operation="test_write") == count + 1
+    assert _sample("mongo_write_batch_size_sum", operation="test_write") >= 42
+
+def test_middleware_labels_requests_by_route_template():
+    app = FastAPI()
+
+    @app.get("/items/{item_id}")
+    def get_item(item_id: str):
+        return {"id": item_id}
+
+    app.add_middleware(MetricsMiddleware)
+    labels = {"method": "GET", "route": "/items/{item_id}", "status": "200"}
+    count = _sample("http_request_duration_seconds_count", **labels)
+
+    client = TestClient(app)
+    client.get("/items/1")
+    client.get("/items/2")
+
+    assert _sample("http_request_duration_seconds_count", **labels) == count + 2
+
+def test_metrics_route():
+    app = FastAPI()
+    app.include_router(router)
+    client = TestClient(app)
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "graph_request_duration_seconds" in response.text
+
+    with patch.object(settings, "METRICS_ENABLED", False):
+        assert client.get("/metrics").status_code == 404
+
+def test_runtime_collector_reads_in_memory_state():
+    client = GraphClient()
+    client.stats.retries = 2
+    with patch("app.workers.notification_worker.notification_worker") as worker, \
+            patch("app.dependencies.get_graph_client", return_value=client):
+        worker.queue_depth = 7
+        metrics = {metric.name: metric for metric in RuntimeCollector().collect()}
+
+    assert "outbound_queue_depth" not in metrics
+    assert metrics["notification_queue_depth"].samples[0].value == 7
+    assert metrics["graph_retries"].samples[0].value == 2
+
+def test_send_workers_set_the_outbound_queue_depth():
+    pool = SendWorkerPool(worker_count=1)
+    pool.outbound_repository = Mock()
+    pool.outbound_repository.queue_depths_async = AsyncMock(return_value={"pending": 3, "in_flight": 1})
+
+    asyncio.run(pool.refresh_queue_depth())
+
+    assert _sample("outbound_queue_depth", status="pending") == 3
+    assert _sample("outbound_queue_depth", status="in_flight") == 1
+
+def test_scheduler_records_lag_duration_and_overlaps():
+    mailbox_scheduler = MailboxScheduler()
+    job_id = "retrieve_emails:a@test.com"
+    assert job_kind(job_id) == "retrieve_emails"
+    lag_count = _sample("scheduler_job_lag_seconds_count", job="retrieve_emails")
+    duration_count = _sample("scheduler_job_duration_seconds_count", job="retrieve_emails")
+    overlaps = _sample("scheduler_job_overlaps_total", job="retrieve_emails")
+    scheduled = datetime.now(mailbox_scheduler.scheduler.timezone) - timedelta(seconds=2)
+
+    mailbox_scheduler.record_job_event(Mock(code=EVENT_JOB_SUBMITTED, job_id=job_id, scheduled_run_times=[scheduled]))
+    assert _sample("scheduler_jobs_running", job="retrieve_emails") == 1
+    mailbox_scheduler.record_job_event(Mock(code=EVENT_JOB_MAX_INSTANCES, job_id=job_id))
+    mailbox_scheduler.record_job_event(Mock(code=EVENT_JOB_EXECUTED, job_id=job_id))
+
+    assert _sample("scheduler_job_lag_seconds_count", job="retrieve_emails") == lag_count + 1
+    assert _sample("scheduler_job_duration_seconds_count", job="retrieve_emails") == duration_count + 1
+    assert _sample("scheduler_job_overlaps_total", job="retrieve_emails") == overlaps + 1
+    assert _sample("scheduler_jobs_running", job="retrieve_emails") == 0
+
+def test_registering_runtime_collector_does_not_collect():
+    registry = CollectorRegistry()
+    with patch.object(RuntimeCollector, "collect") as collect:
+        registry.register(RuntimeCollector())
+
+    collect.assert_not_called()
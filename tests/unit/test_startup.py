@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from unittest.mock import AsyncMock, Mock, patch
+
+from app.api.routes import router
+from app.startup import start_services, startup_state
+from config import settings
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(router)
+    return TestClient(app)
+
+@pytest.fixture(autouse=True)
+def reset_state():
+    startup_state.reset()
+    yield
+    startup_state.reset()
+
+@pytest.fixture
+def services():
+    with patch("app.startup.token_cache") as token_cache, \
+            patch("app.startup.start_scheduler") as start_scheduler, \
+            patch("app.startup.start_send_workers") as start_send_workers, \
+            patch("app.startup.start_notification_worker") as start_notification_worker, \
+            patch("app.startup.ensure_indexes") as ensure_indexes:
+        yield Mock(token_cache=token_cache, start_scheduler=start_scheduler, start_send_workers=start_send_workers,
+                   start_notification_worker=start_notification_worker, ensure_indexes=ensure_indexes)
+
+def test_start_services_waits_for_mongo_then_starts_everything(services):
+    mongo = Mock()
+    mongo.admin.command = AsyncMock(side_effect=[Exception("connection refused"), {"ok": 1}])
+
+    with patch("app.startup.get_async_mongo_client", return_value=mongo), \
+            patch.object(settings, "MONGODB_STARTUP_RETRY_INTERVAL", 0.01):
+        asyncio.run(start_services())
+
+    assert mongo.admin.command.await_count == 2
+    services.ensure_indexes.assert_called_once()
+    services.token_cache.start_background_refresh.assert_called_once()
+    services.start_scheduler.assert_called_once()
+    services.start_send_workers.assert_called_once()
+    services.start_notification_worker.assert_called_once()
+    assert startup_state.ready and startup_state.indexes_ready
+    assert startup_state.error is None
+
+def test_failed_index_creation_does_not_block_readiness(services):
+    services.ensure_indexes.side_effect = Exception("index build failed")
+    mongo = Mock()
+    mongo.admin.command = AsyncMock(return_value={"ok": 1})
+
+    with patch("app.startup.get_async_mongo_client", return_value=mongo):
+        asyncio.run(start_services())
+
+    assert startup_state.ready
+    assert startup_state.indexes_ready is False
+
+def test_healthz_and_readyz(client):
+    assert client.get("/healthz").json() == {"status": "ok"}
+    startup_state.error = "connection refused"
+
+    starting = client.get("/readyz")
+    startup_state.mongo_ready = startup_state.services_started = True
+    ready = client.get("/readyz")
+
+    assert starting.status_code == 503
+    assert starting.json()["error"] == "connection refused"
+    assert ready.status_code == 200
+    assert ready.json()["checks"] == {"mongo": True, "indexes": False, "services": True}
@@ -0,0 +1,126 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from unittest.mock import AsyncMock, Mock, patch
+
+from app.api.routes import router
+from app.dependencies import get_notification_worker
+from app.workers.notification_worker import NotificationWorker
+from config import settings
+
+def notification(subscription_id="sub-1", email_id="m1", client_state="secret"):
+    """Change notification as sent by Microsoft Graph"""
+    return {
+        "subscriptionId": subscription_id,
+        "clientState": client_state,
+        "changeType": "created",
+        "resource": f"Users/u/Messages/{email_id}",
+        "resourceData": {"@odata.type": "#Microsoft.Graph.Message", "id": email_id}
+    }
+
+@pytest.fixture
+def mock_worker():
+    return Mock()
+
+@pytest.fixture
+def client(mock_worker):
+    app = FastAPI()
+    app.include_router(router)
+    app.dependency_overrides[get_notification_worker] = lambda: mock_worker
+    with patch.object(settings, "WEBHOOK_CLIENT_STATE", "secret"):
+        yield TestClient(app)
+
+@pytest.fixture
+def worker():
+    worker = NotificationWorker()
+    worker.subscription_repository = Mock()
+    worker.subscription_repository.get_by_subscription_id_async = AsyncMock(
+        side_effect=lambda subscription_id: {"_id": {"sub-1": "a@x.com", "sub-2": "b@x.com"}[subscription_id],
+                                             "expiration_datetime": datetime.utcnow() + timedelta(hours=1)}
+    )
+    worker.email_service = Mock()
+    worker.email_service.fetch_emails = AsyncMock()
+    return worker
+
+def test_validation_token_is_echoed(client):
+    response = client.post("/notifications?validationToken=abc%20123")
+
+    assert response.status_code == 200
+    assert response.text == "abc 123"
+    assert response.headers["content-type"].startswith("text/plain")
+
+def test_notifications_are_queued(mock_worker, client):
+    mock_worker.enqueue.return_value = True
+
+    response = client.post("/notifications", json={"value": [notification(email_id="m1"), notification(email_id="m2")]})
+
+    assert response.status_code == 202
+    assert [c.args for c in mock_worker.enqueue.call_args_list] == [("sub-1", "m1"), ("sub-1", "m2")]
+
+def test_notifications_with_wrong_client_state_are_ignored(mock_worker, client):
+    response = client.post("/notifications", json={"value": [notification(client_state="forged")]})
+
+    assert response.status_code == 202
+    mock_worker.enqueue.assert_not_called()
+
+def test_notifications_are_refused_without_a_client_state_secret(mock_worker, client):
+    with patch.object(settings, "WEBHOOK_CLIENT_STATE", ""):
+        handshake = client.post("/notifications?validationToken=abc")
+        forged = client.post("/notifications", json={"value": [notification(client_state="")]})
+
+    assert handshake.status_code == 403 and forged.status_code == 403
+    mock_worker.enqueue.assert_not_called()
+
+def test_full_queue_asks_graph_to_redeliver(mock_worker, client):
+    mock_worker.enqueue.return_value = False
+
+    response = client.post("/notifications", json={"value": [notification()]})
+
+    assert response.status_code == 503
+
+def test_process_fetches_once_per_mailbox(worker):
+    asyncio.run(worker.process([("sub-1", "m1"), ("sub-2", "m2"), ("sub-1", "m3"), ("sub-1", "m4")]))
+
+    assert sorted(c.args for c in worker.email_service.fetch_emails.await_args_list) == [
+        ("a@x.com", ["m1", "m3", "m4"]), ("b@x.com", ["m2"])
+    ]
+    # Subscriptions are resolved once and then served from the cache
+    assert worker.subscription_repository.get_by_subscription_id_async.await_count == 2
+
+def test_expired_subscriptions_are_evicted_and_looked_up_again(worker):
+    asyncio.run(worker.process([("sub-1", "m1"), ("sub-2", "m2")]))
+    worker._mailboxes["sub-1"] = ("a@x.com", datetime.utcnow() - timedelta(seconds=1))
+    worker._mailboxes["sub-2"] = ("b@x.com", datetime.utcnow() - timedelta(seconds=1))
+
+    asyncio.run(worker.process([("sub-1", "m3")]))
+
+    assert set(worker._mailboxes) == {"sub-1"}
+    assert worker.subscription_repository.get_by_subscription_id_async.await_count == 3
+    worker.email_service.fetch_emails.assert_awaited_with("a@x.com", ["m3"])
+
+@patch.object(settings, "WEBHOOK_BATCH_WAIT", 0.05)
+def test_burst_of_notifications_is_fetched_in_one_batch(worker):
+    async def scenario():
+        worker.start()
+        for i in range(5):
+            assert worker.enqueue("sub-1", f"m{i}")
+        await asyncio.sleep(0.2)
+        await worker.stop()
+
+    asyncio.run(scenario())
+
+    worker.email_service.fetch_emails.assert_awaited_once_with("a@x.com", [f"m{i}" for i in range(5)])
+
+def test_enqueue_rejects_when_full(worker):
+    async def scenario():
+        with patch.object(settings, "WEBHOOK_QUEUE_MAX_SIZE", 1), patch.object(settings, "WEBHOOK_BATCH_WAIT", 10):
+            worker.start()
+            worker._task.cancel()
+            accepted = [worker.enqueue("sub-1", "m1"), worker.enqueue("sub-1", "m2")]
+            await worker.stop()
+            return accepted
+
+    assert asyncio.run(scenario()) == [True, False]
@@ -0,0 +1,148 @@
+import asyncio
+
+import pytest
+from bson import ObjectId
+from unittest.mock import AsyncMock, Mock, patch
+
+from app.exceptions import GraphAPIError
+from app.workers.send_worker import SendWorkerPool
+from config import settings
+
+QUEUED_REQUEST = {"to_recipients": ["test@example.com"], "subject": "Subject", "body": "Body"}
+
+@pytest.fixture
+def worker_pool():
+    pool = SendWorkerPool(worker_count=1)
+    pool.outbound_repository = AsyncMock()
+    pool.outbound_repository.queue_depths_async.return_value = {"pending": 0, "in_flight": 0}
+    pool.email_service = Mock()
+    pool.email_service.send_email = AsyncMock(return_value="email_sent_successfully")
+    return pool
+
+def test_process_next_sends_and_marks_sent(worker_pool):
+    queue_id = ObjectId()
+    worker_pool.outbound_repository.claim_next_async.return_value = {"_id": queue_id, "request": QUEUED_REQUEST, "attempts": 1}
+
+    assert asyncio.run(worker_pool.process_next()) is True
+
+    worker_pool.email_service.send_email.assert_awaited_once()
+    worker_pool.outbound_repository.mark_sent_async.assert_awaited_once_with(queue_id)
+
+def test_process_next_with_empty_queue(worker_pool):
+    worker_pool.outbound_repository.claim_next_async.return_value = None
+
+    assert asyncio.run(worker_pool.process_next()) is False
+    worker_pool.email_service.send_email.assert_not_called()
+
+@patch.object(settings, "SEND_MAX_ATTEMPTS", 2)
+def test_process_next_retries_until_max_attempts(worker_pool):
+    queue_id = ObjectId()
+    worker_pool.email_service.send_email.side_effect = Exception("Failed to send email: 500")
+
+    worker_pool.outbound_repository.claim_next_async.return_value = {"_id": queue_id, "request": QUEUED_REQUEST, "attempts": 1}
+    asyncio.run(worker_pool.process_next())
+    worker_pool.outbound_repository.claim_next_async.return_value = {"_id": queue_id, "request": QUEUED_REQUEST, "attempts": 2}
+    asyncio.run(worker_pool.process_next())
+
+    retries = [c.kwargs["retry"] for c in worker_pool.outbound_repository.mark_failed_async.call_args_list]
+    assert retries == [True, False]
+
+@patch.object(settings, "SEND_MAX_ATTEMPTS", 5)
+@patch.object(settings, "SEND_RETRY_BASE_DELAY", 5)
+@patch.object(settings, "SEND_RETRY_MAX_DELAY", 30)
+def test_process_next_backs_off_exponentially(worker_pool):
+    delays = []
+    for attempts, error in [(1, Exception("timeout")), (2, Exception("timeout")), (4, Exception("timeout")),
+                            (1, GraphAPIError("Throttled", 429, retry_after=12))]:
+        worker_pool.email_service.send_email.side_effect = error
+        worker_pool.outbound_repository.claim_next_async.return_value = {
+            "_id": ObjectId(), "request": QUEUED_REQUEST, "attempts": attempts
+        }
+        asyncio.run(worker_pool.process_next())
+        delays.append(worker_pool.outbound_repository.mark_failed_async.call_args.kwargs["retry_delay"])
+
+    assert delays == [5, 10, 30, 12]
+
+def test_process_next_fails_permanent_graph_errors_at_once(worker_pool):
+    worker_pool.outbound_repository.claim_next_async.return_value = {"_id": ObjectId(), "request": QUEUED_REQUEST, "attempts": 1}
+    worker_pool.email_service.send_email.side_effect = GraphAPIError("Failed to send email: invalid recipient", 400)
+
+    asyncio.run(worker_pool.process_next())
+
+    assert worker_pool.outbound_repository.mark_failed_async.call_args.kwargs["retry"] is False
+
+def test_process_next_fails_content_that_is_not_base64_at_once(worker_pool):
+    attachment = {"name": "a.txt", "content_bytes": "not base64!"}
+    worker_pool.outbound_repository.claim_next_async.return_value = {
+        "_id": ObjectId(), "request": dict(QUEUED_REQUEST, attachments=[attachment]), "attempts": 1
+    }
+
+    asyncio.run(worker_pool.process_next())
+
+    worker_pool.email_service.send_email.assert_not_called()
+    assert worker_pool.outbound_repository.mark_failed_async.call_args.kwargs["retry"] is False
+
+@patch.object(settings, "SEND_MAX_ATTEMPTS", 2)
+def test_process_next_fails_email_reclaimed_after_its_last_attempt(worker_pool):
+    queue_id = ObjectId()
+    worker_pool.outbound_repository.claim_next_async.return_value = {"_id": queue_id, "request": QUEUED_REQUEST, "attempts": 3}
+
+    assert asyncio.run(worker_pool.process_next()) is True
+
+    worker_pool.email_service.send_email.assert_not_called()
+    worker_pool.outbound_repository.mark_failed_async.assert_awaited_once()
+    assert worker_pool.outbound_repository.mark_failed_async.call_args.kwargs["retry"] is False
+
+@patch.object(settings, "SEND_LEASE_TIMEOUT", 0.03)
+def test_process_next_renews_the_lease_during_a_long_send(worker_pool):
+    queue_id = ObjectId()
+    worker_pool.outbound_repository.claim_next_async.return_value = {
+        "_id": queue_id, "request": QUEUED_REQUEST, "attempts": 1, "claim_id": "claim"
+    }
+    worker_pool.outbound_repository.renew_lease_async.return_value = True
+
+    async def slow_send(*args, **kwargs):
+        await asyncio.sleep(0.1)
+
+    worker_pool.email_service.send_email.side_effect = slow_send
+
+    async def run():
+        await worker_pool.process_next()
+        renewals = worker_pool.outbound_repository.renew_lease_async.await_count
+        await asyncio.sleep(0.05)
+        return renewals
+
+    renewals = asyncio.run(run())
+
+    assert renewals >= 2
+    assert worker_pool.outbound_repository.renew_lease_async.await_count == renewals
+    worker_pool.outbound_repository.renew_lease_async.assert_awaited_with(queue_id, "claim")
+    worker_pool.outbound_repository.mark_sent_async.assert_awaited_once_with(queue_id)
+
+def test_workers_drain_queue_after_notify(worker_pool):
+    queue = [{"_id": ObjectId(), "request": QUEUED_REQUEST, "attempts": 1} for _ in range(3)]
+    worker_pool.outbound_repository.claim_next_async.side_effect = lambda: queue.pop(0) if queue else None
+
+    async def run():
+        worker_pool.start()
+        await asyncio.sleep(0.05)
+        await worker_pool.stop()
+
+    asyncio.run(run())
+
+    assert worker_pool.outbound_repository.mark_sent_async.call_count == 3
+
+def test_process_next_resumes_split_email_and_records_progress(worker_pool):
+    queue_id = ObjectId()
+    worker_pool.outbound_repository.claim_next_async.return_value = {
+        "_id": queue_id, "request": QUEUED_REQUEST, "attempts": 2, "parts_sent": 1
+    }
+
+    async def send_email(email_request, parts_sent, on_part_sent):
+        await on_part_sent(parts_sent + 1)
+
+    worker_pool.email_service.send_email = AsyncMock(side_effect=send_email)
+    asyncio.run(worker_pool.process_next())
+
+    assert worker_pool.email_service.send_email.call_args.kwargs["parts_sent"] == 1
+    worker_pool.outbound_repository.mark_parts_sent_async.assert_awaited_once_with(queue_id, 2)